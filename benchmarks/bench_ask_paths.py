@@ -0,0 +1,147 @@
+# Latency and throughput of the /ask paths on a seeded SQLite database:
+#   fast      tracking-number lookup through tracking.PackageLookup, no LLM
+#   template  SQL reused from the per-template cache, no LLM
+#   llm       SQL written by the LLM for every request, then executed
+# On the llm path the openai and azure apps then have the LLM phrase the answer
+# from the rows, a call left out here; template hits are answered from the rows
+# by sql_cache.rows_answer, as they are here.
+# By default the LLM is a stub that sleeps --llm-latency seconds and returns the
+# statement an LLM writes for these questions; --openai calls the real chain.
+#
+#   python benchmarks/bench_ask_paths.py --packages 100000 --threads 8
+#   OPENAI_API_KEY=... python benchmarks/bench_ask_paths.py --openai --requests 20
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import create_engine, insert, text
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'shipsense-openai'))
+
+from models import db, Package, PackageHistory  # noqa: E402
+from tracking import PackageLookup, lookup_tracking_number  # noqa: E402
+from sql_cache import bind_params, clean_sql, parameterize_sql, question_template, rows_answer  # noqa: E402
+
+QUESTIONS = ('Where is package {}?', "What's the ETA of {}", 'status of tracking number {}', '{}')
+STUB_SQL = "SELECT status, eta FROM packages WHERE tracking_number = '{}'"
+
+
+def seed(engine, packages, scans):
+    db.metadata.create_all(engine)
+    rng = random.Random(0)
+    numbers = [f'{794600000000 + i}' for i in range(packages)]
+    with engine.begin() as connection:
+        for start in range(0, packages, 10000):
+            batch = numbers[start:start + 10000]
+            connection.execute(insert(Package.__table__), [
+                {'tracking_number': number, 'dimensions': '10x10x10', 'weight': rng.uniform(0.5, 30),
+                 'status': rng.choice(('In Transit', 'Delivered', 'Out for Delivery'))}
+                for number in batch
+            ])
+            connection.execute(insert(PackageHistory.__table__), [
+                {'tracking_number': number, 'location': rng.choice(('Memphis, TN', 'Newark, NJ', 'Oakland, CA'))}
+                for number in batch for _ in range(scans)
+            ])
+    return numbers
+
+
+def stub_llm(latency):
+    def generate(question):
+        time.sleep(latency)
+        return f"```sql\n{STUB_SQL.format(question_template(question)[1][0])};\n```"
+    return generate
+
+
+def openai_llm(engine):
+    from langchain_community.llms import OpenAI
+    from langchain_community.utilities import SQLDatabase
+    from langchain_experimental.sql import SQLDatabaseChain
+    chain = SQLDatabaseChain(llm=OpenAI(), database=SQLDatabase(engine), return_sql=True)
+    return chain.run
+
+
+def execute(engine, sql, params=None):
+    with engine.connect() as connection:
+        return [dict(row._mapping) for row in connection.execute(text(sql), params or {}).fetchall()]
+
+
+def make_paths(engine, generate_sql):
+    lookup = PackageLookup(engine, Package.__table__, PackageHistory.__table__)
+    templates = {}
+    template_lock = threading.Lock()
+
+    def fast(question):
+        return lookup.find(lookup_tracking_number(question))
+
+    def llm(question):
+        return execute(engine, clean_sql(generate_sql(question)))
+
+    def template(question):
+        key, params = question_template(question)
+        sql = templates.get(key)
+        if sql is None:
+            sql = clean_sql(generate_sql(question))
+            with template_lock:
+                templates[key] = parameterize_sql(sql, params)
+            return execute(engine, sql)
+        rows = execute(engine, sql, bind_params(params))
+        rows_answer(rows)
+        return rows
+
+    return {'fast': fast, 'template': template, 'llm': llm}
+
+
+def run(path, questions, threads):
+    latencies = []
+
+    def timed(question):
+        start = time.perf_counter()
+        path(question)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(timed, questions))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'p50': latencies[len(latencies) // 2] * 1000,
+        'p95': latencies[int(len(latencies) * 0.95)] * 1000,
+        'p99': latencies[int(len(latencies) * 0.99)] * 1000,
+        'throughput': len(latencies) / elapsed
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--packages', type=int, default=20000)
+    parser.add_argument('--scans', type=int, default=4, help='history rows per package')
+    parser.add_argument('--requests', type=int, default=2000, help='requests per path (the llm path runs a tenth)')
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--llm-latency', type=float, default=1.0, help='seconds the stub LLM takes per call')
+    parser.add_argument('--openai', action='store_true', help='generate SQL with the real OpenAI chain')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'packages.db')}")
+        numbers = seed(engine, args.packages, args.scans)
+        generate_sql = openai_llm(engine) if args.openai else stub_llm(args.llm_latency)
+        paths = make_paths(engine, generate_sql)
+
+        rng = random.Random(1)
+        questions = [rng.choice(QUESTIONS).format(rng.choice(numbers)) for _ in range(args.requests)]
+        assert all(lookup_tracking_number(question) for question in questions)
+
+        print(f"{args.packages} packages, {args.threads} threads, "
+              f"LLM {'openai' if args.openai else f'stub {args.llm_latency:.2f}s'}")
+        for name, path in paths.items():
+            sample = questions if name != 'llm' else questions[:max(args.requests // 10, args.threads)]
+            stats = run(path, sample, args.threads)
+            print(f"{name:<9} p50 {stats['p50']:9.2f} ms  p95 {stats['p95']:9.2f} ms  "
+                  f"p99 {stats['p99']:9.2f} ms  {stats['throughput']:9.1f} req/s")
@@ -0,0 +1,113 @@
+# Throughput and latency of a burst of concurrent /search-style calls with and
+# without request coalescing (batching.py):
+#   embedding  each call embeds its query; batched, concurrent queries share one encode call
+#   llm        each call generates an answer; batched, concurrent prompts share one request
+# The stub encoder costs a fixed overhead per call plus a little per query and,
+# like a model on the CPU, runs one call at a time. The stub LLM takes the same
+# time for one prompt or a batch (the server batches on the GPU) and, like a
+# provider rate limit, accepts --llm-slots requests at once. --model embeds with
+# a real SentenceTransformer instead of the stub.
+#
+#   python benchmarks/bench_batching.py --callers 256
+#   python benchmarks/bench_batching.py --model all-MiniLM-L6-v2 --only embedding
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'shipsense-openai'))
+
+from batching import MicroBatcher  # noqa: E402
+
+QUERIES = ('How do I file a claim for a damaged package?', 'What are the weight limits for ground shipping?',
+           'Which items are prohibited from shipping?', 'How long does international delivery take?')
+
+
+class StubEncoder:
+    def __init__(self, overhead, per_item):
+        self.overhead = overhead
+        self.per_item = per_item
+        self.lock = threading.Lock()
+
+    def encode(self, queries):
+        with self.lock:
+            time.sleep(self.overhead + self.per_item * len(queries))
+        return [[float(len(query))] * 4 for query in queries]
+
+
+class StubLLM:
+    def __init__(self, latency, slots):
+        self.latency = latency
+        self.slots = threading.Semaphore(slots)
+
+    def generate(self, prompts):
+        with self.slots:
+            time.sleep(self.latency)
+        return [f"answer to {prompt}" for prompt in prompts]
+
+
+def run(call, callers):
+    latencies = []
+
+    def timed(i):
+        start = time.perf_counter()
+        call(QUERIES[i % len(QUERIES)])
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    # Every caller starts at once, like a burst of requests on a threaded server
+    with ThreadPoolExecutor(max_workers=callers) as pool:
+        list(pool.map(timed, range(callers)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'p50': latencies[len(latencies) // 2] * 1000,
+        'p95': latencies[int(len(latencies) * 0.95)] * 1000,
+        'throughput': callers / elapsed
+    }
+
+
+def report(label, stats, batcher=None):
+    line = f"  {label:<9} p50 {stats['p50']:9.1f} ms  p95 {stats['p95']:9.1f} ms  {stats['throughput']:9.1f} calls/s"
+    if batcher is not None:
+        counters = batcher.stats()
+        line += f"  mean batch {counters['mean_batch_size']:.1f} (max {counters['largest_batch']})"
+    print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--callers', type=int, default=128, help='concurrent calls in the burst')
+    parser.add_argument('--only', choices=('embedding', 'llm'))
+    parser.add_argument('--model', help='SentenceTransformer model to embed with instead of the stub')
+    parser.add_argument('--encode-overhead', type=float, default=0.008, help='stub seconds per encode call')
+    parser.add_argument('--encode-per-item', type=float, default=0.0005, help='stub seconds per query')
+    parser.add_argument('--embedding-batch', type=int, default=64)
+    parser.add_argument('--embedding-window-ms', type=float, default=5)
+    parser.add_argument('--llm-latency', type=float, default=0.5, help='stub seconds per generation request')
+    parser.add_argument('--llm-slots', type=int, default=8, help='generation requests the stub accepts at once')
+    parser.add_argument('--llm-batch', type=int, default=8)
+    parser.add_argument('--llm-window-ms', type=float, default=20)
+    args = parser.parse_args()
+
+    if args.only != 'llm':
+        if args.model:
+            from sentence_transformers import SentenceTransformer
+            encode = SentenceTransformer(args.model).encode
+            encode(list(QUERIES))  # load weights before timing
+        else:
+            encode = StubEncoder(args.encode_overhead, args.encode_per_item).encode
+        print(f"embedding, {args.callers} concurrent queries")
+        report('per-call', run(lambda query: encode([query])[0], args.callers))
+        batcher = MicroBatcher(encode, args.embedding_batch, args.embedding_window_ms, name='embedding')
+        report('batched', run(batcher.submit, args.callers), batcher)
+
+    if args.only != 'embedding':
+        llm = StubLLM(args.llm_latency, args.llm_slots)
+        print(f"llm, {args.callers} concurrent prompts, {args.llm_slots} requests at a time")
+        report('per-call', run(lambda prompt: llm.generate([prompt])[0], args.callers))
+        batcher = MicroBatcher(llm.generate, args.llm_batch, args.llm_window_ms, args.llm_slots, name='llm')
+        report('batched', run(batcher.submit, args.callers), batcher)
@@ -0,0 +1,179 @@
+# Blob ingestion of the Azure indexer (shipsenseai-azure-native/blob_ingest.py)
+# against the old path, up to and including page-window extraction in a
+# process pool:
+#   temp-file  readall() each blob in turn, write it to /tmp and let the
+#              workers open that file (the old behaviour)
+#   streamed   download the next --prefetch blobs while extracting, stream each
+#              into shared memory and let the workers map it by name
+# Blobs come from a filesystem stand-in for a container that adds --latency per
+# blob and reads at --mb-per-s, or from Azurite (or a real account) with
+# --connection-string. Each mode runs in a fresh interpreter so the peak RSS
+# figures do not bleed over.
+#
+#   python benchmarks/bench_blob_ingest.py --blobs 8
+#   python benchmarks/bench_blob_ingest.py --text-only --mb-per-s 20 --latency 0.2
+#   python benchmarks/bench_blob_ingest.py --connection-string UseDevelopmentStorage=true --container shipsense-bench
+import argparse
+import hashlib
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from functools import partial
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'shipsenseai-azure-native'))
+
+from blob_ingest import download_pdf, prefetch  # noqa: E402
+from pdf_extraction import SharedPdf, extract_page_window, iter_pdf_blocks, page_windows  # noqa: E402
+
+DEFAULT_PDF = os.path.join(ROOT, 'shipsenseai-azure-native', 'Service_Guide_2024.pdf')
+READ_SIZE = 4 * 1024 * 1024
+
+
+class FileDownloader:
+    def __init__(self, path, latency, mb_per_s):
+        self.path = path
+        self.size = os.path.getsize(path)
+        self.latency = latency
+        self.mb_per_s = mb_per_s
+
+    def chunks(self):
+        time.sleep(self.latency)
+        with open(self.path, 'rb') as f:
+            for block in iter(lambda: f.read(READ_SIZE), b''):
+                time.sleep(len(block) / (self.mb_per_s * 1e6))
+                yield block
+
+    def readall(self):
+        return b''.join(self.chunks())
+
+
+class FileContainer:
+    # The few ContainerClient calls the indexer makes, over a directory
+    def __init__(self, directory, latency, mb_per_s):
+        self.directory = directory
+        self.latency = latency
+        self.mb_per_s = mb_per_s
+
+    def list_blobs(self):
+        for name in sorted(os.listdir(self.directory)):
+            yield SimpleNamespace(name=name, etag=str(os.stat(os.path.join(self.directory, name)).st_mtime_ns))
+
+    def get_blob_client(self, blob):
+        path = os.path.join(self.directory, blob.name)
+        return SimpleNamespace(download_blob=lambda max_concurrency=1: FileDownloader(path, self.latency,
+                                                                                     self.mb_per_s))
+
+
+def text_window(source):
+    pdf, start, end = source
+    try:
+        return list(iter_pdf_blocks(pdf, start, end))
+    finally:
+        if isinstance(pdf, SharedPdf):
+            pdf.close()
+
+
+def extract_all(pool, extract, jobs):
+    futures = [pool.submit(extract, (pdf, start, end)) for pdf, windows in jobs for start, end in windows]
+    wait(futures)
+    for future in futures:
+        future.result()
+
+
+def temp_file(container, pool, extract, args):
+    written = 0
+    jobs = []
+    temp_dir = tempfile.mkdtemp(prefix='shipsense-ingest-')
+    try:
+        for blob in container.list_blobs():
+            data = container.get_blob_client(blob).download_blob().readall()
+            hashlib.sha256(data).hexdigest()
+            pdf_path = os.path.join(temp_dir, blob.name)
+            with open(pdf_path, 'wb') as f:
+                f.write(data)
+            written += len(data)
+            windows = page_windows(pdf_path, args.page_window)
+            jobs.append((pdf_path, windows))
+            # The old indexer extracted a blob's windows before downloading the next
+            extract_all(pool, extract, jobs[-1:])
+    finally:
+        shutil.rmtree(temp_dir)
+    return written
+
+
+def streamed(container, pool, extract, args):
+    buffers = []
+    try:
+        for blob, download in prefetch(container.list_blobs(), partial(download_pdf, container), args.prefetch):
+            pdf, _ = download.result()
+            buffers.append(pdf)
+            extract_all(pool, extract, [(pdf, page_windows(pdf, args.page_window))])
+    finally:
+        for pdf in buffers:
+            pdf.unlink()
+    return 0
+
+
+MODES = {'temp-file': temp_file, 'streamed': streamed}
+
+
+def open_container(args):
+    if args.connection_string:
+        from azure.storage.blob import BlobServiceClient
+        return BlobServiceClient.from_connection_string(args.connection_string).get_container_client(args.container)
+    directory = os.path.join(tempfile.gettempdir(), 'shipsense-ingest-blobs')
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+        for i in range(args.blobs):
+            shutil.copy(args.pdf, os.path.join(directory, f'guide-{i:03d}.pdf'))
+    return FileContainer(directory, args.latency, args.mb_per_s)
+
+
+def run_mode(mode, args):
+    import multiprocessing
+    container = open_container(args)
+    extract = text_window if args.text_only else extract_page_window
+    pool = ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context('fork'))
+    start = time.perf_counter()
+    try:
+        written = MODES[mode](container, pool, extract, args)
+    finally:
+        pool.shutdown()
+    elapsed = time.perf_counter() - start
+    max_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"{mode:<10} {elapsed:7.2f} s  {written / 1e6:7.1f} MB written to temp files  "
+          f"parent max RSS {max_rss_kb / 1024:7.1f} MiB")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', choices=list(MODES))
+    parser.add_argument('--pdf', default=DEFAULT_PDF, help='copied --blobs times into the stand-in container')
+    parser.add_argument('--blobs', type=int, default=6)
+    parser.add_argument('--latency', type=float, default=0.1, help='stand-in seconds before a download starts')
+    parser.add_argument('--mb-per-s', type=float, default=50.0, help='stand-in download speed')
+    parser.add_argument('--connection-string', help='read from this storage account instead of the stand-in')
+    parser.add_argument('--container', default='shipsense-bench')
+    parser.add_argument('--prefetch', type=int, default=2)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--page-window', type=int, default=8)
+    parser.add_argument('--text-only', action='store_true', help='skip camelot')
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode, args)
+    else:
+        stand_in = os.path.join(tempfile.gettempdir(), 'shipsense-ingest-blobs')
+        shutil.rmtree(stand_in, ignore_errors=True)
+        try:
+            for mode in MODES:
+                subprocess.run([sys.executable, __file__, '--mode', mode] + sys.argv[1:], check=True)
+        finally:
+            shutil.rmtree(stand_in, ignore_errors=True)
@@ -0,0 +1,213 @@
+# Upload stage of the Elasticsearch indexers (bulk_upload.py) against a local
+# stand-in for the _bulk API, compared with the old helpers.bulk call per page
+# window:
+#   healthy    every request takes --latency seconds plus --mb-per-s for its body
+#   throttled  --reject-rate of the items in a request are rejected with 429, as
+#              a busy cluster does when its write queue is full
+#   saturated  the stand-in handles --slots requests at once and rejects every
+#              item of any request beyond that
+# Each run reports throughput, requests, bytes sent, retries and how many of the
+# chunks ended up stored; the old path loses the windows with a rejected item.
+#
+#   python benchmarks/bench_bulk_upload.py --windows 200 --chunks 40
+#   python benchmarks/bench_bulk_upload.py --only uploader --concurrency 8 --max-bytes 2000000
+#   python benchmarks/bench_bulk_upload.py --serve --port 9201   # stand-in only, for ES_PORT=9201
+import argparse
+import gzip
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'shipsense-openai'))
+
+from bulk_upload import BulkUploader, elasticsearch_bulk, elasticsearch_lines  # noqa: E402
+from vector_encoding import vector_payload  # noqa: E402
+
+DIMENSIONS = 384  # all-MiniLM-L6-v2
+
+
+class StubBulk(BaseHTTPRequestHandler):
+    # Enough of Elasticsearch for the indexers: _bulk, index settings and refresh
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        if not self.path.split('?')[0].endswith('/_bulk'):
+            return self.reply(200, {'_shards': {'total': 1, 'successful': 1, 'failed': 0}})
+        self.reply(200, self.server.bulk(body))
+
+    def do_PUT(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.reply(200, {'acknowledged': True})
+
+    def do_GET(self):
+        self.reply(200, {'pdf_index': {'settings': {}}})
+
+    def do_HEAD(self):
+        self.reply(200, {})
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        # The 8.x client refuses to talk to anything else
+        self.send_header('X-Elastic-Product', 'Elasticsearch')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, port, latency, mb_per_s, slots, reject_rate):
+        super().__init__(('127.0.0.1', port), StubBulk)
+        self.latency = latency
+        self.mb_per_s = mb_per_s
+        self.slots = threading.BoundedSemaphore(slots)
+        self.reject_rate = reject_rate
+        self.lock = threading.Lock()
+        self.documents = {}
+
+    def bulk(self, body):
+        lines = body.decode('utf-8').splitlines()
+        operations = []
+        while lines:
+            metadata = json.loads(lines.pop(0))
+            (op_type, target), = metadata.items()
+            operations.append((op_type, target['_id'], None if op_type == 'delete' else lines.pop(0)))
+        busy = not self.slots.acquire(blocking=False)
+        try:
+            time.sleep(self.latency + len(body) / (self.mb_per_s * 1e6))
+            items = []
+            with self.lock:
+                for op_type, doc_id, source in operations:
+                    if busy or random.random() < self.reject_rate:
+                        error = {'type': 'es_rejected_execution_exception', 'reason': 'write queue is full'}
+                        items.append({op_type: {'_id': doc_id, 'status': 429, 'error': error}})
+                    elif op_type == 'delete':
+                        found = self.documents.pop(doc_id, None) is not None
+                        items.append({op_type: {'_id': doc_id, 'status': 200 if found else 404}})
+                    else:
+                        self.documents[doc_id] = source
+                        items.append({op_type: {'_id': doc_id, 'status': 201}})
+        finally:
+            if not busy:
+                self.slots.release()
+        return {'took': 1, 'errors': any(item[next(iter(item))]['status'] >= 300 for item in items),
+                'items': items}
+
+
+def make_windows(windows, chunks, compact):
+    rng = np.random.default_rng(0)
+    result = []
+    for window in range(windows):
+        actions = []
+        for chunk in range(chunks):
+            embedding = rng.standard_normal(DIMENSIONS).astype(np.float32)
+            embedding /= np.linalg.norm(embedding)
+            actions.append({'_index': 'pdf_index', '_id': f'guide.pdf_{window:05d}_{chunk:03d}', '_source': {
+                'pdf_filename': 'guide.pdf', 'page': window, 'heading': 'Ground shipping',
+                'content': 'Packages up to 150 lbs ship with FedEx Ground. ' * 12,
+                'embedding': vector_payload(embedding) if compact else embedding.tolist()
+            }})
+        result.append(actions)
+    return result
+
+
+def run_helpers(es, windows):
+    # The old upload stage: one helpers.bulk call per page window, in order
+    from elasticsearch.helpers import bulk, BulkIndexError
+    failed_windows = 0
+    for actions in windows:
+        try:
+            bulk(es, actions, ignore_status=(404,))
+        except BulkIndexError:
+            failed_windows += 1
+    return {'failed_windows': failed_windows}
+
+
+def run_uploader(es, windows, args):
+    uploader = BulkUploader(elasticsearch_bulk(es), name='stand-in', max_bytes=args.max_bytes,
+                            concurrency=args.concurrency, backoff=args.backoff)
+    failed_windows = []
+    for actions in windows:
+        uploader.add([elasticsearch_lines(action) for action in actions],
+                     lambda errors: errors and failed_windows.append(errors))
+    uploader.close()
+    return {**uploader.stats(), 'failed_windows': len(failed_windows)}
+
+
+def bench(label, run, server, windows):
+    server.documents.clear()
+    start = time.perf_counter()
+    stats = run(windows)
+    elapsed = time.perf_counter() - start
+    total = sum(len(actions) for actions in windows)
+    line = (f"  {label:<9} {elapsed:7.2f} s  {total / elapsed:9.1f} chunks/s  stored {len(server.documents)}/{total}"
+            f"  failed windows {stats['failed_windows']}")
+    if 'requests' in stats:
+        line += (f"  {stats['requests']} requests, {stats['bytes'] / 1e6:.1f} MB, {stats['retried']} retried, "
+                 f"final request size {stats['target_bytes'] / 1e6:.2f} MB")
+    print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--windows', type=int, default=100, help='page windows uploaded')
+    parser.add_argument('--chunks', type=int, default=40, help='chunks per window')
+    parser.add_argument('--only', choices=('helpers', 'uploader'))
+    parser.add_argument('--scenario', action='append', choices=('healthy', 'throttled', 'saturated'))
+    parser.add_argument('--latency', type=float, default=0.02, help='stand-in seconds per request')
+    parser.add_argument('--mb-per-s', type=float, default=20.0, help='stand-in ingest speed per request')
+    parser.add_argument('--slots', type=int, default=2, help='requests the saturated stand-in takes at once')
+    parser.add_argument('--reject-rate', type=float, default=0.05, help='items rejected when throttled')
+    parser.add_argument('--max-bytes', type=int, default=5 * 1024 * 1024)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--backoff', type=float, default=0.05, help='first retry delay in seconds')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--serve', action='store_true', help='only run the stand-in, healthy')
+    args = parser.parse_args()
+
+    if args.serve:
+        print(f"Elasticsearch stand-in on http://127.0.0.1:{args.port}")
+        StubServer(args.port, args.latency, args.mb_per_s, 1000, 0.0).serve_forever()
+
+    from elasticsearch import Elasticsearch
+
+    plain = make_windows(args.windows, args.chunks, compact=False)
+    compact = make_windows(args.windows, args.chunks, compact=True)
+    body_bytes = [sum(len(elasticsearch_lines(action)) for actions in windows for action in actions)
+                  for windows in (plain, compact)]
+    print(f"{args.windows} windows of {args.chunks} chunks, {body_bytes[0] / 1e6:.1f} MB of _bulk body "
+          f"({body_bytes[1] / 1e6:.1f} MB with compact vectors)")
+
+    scenarios = {'healthy': (1000, 0.0), 'throttled': (1000, args.reject_rate), 'saturated': (args.slots, 0.0)}
+    for scenario in args.scenario or scenarios:
+        slots, reject_rate = scenarios[scenario]
+        server = StubServer(args.port, args.latency, args.mb_per_s, slots, reject_rate)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{server.server_address[1]}'
+        print(scenario)
+        if args.only != 'uploader':
+            es = Elasticsearch(url, request_timeout=120)
+            bench('helpers', lambda windows: run_helpers(es, windows), server, plain)
+        if args.only != 'helpers':
+            # As index_pdfs.py configures it
+            es = Elasticsearch(url, http_compress=True, request_timeout=120)
+            bench('uploader', lambda windows: run_uploader(es, windows, args), server, compact)
+        server.shutdown()
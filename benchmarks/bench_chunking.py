@@ -0,0 +1,77 @@
+# Compare the old one-document-per-line splitter against the chunker: number of
+# indexed documents, index payload size and ingest time on the bundled Service Guide.
+#
+#   python benchmarks/bench_chunking.py            # chunking only
+#   python benchmarks/bench_chunking.py --embed    # also time embedding every document
+import argparse
+import json
+import os
+import sys
+import time
+from functools import partial
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'shipsense-openai'))
+
+from chunking import chunk_pages, token_counter, CHUNK_TOKENS, CHUNK_OVERLAP  # noqa: E402
+from pdf_extraction import iter_pdf_blocks, iter_pdf_paragraphs, page_windows  # noqa: E402
+
+DEFAULT_PDF = os.path.join(ROOT, 'shipsenseai-azure-native', 'Service_Guide_2024.pdf')
+
+# all-MiniLM-L6-v2 vectors serialized as a JSON float list
+EMBEDDING_JSON_BYTES = len(json.dumps([-0.012345678901234567] * 384))
+
+
+def line_splitter(pdf_path):
+    return [paragraph for _, paragraph in iter_pdf_paragraphs(pdf_path)]
+
+
+def chunker(pdf_path, count_tokens=None):
+    # Chunk page window by page window, as the indexers do
+    texts = []
+    heading = None
+    for start, end in page_windows(pdf_path):
+        chunks, heading = chunk_pages(list(iter_pdf_blocks(pdf_path, start, end)), heading=heading,
+                                     count_tokens=count_tokens)
+        texts.extend(chunk.text for chunk in chunks)
+    return texts
+
+
+def report(label, texts, elapsed, embed_seconds):
+    content_bytes = sum(len(text.encode('utf-8')) for text in texts)
+    payload_mib = (content_bytes + len(texts) * EMBEDDING_JSON_BYTES) / 2**20
+    line = (f"{label:<14} {len(texts):>8} docs  avg {content_bytes / max(len(texts), 1):7.0f} B  "
+            f"payload {payload_mib:8.1f} MiB  split {elapsed:6.2f}s")
+    if embed_seconds is not None:
+        line += f"  embed {embed_seconds:7.1f}s"
+    print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pdf', default=DEFAULT_PDF)
+    parser.add_argument('--embed', action='store_true', help='time embedding with all-MiniLM-L6-v2')
+    args = parser.parse_args()
+
+    model = None
+    count_tokens = None
+    unit = 'words'
+    if args.embed:
+        from sentence_transformers import SentenceTransformer
+        from embedding import encode_batched
+        model = SentenceTransformer('all-MiniLM-L6-v2')
+        # Size chunks in word pieces, as the indexers do
+        count_tokens = token_counter(model.tokenizer)
+        unit = 'word pieces'
+
+    print(f"{os.path.basename(args.pdf)}, chunker window {CHUNK_TOKENS} {unit}, overlap {CHUNK_OVERLAP}")
+    for label, split in (('line splitter', line_splitter), ('chunker', partial(chunker, count_tokens=count_tokens))):
+        start = time.perf_counter()
+        texts = split(args.pdf)
+        elapsed = time.perf_counter() - start
+        embed_seconds = None
+        if model is not None:
+            start = time.perf_counter()
+            encode_batched(model, texts)
+            embed_seconds = time.perf_counter() - start
+        report(label, texts, elapsed, embed_seconds)
@@ -0,0 +1,505 @@
+# End-to-end benchmark of the ShipSense apps against local stand-ins, so a
+# change can be measured, and a regression caught, without OpenAI, Hugging Face,
+# Elasticsearch, Azure or MySQL:
+#   LLM        a stub server speaking the OpenAI completions API and the Hugging
+#              Face (text-generation-inference) API; --llm-latency per call,
+#              --token-latency between streamed tokens. SQL prompts get SQL back,
+#              every other prompt a fixed answer.
+#   database   SQLite seeded with --packages packages, or --database-url
+#   search     the local vector index (RETRIEVAL_BACKEND=local), built by each
+#              variant's indexer from the bundled Service Guide PDFs
+# Per variant it times the indexer (a full build, then an incremental run with
+# nothing to do), boots the app (`flask run`, or async_app.py with --server
+# async) and replays the recorded query mix (query_mix.jsonl) against /search
+# and /ask with --clients concurrent clients.
+#
+#   python benchmarks/bench_e2e.py
+#   python benchmarks/bench_e2e.py --variant shipsense-openai --server async --clients 32 --requests 800
+#   python benchmarks/bench_e2e.py --save baseline.json
+#   python benchmarks/bench_e2e.py --compare baseline.json --tolerance 0.15   # exit status 1 on a regression
+#
+# The apps load the real embedding model, so the variant's requirements must be
+# installed. index_pdfs_function.py reads from Blob Storage: with
+# --blob-connection-string UseDevelopmentStorage=true it runs against Azurite,
+# otherwise the azure app serves an index built by shipsense-openai's indexer.
+# --database-url must point at a database seeded with add_test_data.py; it is
+# only read from.
+import argparse
+import importlib.util
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from sqlalchemy import create_engine, insert
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'shipsense-openai'))
+
+from vector_store import LocalVectorIndex  # noqa: E402
+
+VARIANTS = ('shipsense-openai', 'shipsense-llama-on-hf', 'shipsenseai-azure-native')
+INDEXERS = {'shipsense-openai': 'index_pdfs.py', 'shipsense-llama-on-hf': 'index_pdfs.py',
+            'shipsenseai-azure-native': 'index_pdfs_function.py'}
+DEFAULT_MIX = os.path.join(ROOT, 'benchmarks', 'query_mix.jsonl')
+DEFAULT_PDFS = (os.path.join(ROOT, 'shipsenseai-azure-native', 'Service_Guide_2024.pdf'),
+                os.path.join(ROOT, 'shipsense-openai', 'knowledgebase', 'Service_Guide_2024-pages-2.pdf'))
+BLOB_CONTAINER = 'shipsense-bench'
+
+ANSWER = ('Based on the Service Guide, packages up to 150 lbs ship with FedEx Ground and heavier ones as '
+          'FedEx Freight. Declared values above $100 need additional coverage, and a claim must be filed '
+          'within 60 days of delivery.')
+TRACKING_NUMBER = re.compile(r'\b\d{12}\b')
+# LangChain's SQLDatabaseChain prompt ends in "SQLQuery:", the llama app's in "SQL Query:"
+SQL_PROMPT = re.compile(r'SQL ?Query:\s*$')
+
+
+def completion_text(prompt):
+    if not SQL_PROMPT.search(prompt):
+        return ANSWER
+    question = re.findall(r'Question:\s*(.*)', prompt)[-1]
+    match = TRACKING_NUMBER.search(question)
+    if match:
+        return f"SELECT status, eta FROM packages WHERE tracking_number = '{match.group()}'"
+    if 'transit' in question.lower():
+        return "SELECT COUNT(*) AS in_transit FROM packages WHERE status = 'In Transit'"
+    if 'heav' in question.lower():
+        return "SELECT tracking_number, weight FROM packages WHERE weight > 20 ORDER BY weight DESC LIMIT 20"
+    return "SELECT status, COUNT(*) AS packages FROM packages GROUP BY status"
+
+
+class StubLLM(BaseHTTPRequestHandler):
+    # POST /v1/completions answers like OpenAI, any other POST like a Hugging Face endpoint
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True  # otherwise delayed ACKs add ~40 ms to every keep-alive call
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        self.server.count()
+        time.sleep(self.server.latency)
+        if self.path.rstrip('/').endswith('/completions'):
+            self.openai(body)
+        else:
+            self.huggingface(body)
+
+    def openai(self, body):
+        prompts = body['prompt'] if isinstance(body['prompt'], list) else [body['prompt']]
+        completion = {'id': 'cmpl-stub', 'object': 'text_completion', 'created': int(time.time()),
+                      'model': body.get('model', 'stub')}
+        if body.get('stream'):
+            def event(token):
+                choice = {'text': token, 'index': 0, 'logprobs': None, 'finish_reason': None}
+                return 'data: ' + json.dumps({**completion, 'choices': [choice]})
+            return self.stream(completion_text(prompts[0]), event, 'data: [DONE]')
+        choices = [{'text': completion_text(prompt), 'index': i, 'logprobs': None, 'finish_reason': 'stop'}
+                   for i, prompt in enumerate(prompts)]
+        usage = {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}
+        self.reply({**completion, 'choices': choices, 'usage': usage})
+
+    def huggingface(self, body):
+        inputs = body.get('inputs', '')
+        if body.get('stream'):
+            return self.stream(completion_text(inputs),
+                               lambda token: 'data:' + json.dumps({'token': {'text': token, 'special': False}}))
+        if isinstance(inputs, list):
+            # HF_BATCH_GENERATION: one result list per input, like the text-generation pipeline
+            return self.reply([[{'generated_text': completion_text(prompt)}] for prompt in inputs])
+        self.reply([{'generated_text': completion_text(inputs)}])
+
+    def reply(self, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def stream(self, text, event, last=None):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        for i, word in enumerate(text.split(' ')):
+            if i:
+                time.sleep(self.server.token_latency)
+            self.wfile.write(f"{event(word if i == 0 else ' ' + word)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+        if last is not None:
+            self.wfile.write(f"{last}\n\n".encode('utf-8'))
+        self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, latency, token_latency):
+        super().__init__(('127.0.0.1', 0), StubLLM)
+        self.latency = latency
+        self.token_latency = token_latency
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def count(self):
+        with self.lock:
+            self.calls += 1
+
+
+def load_tables(variant):
+    # Each variant declares its own tables (the azure ones are named Packages and PackageHistory)
+    spec = importlib.util.spec_from_file_location(f"{variant.replace('-', '_')}_models",
+                                                  os.path.join(ROOT, variant, 'models.py'))
+    models = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(models)
+    return models.Package.__table__, models.PackageHistory.__table__
+
+
+def seed(database_url, variant, packages, scans):
+    package_table, history_table = load_tables(variant)
+    engine = create_engine(database_url)
+    package_table.metadata.create_all(engine)
+    rng = random.Random(0)
+    with engine.begin() as connection:
+        for start in range(0, packages, 10000):
+            numbers = [f'{794600000000 + i}' for i in range(start, min(start + 10000, packages))]
+            connection.execute(insert(package_table), [
+                {'tracking_number': number, 'dimensions': '10x10x10', 'weight': round(rng.uniform(0.5, 30), 2),
+                 'status': rng.choice(('In Transit', 'Delivered', 'Out for Delivery')),
+                 'eta': date(2024, 7, 1) + timedelta(days=rng.randrange(30))}
+                for number in numbers
+            ])
+            connection.execute(insert(history_table), [
+                {'tracking_number': number, 'location': rng.choice(('Memphis, TN', 'Newark, NJ', 'Oakland, CA'))}
+                for number in numbers for _ in range(scans)
+            ])
+    engine.dispose()
+
+
+def base_env(args, llm_url, index_path):
+    env = dict(os.environ)
+    env.update({
+        'RETRIEVAL_BACKEND': 'local',
+        'LOCAL_INDEX_PATH': index_path,
+        'OPENAI_API_KEY': 'stub',
+        # LangChain reads the first, the openai client the second
+        'OPENAI_API_BASE': f'{llm_url}/v1',
+        'OPENAI_BASE_URL': f'{llm_url}/v1',
+        'HF_ENDPOINT': llm_url,
+        'HF_TOKEN': 'stub',
+        # The azure app builds its search clients at import, never calling them with a local index
+        'SEARCH_SERVICE_ENDPOINT': 'https://search.invalid',
+        'SEARCH_SERVICE_API_KEY': 'stub',
+        'SEARCH_INDEX_NAME': 'pdf_index'
+    })
+    if args.no_cache:
+        env.update({'ANSWER_CACHE_TTL': '0', 'SQL_CACHE_TTL': '0'})
+    for setting in args.env:
+        name, _, value = setting.partition('=')
+        env[name] = value
+    return env
+
+
+def run_logged(command, cwd, env, log_path):
+    start = time.perf_counter()
+    with open(log_path, 'a') as log:
+        result = subprocess.run(command, cwd=cwd, env=env, stdout=log, stderr=subprocess.STDOUT)
+    if result.returncode != 0:
+        raise RuntimeError(f"{' '.join(command)} failed with exit status {result.returncode}, see {log_path}")
+    return time.perf_counter() - start
+
+
+def upload_to_azurite(connection_string, pdfs):
+    from azure.storage.blob import BlobServiceClient
+    container = BlobServiceClient.from_connection_string(connection_string).get_container_client(BLOB_CONTAINER)
+    if not container.exists():
+        container.create_container()
+    for path in pdfs:
+        with open(path, 'rb') as f:
+            container.upload_blob(os.path.basename(path), f, overwrite=True)
+
+
+def bench_indexer(variant, args, env, pdf_dir, pages, log_path):
+    indexer_variant, source = variant, pdf_dir
+    if variant == 'shipsenseai-azure-native':
+        if args.blob_connection_string:
+            env = {**env, 'BLOB_CONNECTION_STRING': args.blob_connection_string}
+            source = BLOB_CONTAINER
+        else:
+            indexer_variant = 'shipsense-openai'
+    command = [sys.executable, INDEXERS[indexer_variant], source, '--workers', str(args.index_workers)]
+    cwd = os.path.join(ROOT, indexer_variant)
+    full = run_logged(command + ['--full'], cwd, env, log_path)
+    incremental = run_logged(command, cwd, env, log_path)
+    return {
+        'indexer': f'{indexer_variant}/{INDEXERS[indexer_variant]}',
+        'full_s': full,
+        'incremental_s': incremental,
+        'chunks': len(LocalVectorIndex(env['LOCAL_INDEX_PATH'])),
+        'pages_per_s': pages / full
+    }
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_app(variant, args, env, log_path):
+    port = free_port()
+    if args.server == 'async':
+        command = [sys.executable, 'async_app.py']
+        env = {**env, 'ASYNC_HOST': '127.0.0.1', 'ASYNC_PORT': str(port)}
+    else:
+        command = [sys.executable, '-m', 'flask', '--app', 'app', 'run', '--host', '127.0.0.1', '--port', str(port),
+                   '--no-reload', '--no-debugger']
+    start = time.perf_counter()
+    log = open(log_path, 'a')
+    process = subprocess.Popen(command, cwd=os.path.join(ROOT, variant), env=env, stdout=log,
+                               stderr=subprocess.STDOUT)
+    log.close()
+    url = f'http://127.0.0.1:{port}'
+    while True:
+        if process.poll() is not None:
+            raise RuntimeError(f"{variant} exited while starting, see {log_path}")
+        try:
+            if requests.get(f'{url}/metrics', timeout=1).status_code == 200:
+                return process, url, time.perf_counter() - start
+        except requests.RequestException:
+            pass
+        if time.perf_counter() - start > args.boot_timeout:
+            stop_app(process)
+            raise RuntimeError(f"{variant} did not answer within {args.boot_timeout:.0f}s, see {log_path}")
+        time.sleep(0.5)
+
+
+def stop_app(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def load_mix(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def send(session, url, entry, stream, timeout):
+    # Returns (seconds, seconds to the first token or None, ok)
+    body = {'query': entry['query']}
+    streamed = stream and entry['endpoint'] == '/search'
+    if streamed:
+        body['stream'] = True
+    start = time.perf_counter()
+    with session.post(url + entry['endpoint'], json=body, stream=streamed, timeout=timeout) as response:
+        if not streamed:
+            response.content
+            return time.perf_counter() - start, None, response.status_code < 400
+        first_token, ok = None, response.status_code < 400
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith('data:') and first_token is None:
+                first_token = time.perf_counter() - start
+            elif line == 'event: error':
+                ok = False
+        return time.perf_counter() - start, first_token, ok
+
+
+def replay(url, mix, clients, count, stream, timeout):
+    latencies = {endpoint: [] for endpoint in sorted({entry['endpoint'] for entry in mix})}
+    first_tokens, errors = [], {endpoint: 0 for endpoint in latencies}
+    lock = threading.Lock()
+    issued = [0]
+
+    def client():
+        # Clients take the next entry of the recorded mix, in order, until count were sent
+        session = requests.Session()
+        while True:
+            with lock:
+                if issued[0] >= count:
+                    return
+                entry = mix[issued[0] % len(mix)]
+                issued[0] += 1
+            try:
+                seconds, first_token, ok = send(session, url, entry, stream, timeout)
+            except requests.RequestException:
+                seconds, first_token, ok = None, None, False
+            with lock:
+                if not ok:
+                    errors[entry['endpoint']] += 1
+                    continue
+                latencies[entry['endpoint']].append(seconds)
+                if first_token is not None:
+                    first_tokens.append(first_token)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        for _ in range(clients):
+            pool.submit(client)
+    elapsed = time.perf_counter() - start
+    results = {endpoint: summarize(values, errors[endpoint], elapsed) for endpoint, values in latencies.items()}
+    if first_tokens:
+        results['/search first token'] = summarize(first_tokens, 0, elapsed)
+    return results, count / elapsed
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+
+    def percentile(q):
+        return latencies[min(int(len(latencies) * q), len(latencies) - 1)] * 1000 if latencies else float('nan')
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'p50': percentile(0.5),
+        'p95': percentile(0.95),
+        'p99': percentile(0.99),
+        'throughput': len(latencies) / elapsed
+    }
+
+
+def bench_variant(variant, args, workdir, llm, mix, pdf_dir, pages):
+    log_path = os.path.join(workdir, f'{variant}.log')
+    index_path = os.path.join(workdir, variant, 'local_index')
+    env = base_env(args, f'http://127.0.0.1:{llm.server_address[1]}', index_path)
+    database_url = args.database_url
+    if database_url is None:
+        database_url = f"sqlite:///{os.path.join(workdir, variant, 'packages.db')}"
+        seed(database_url, variant, args.packages, args.scans)
+    env['DATABASE_URL'] = database_url
+
+    results = {'index': bench_indexer(variant, args, env, pdf_dir, pages, log_path)}
+    index = results['index']
+    print(f"  index     full {index['full_s']:7.1f} s ({index['pages_per_s']:.1f} pages/s, {index['chunks']} chunks)  "
+          f"incremental {index['incremental_s']:6.1f} s  [{index['indexer']}]")
+
+    process, url, results['boot_s'] = start_app(variant, args, env, log_path)
+    try:
+        print(f"  boot      {results['boot_s']:7.1f} s  ({args.server})")
+        replay(url, mix, min(args.clients, args.warmup) or 1, args.warmup, args.stream, args.timeout)
+        llm_calls = llm.calls
+        results['endpoints'], results['throughput'] = replay(url, mix, args.clients, args.requests, args.stream,
+                                                             args.timeout)
+        results['llm_calls'] = llm.calls - llm_calls
+    finally:
+        stop_app(process)
+    for endpoint, stats in results['endpoints'].items():
+        print(f"  {endpoint:<9} p50 {stats['p50']:8.1f} ms  p95 {stats['p95']:8.1f} ms  p99 {stats['p99']:8.1f} ms  "
+              f"{stats['throughput']:7.1f} req/s  {stats['errors']} errors")
+    print(f"  total     {results['throughput']:7.1f} req/s, "
+          f"{results['llm_calls']} LLM calls for {args.requests} requests")
+    return results
+
+
+def compare(results, baseline, tolerance):
+    # Higher p95s and lower throughputs or indexing speeds than the baseline by more than tolerance
+    regressions = []
+    for variant, current in results.items():
+        previous = baseline.get(variant)
+        if previous is None:
+            continue
+        checks = [('index full_s', previous['index']['full_s'], current['index']['full_s'], True),
+                  ('throughput', previous['throughput'], current['throughput'], False)]
+        for endpoint, stats in current['endpoints'].items():
+            if endpoint in previous['endpoints']:
+                checks.append((f'{endpoint} p95', previous['endpoints'][endpoint]['p95'], stats['p95'], True))
+        for name, before, after, lower_is_better in checks:
+            change = (after - before) / before if before else 0.0
+            worse = change > tolerance if lower_is_better else change < -tolerance
+            print(f"  {variant} {name:<24} {before:10.1f} -> {after:10.1f}  {change * 100:+6.1f}%"
+                  f"{'  REGRESSION' if worse else ''}")
+            if worse:
+                regressions.append(f'{variant} {name}')
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--variant', action='append', choices=VARIANTS, help='benchmark only these variants')
+    parser.add_argument('--server', choices=('flask', 'async'), default='flask', help='app.py or async_app.py')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='recorded queries, one JSON object per line')
+    parser.add_argument('--requests', type=int, default=400, help='requests replayed per variant')
+    parser.add_argument('--clients', type=int, default=16, help='concurrent clients')
+    parser.add_argument('--warmup', type=int, default=16, help='requests sent before measuring')
+    parser.add_argument('--stream', action='store_true', help='ask for streamed /search answers')
+    parser.add_argument('--no-cache', action='store_true', help='turn the answer and SQL caches off')
+    parser.add_argument('--llm-latency', type=float, default=0.5, help='stub seconds per LLM call')
+    parser.add_argument('--token-latency', type=float, default=0.02, help='stub seconds between streamed tokens')
+    parser.add_argument('--packages', type=int, default=10000, help='packages seeded into SQLite')
+    parser.add_argument('--scans', type=int, default=4, help='history rows per package')
+    parser.add_argument('--database-url', help='an already seeded database to use instead of SQLite')
+    parser.add_argument('--pdf', action='append', help='PDFs to index (default: the bundled Service Guides)')
+    parser.add_argument('--index-workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--blob-connection-string', help='Azurite, to run the azure indexer')
+    parser.add_argument('--env', action='append', default=[], metavar='NAME=VALUE', help='extra app setting')
+    parser.add_argument('--boot-timeout', type=float, default=300.0)
+    parser.add_argument('--timeout', type=float, default=120.0, help='per-request timeout in seconds')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='results of an earlier --save to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative slowdown')
+    parser.add_argument('--keep', action='store_true', help='keep the working directory with logs and indexes')
+    args = parser.parse_args()
+
+    import fitz  # PyMuPDF
+
+    mix = load_mix(args.mix)
+    pdfs = args.pdf or DEFAULT_PDFS
+    workdir = tempfile.mkdtemp(prefix='shipsense-bench-')
+    pdf_dir = os.path.join(workdir, 'pdfs')
+    os.makedirs(pdf_dir)
+    for path in pdfs:
+        shutil.copy(path, pdf_dir)
+    pages = 0
+    for path in pdfs:
+        with fitz.open(path) as document:
+            pages += document.page_count
+    if args.blob_connection_string:
+        upload_to_azurite(args.blob_connection_string, pdfs)
+
+    llm = StubServer(args.llm_latency, args.token_latency)
+    threading.Thread(target=llm.serve_forever, daemon=True).start()
+    print(f"{len(pdfs)} PDFs ({pages} pages), {len(mix)} recorded queries, {args.requests} requests from "
+          f"{args.clients} clients, LLM {args.llm_latency * 1000:.0f} ms per call")
+    results = {}
+    try:
+        for variant in args.variant or VARIANTS:
+            os.makedirs(os.path.join(workdir, variant))
+            print(variant)
+            try:
+                results[variant] = bench_variant(variant, args, workdir, llm, mix, pdf_dir, pages)
+            except RuntimeError as e:
+                print(f"  failed: {e}")
+                args.keep = True  # for the logs
+    finally:
+        llm.shutdown()
+        if args.keep:
+            print(f"Logs and indexes are in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"compared with {args.compare}")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regressions: {', '.join(regressions)}")
+            sys.exit(1)
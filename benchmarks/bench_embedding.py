@@ -0,0 +1,52 @@
+# Compare paragraphs/sec of the old one-encode()-per-paragraph loop against
+# batched embedding on the bundled Service Guide.
+#
+#   python benchmarks/bench_embedding.py --batch-sizes 16 32 64 128
+import argparse
+import os
+import sys
+import time
+
+import fitz  # PyMuPDF
+from sentence_transformers import SentenceTransformer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'shipsense-openai'))
+
+from embedding import encode_batched  # noqa: E402
+
+DEFAULT_PDF = os.path.join(ROOT, 'shipsenseai-azure-native', 'Service_Guide_2024.pdf')
+
+
+def load_paragraphs(pdf_path, limit):
+    doc = fitz.open(pdf_path)
+    paragraphs = []
+    for page in doc:
+        paragraphs.extend(line for line in page.get_text().split('\n') if line.strip())
+        if limit and len(paragraphs) >= limit:
+            break
+    return paragraphs[:limit] if limit else paragraphs
+
+
+def bench(label, fn, paragraphs):
+    start = time.perf_counter()
+    fn(paragraphs)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<24} {len(paragraphs) / elapsed:>10.1f} paragraphs/sec ({elapsed:.2f}s)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pdf', default=DEFAULT_PDF)
+    parser.add_argument('--limit', type=int, default=5000, help='max paragraphs to embed (0 = all)')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[16, 32, 64, 128])
+    args = parser.parse_args()
+
+    model = SentenceTransformer('all-MiniLM-L6-v2')
+    paragraphs = load_paragraphs(args.pdf, args.limit)
+    print(f"Embedding {len(paragraphs)} paragraphs from {os.path.basename(args.pdf)}")
+
+    model.encode(paragraphs[:32])  # warm up
+    bench('per-call loop', lambda texts: [model.encode(text) for text in texts], paragraphs)
+    for batch_size in args.batch_sizes:
+        bench(f'batched ({batch_size})', lambda texts: encode_batched(model, texts, batch_size), paragraphs)
@@ -0,0 +1,59 @@
+# Compare peak memory of whole-document extraction (text += page.get_text(),
+# then split('\n')) against the streaming page API on the bundled Service Guide.
+# Each mode runs in a fresh interpreter so peak RSS figures do not bleed over.
+#
+#   python benchmarks/bench_extraction_memory.py
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'shipsense-openai'))
+
+DEFAULT_PDF = os.path.join(ROOT, 'shipsenseai-azure-native', 'Service_Guide_2024.pdf')
+
+
+def whole_document(pdf_path):
+    import fitz  # PyMuPDF
+    doc = fitz.open(pdf_path)
+    text = ""
+    for page_num in range(doc.page_count):
+        page = doc.load_page(page_num)
+        text += page.get_text()
+    return sum(1 for paragraph in text.split('\n') if paragraph.strip())
+
+
+def streaming(pdf_path):
+    from pdf_extraction import iter_pdf_paragraphs
+    return sum(1 for _ in iter_pdf_paragraphs(pdf_path))
+
+
+MODES = {'whole-document': whole_document, 'streaming': streaming}
+
+
+def run_mode(mode, pdf_path):
+    tracemalloc.start()
+    start = time.perf_counter()
+    paragraphs = MODES[mode](pdf_path)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    max_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"{mode:<16} {paragraphs:>8} paragraphs  {elapsed:6.2f}s  "
+          f"python peak {peak / 2**20:7.1f} MiB  max RSS {max_rss_kb / 1024:7.1f} MiB")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pdf', default=DEFAULT_PDF)
+    parser.add_argument('--mode', choices=list(MODES))
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode, args.pdf)
+    else:
+        for mode in MODES:
+            subprocess.run([sys.executable, __file__, '--pdf', args.pdf, '--mode', mode], check=True)
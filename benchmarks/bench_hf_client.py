@@ -0,0 +1,194 @@
+# Exercises the Hugging Face inference client (shipsense-llama-on-hf/hf_client.py)
+# against a local stub of the endpoint that can be slow, flaky, rate limited or
+# down, and compares it with the old one-requests.post-per-call approach:
+#   healthy    every call answers after --latency seconds
+#   flaky      --error-rate of calls answer 503
+#   throttled  --error-rate of calls answer 429 with Retry-After: 0
+#   slow-tail  --tail-rate of calls take --tail-latency seconds (hedging helps here)
+#   outage     every call answers 503 (the circuit breaker fails fast)
+#
+#   python benchmarks/bench_hf_client.py --requests 400 --threads 16
+#   python benchmarks/bench_hf_client.py --serve --port 8081   # stub only, for HF_ENDPOINT=http://localhost:8081
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'shipsense-llama-on-hf'))
+
+from hf_client import CircuitBreaker, InferenceClient, InferenceError  # noqa: E402
+
+ANSWER = 'Packages over 70 kg ship as freight.'
+
+
+class StubEndpoint(BaseHTTPRequestHandler):
+    # Answers like a text-generation-inference endpoint; behaviour comes from server.scenario
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True  # otherwise delayed ACKs add ~40 ms to every keep-alive call
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        scenario = self.server.scenario
+        rng = random.random()
+        if scenario['error_rate'] and rng < scenario['error_rate']:
+            time.sleep(scenario['latency'] / 10)
+            return self.reply(scenario['error_status'], {'error': 'Model is overloaded'}, {'Retry-After': '0'})
+        if scenario['tail_rate'] and rng > 1 - scenario['tail_rate']:
+            time.sleep(scenario['tail_latency'])
+        else:
+            time.sleep(scenario['latency'])
+        if payload.get('stream'):
+            return self.stream()
+        self.reply(200, [{'generated_text': ANSWER}])
+
+    def reply(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def stream(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        for word in ANSWER.split(' '):
+            event = {'token': {'text': word + ' ', 'special': False}}
+            self.wfile.write(f"data:{json.dumps(event)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+        self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # the naive client opens a connection per call
+
+
+def start_stub(scenario, port=0):
+    server = StubServer(('127.0.0.1', port), StubEndpoint)
+    server.scenario = scenario
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def scenario_settings(name, args):
+    settings = {'latency': args.latency, 'error_rate': 0.0, 'error_status': 503, 'tail_rate': 0.0,
+                'tail_latency': args.tail_latency}
+    if name == 'flaky':
+        settings['error_rate'] = args.error_rate
+    elif name == 'throttled':
+        settings.update(error_rate=args.error_rate, error_status=429)
+    elif name == 'slow-tail':
+        settings['tail_rate'] = args.tail_rate
+    elif name == 'outage':
+        settings['error_rate'] = 1.0
+    return settings
+
+
+def naive_call(endpoint):
+    # What app.py did before hf_client.py: a new connection per call, no retries
+    def call(headers, payload):
+        response = requests.post(endpoint, headers=headers, json=payload)
+        if response.status_code != 200:
+            raise InferenceError(f"Hugging Face returned {response.status_code}", response.status_code)
+        return response.json()
+    return call
+
+
+def run(call, requests_count, threads):
+    latencies, failures = [], []
+    headers = {'Content-Type': 'application/json'}
+
+    def timed(i):
+        start = time.perf_counter()
+        try:
+            call(headers, {'inputs': f'question {i}', 'parameters': {'max_length': 512}})
+        except (InferenceError, requests.RequestException) as e:
+            failures.append(e)
+            return
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(timed, range(requests_count)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+
+    def percentile(q):
+        return latencies[min(int(len(latencies) * q), len(latencies) - 1)] * 1000 if latencies else float('nan')
+    return {
+        'ok': len(latencies) / requests_count * 100,
+        'p50': percentile(0.5),
+        'p95': percentile(0.95),
+        'p99': percentile(0.99),
+        'elapsed': elapsed
+    }
+
+
+def check_stream(endpoint):
+    client = InferenceClient(endpoint)
+    lines = [line for line in client.stream({}, {'inputs': 'q', 'stream': True}) if line]
+    client.close()
+    tokens = ''.join(json.loads(line[len('data:'):])['token']['text'] for line in lines)
+    assert tokens.strip() == ANSWER, tokens
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=200, help='calls per client and scenario')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds the stub takes per generation')
+    parser.add_argument('--error-rate', type=float, default=0.2, help='share of failing calls (flaky, throttled)')
+    parser.add_argument('--tail-rate', type=float, default=0.05, help='share of slow calls (slow-tail)')
+    parser.add_argument('--tail-latency', type=float, default=1.0, help='seconds a slow call takes')
+    parser.add_argument('--hedge-after', type=float, default=0.15, help='hedge delay for the hedged client')
+    parser.add_argument('--scenario', action='append', help='run only these scenarios')
+    parser.add_argument('--serve', action='store_true', help='only run the stub endpoint')
+    parser.add_argument('--port', type=int, default=8081)
+    args = parser.parse_args()
+
+    if args.serve:
+        name = (args.scenario or ['healthy'])[0]
+        start_stub(scenario_settings(name, args), args.port)
+        print(f"Stub endpoint on http://127.0.0.1:{args.port} ({name})")
+        threading.Event().wait()
+
+    stub = start_stub(scenario_settings('healthy', args))
+    endpoint = f"http://127.0.0.1:{stub.server_address[1]}"
+    check_stream(endpoint)
+
+    print(f"{args.requests} calls per client, {args.threads} threads, stub latency {args.latency * 1000:.0f} ms")
+    for name in args.scenario or ['healthy', 'flaky', 'throttled', 'slow-tail', 'outage']:
+        stub.scenario = scenario_settings(name, args)
+        print(name)
+        clients = {
+            'naive': None,
+            'client': InferenceClient(endpoint, breaker=CircuitBreaker(), hedge_after=0),
+            'hedged': InferenceClient(endpoint, breaker=CircuitBreaker(), hedge_after=args.hedge_after)
+        }
+        for label, client in clients.items():
+            call = naive_call(endpoint) if client is None else client.generate
+            stats = run(call, args.requests, args.threads)
+            print(f"  {label:<7} ok {stats['ok']:5.1f}%  p50 {stats['p50']:8.1f} ms  p95 {stats['p95']:8.1f} ms  "
+                  f"p99 {stats['p99']:8.1f} ms  total {stats['elapsed']:6.2f} s")
+            if client is not None:
+                counters = client.stats()
+                print(f"          retries {counters['retries']}  hedges {counters['hedges']} "
+                      f"(won {counters['hedge_wins']})  rejected {counters['rejected']}  "
+                      f"circuit opened {counters['circuit']['opens']}x")
+                client.close()
@@ -0,0 +1,119 @@
+# Query cache of the apps (cache.QueryCache) on the recorded query mix. --workers
+# processes, like gunicorn workers, each answer --requests /search queries drawn
+# from query_mix.jsonl with a Zipf-like skew, embedding each with --embed-ms of
+# work and searching with --search-ms, as get_top_documents does on a miss:
+#   none     no cache, every query is embedded and searched
+#   memory   the per-process LRU only, so each worker warms up on its own
+#   shared   the LRU in front of a SQLite file all workers share (QUERY_CACHE_PATH)
+# Halfway through, the indexer "bumps" the index generation, so cached result ids
+# must be dropped while embeddings stay. Reports the mean time per query and
+# where the embeddings and results came from.
+#
+#   python benchmarks/bench_query_cache.py
+#   python benchmarks/bench_query_cache.py --workers 8 --requests 2000 --search-ms 40
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'shipsense-openai'))
+
+from cache import QueryCache  # noqa: E402
+
+QUERY_MIX = os.path.join(ROOT, 'benchmarks', 'query_mix.jsonl')
+
+
+def load_queries():
+    with open(QUERY_MIX) as f:
+        return [entry['query'] for entry in map(json.loads, f) if entry['endpoint'] == '/search']
+
+
+def worker(mode, args, cache_path, generation_path, seed, results):
+    queries = load_queries()
+    rng = random.Random(seed)
+    # Rank r is drawn with weight 1 / r, so a few questions make up most of the traffic
+    weights = [1 / rank for rank in range(1, len(queries) + 1)]
+
+    def generation():
+        with open(generation_path) as f:
+            return int(f.read())
+
+    cache = None
+    if mode != 'none':
+        cache = QueryCache(path=cache_path if mode == 'shared' else None, version_fn=generation, version_interval=0)
+    embedded = searched = 0
+    start = time.perf_counter()
+    for i in range(args.requests):
+        query = rng.choices(queries, weights)[0]
+        ids = cache.results(query, 'knn:5') if cache is not None else None
+        if ids is None:
+            vector = cache.embedding(query) if cache is not None else None
+            if vector is None:
+                time.sleep(args.embed_ms / 1000)
+                vector = np.full(384, len(query), dtype=np.float32)
+                embedded += 1
+                if cache is not None:
+                    cache.put_embedding(query, vector)
+            time.sleep(args.search_ms / 1000)
+            searched += 1
+            if cache is not None:
+                cache.put_results(query, 'knn:5', [f'doc-{len(query)}-{rank}' for rank in range(5)])
+        else:
+            time.sleep(args.fetch_ms / 1000)
+        if seed == 0 and i == args.requests // 2:
+            with open(generation_path, 'w') as f:
+                f.write('2')
+    results.put((time.perf_counter() - start, embedded, searched, cache.stats() if cache is not None else None))
+
+
+def run(mode, args, workdir):
+    cache_path = os.path.join(workdir, f'{mode}.db')
+    generation_path = os.path.join(workdir, f'{mode}.generation')
+    with open(generation_path, 'w') as f:
+        f.write('1')
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    processes = [context.Process(target=worker, args=(mode, args, cache_path, generation_path, seed, results))
+                 for seed in range(args.workers)]
+    for process in processes:
+        process.start()
+    outcomes = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    total = args.workers * args.requests
+    seconds = sum(outcome[0] for outcome in outcomes)
+    embedded = sum(outcome[1] for outcome in outcomes)
+    searched = sum(outcome[2] for outcome in outcomes)
+    line = (f"  {mode:<7} {seconds / total * 1000:7.2f} ms/query  embedded {embedded:6d}  searched {searched:6d}"
+            f"  of {total}")
+    stats = [outcome[3] for outcome in outcomes if outcome[3] is not None]
+    if stats:
+        line += (f"  memory hits {sum(s['hits'] for s in stats):6d}  store hits {sum(s['store_hits'] for s in stats):6d}"
+                 f"  invalidations {sum(s['invalidations'] for s in stats)}")
+    print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=500, help='queries per worker')
+    parser.add_argument('--embed-ms', type=float, default=15.0, help='stand-in time to embed a query')
+    parser.add_argument('--search-ms', type=float, default=25.0, help='stand-in time of a kNN / hybrid search')
+    parser.add_argument('--fetch-ms', type=float, default=3.0, help='stand-in time to read cached ids back')
+    args = parser.parse_args()
+
+    print(f"{len(load_queries())} distinct queries, {args.workers} workers x {args.requests} requests")
+    workdir = tempfile.mkdtemp(prefix='shipsense-query-cache-')
+    try:
+        for mode in ('none', 'memory', 'shared'):
+            run(mode, args, workdir)
+    finally:
+        shutil.rmtree(workdir)
@@ -0,0 +1,163 @@
+# Cold start of the ShipSense apps: how long a new process takes to answer,
+# to report ready and to serve its first requests. Per variant it
+#   imports    times importing the heavy libraries on their own (torch through
+#              sentence_transformers, LangChain), each in a fresh interpreter
+#   warm-up    boots the app with WARM_UP=true and times /metrics answering
+#              (serving), /ready turning 200 and the first /search and /ask
+#   no warm-up boots it with WARM_UP=false, so the first requests load the
+#              model and LangChain themselves
+# The LLM and database are bench_e2e.py's stub server and a small SQLite
+# database, and the app searches a tiny local index of random vectors, so the
+# numbers are the app's own start-up cost.
+#
+#   python benchmarks/bench_startup.py
+#   python benchmarks/bench_startup.py --variant shipsense-openai --server async --runs 3
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_e2e import VARIANTS, StubServer, base_env, seed, start_app, stop_app  # noqa: E402
+from vector_store import LocalIndexWriter  # noqa: E402
+
+HEAVY_IMPORTS = ('sentence_transformers', 'langchain', 'langchain_experimental.sql')
+FIRST_REQUESTS = (('/search', 'What are the weight limits for ground shipping?'),
+                  ('/ask', 'How many packages are in transit?'))
+DIMENSIONS = 384  # all-MiniLM-L6-v2
+
+
+def time_import(module):
+    code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def write_index(path, chunks=64):
+    rng = np.random.default_rng(0)
+    writer = LocalIndexWriter(path)
+    for i in range(chunks):
+        writer.add(f'bench-{i}', f'Service Guide section {i}: ground packages up to 150 lbs.', 'bench.pdf', i,
+                   rng.standard_normal(DIMENSIONS).astype(np.float32))
+    writer.save()
+
+
+def wait_ready(url, timeout):
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        try:
+            if requests.get(f'{url}/ready', timeout=1).status_code == 200:
+                return time.perf_counter() - start
+        except requests.RequestException:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"{url}/ready did not turn 200 within {timeout:.0f}s")
+
+
+def first_requests(url, timeout):
+    latencies = {}
+    for endpoint, query in FIRST_REQUESTS:
+        start = time.perf_counter()
+        response = requests.post(url + endpoint, json={'query': query}, timeout=timeout)
+        latencies[endpoint] = time.perf_counter() - start
+        if response.status_code >= 400:
+            print(f"    {endpoint} answered {response.status_code}: {response.text[:200]}")
+    return latencies
+
+
+def boot(variant, args, env, log_path, warm_up):
+    env = {**env, 'WARM_UP': 'true' if warm_up else 'false'}
+    process, url, serving_s = start_app(variant, args, env, log_path)
+    try:
+        # Without the warm-up /ready is 200 at once
+        ready_s = serving_s + wait_ready(url, args.boot_timeout)
+        return {'serving_s': serving_s, 'ready_s': ready_s, 'first': first_requests(url, args.timeout)}
+    finally:
+        stop_app(process)
+
+
+def median_run(runs):
+    return {
+        'serving_s': statistics.median(run['serving_s'] for run in runs),
+        'ready_s': statistics.median(run['ready_s'] for run in runs),
+        'first': {endpoint: statistics.median(run['first'][endpoint] for run in runs) for endpoint, _ in
+                  FIRST_REQUESTS}
+    }
+
+
+def bench_variant(variant, args, workdir, llm):
+    os.makedirs(os.path.join(workdir, variant))
+    log_path = os.path.join(workdir, f'{variant}.log')
+    index_path = os.path.join(workdir, variant, 'local_index')
+    write_index(index_path)
+    env = base_env(args, f'http://127.0.0.1:{llm.server_address[1]}', index_path)
+    env['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, variant, 'packages.db')}"
+    seed(env['DATABASE_URL'], variant, args.packages, 2)
+
+    results = {}
+    for label, warm_up in (('warm-up', True), ('no warm-up', False)):
+        result = median_run([boot(variant, args, env, log_path, warm_up) for _ in range(args.runs)])
+        results[label] = result
+        first = '  '.join(f"{endpoint} {seconds * 1000:8.1f} ms" for endpoint, seconds in result['first'].items())
+        print(f"  {label:<11} serving {result['serving_s']:6.2f} s  ready {result['ready_s']:6.2f} s  "
+              f"first {first}")
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--variant', action='append', choices=VARIANTS, help='benchmark only these variants')
+    parser.add_argument('--server', choices=('flask', 'async'), default='flask', help='app.py or async_app.py')
+    parser.add_argument('--runs', type=int, default=1, help='boots per mode; the median is reported')
+    parser.add_argument('--packages', type=int, default=1000, help='packages seeded into SQLite')
+    parser.add_argument('--llm-latency', type=float, default=0.05, help='stub seconds per LLM call')
+    parser.add_argument('--env', action='append', default=[], metavar='NAME=VALUE', help='extra app setting')
+    parser.add_argument('--boot-timeout', type=float, default=300.0)
+    parser.add_argument('--timeout', type=float, default=300.0, help='per-request timeout in seconds')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--keep', action='store_true', help='keep the working directory with logs')
+    args = parser.parse_args()
+    # base_env() reads this; the first requests should reach the model and the LLM
+    args.no_cache = True
+
+    results = {'imports': {}}
+    print('imports')
+    for module in HEAVY_IMPORTS:
+        seconds = time_import(module)
+        results['imports'][module] = seconds
+        print(f"  {module:<28} {'not installed' if seconds is None else f'{seconds:6.2f} s'}")
+
+    llm = StubServer(args.llm_latency, 0.0)
+    threading.Thread(target=llm.serve_forever, daemon=True).start()
+    workdir = tempfile.mkdtemp(prefix='shipsense-startup-')
+    failed = False
+    try:
+        for variant in args.variant or VARIANTS:
+            print(variant)
+            try:
+                results[variant] = bench_variant(variant, args, workdir, llm)
+            except Exception as e:
+                failed = True
+                print(f"  failed: {e}")
+    finally:
+        llm.shutdown()
+        if args.keep or failed:
+            print(f"logs in {workdir}")
+        else:
+            shutil.rmtree(workdir)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
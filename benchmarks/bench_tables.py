@@ -0,0 +1,92 @@
+# Table extraction of the Azure indexer (shipsenseai-azure-native/pdf_extraction.py)
+# on the bundled Service Guide, page window by page window in a process pool as
+# the indexer runs it:
+#   all-pages  camelot on every page of each window (the old behaviour)
+#   cold       only pages with ruling lines go to camelot; empty table cache
+#   warm       the same again, everything comes from the table cache
+# It also compares the chunks the tables become: one JSON blob per table against
+# header-led row groups, and how many exceed what all-MiniLM-L6-v2 reads (256
+# word pieces, about CHUNK_TOKENS words).
+#
+#   python benchmarks/bench_tables.py
+#   python benchmarks/bench_tables.py --pdf other.pdf --workers 8 --page-window 4
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'shipsenseai-azure-native'))
+
+import camelot  # noqa: E402
+from chunking import CHUNK_TOKENS, chunk_table  # noqa: E402
+from pdf_extraction import TableCache, extract_tables_from_pdf, has_table_rules, page_windows  # noqa: E402
+
+DEFAULT_PDF = os.path.join(ROOT, 'shipsenseai-azure-native', 'Service_Guide_2024.pdf')
+
+
+def all_pages(source):
+    pdf_path, start, end, _ = source
+    return [(int(table.page), table.df.values.tolist())
+            for table in camelot.read_pdf(pdf_path, pages=f"{start + 1}-{end}")]
+
+
+def candidates_only(source):
+    pdf_path, start, end, cache_dir = source
+    return extract_tables_from_pdf(pdf_path, start, end, TableCache(cache_dir))
+
+
+def run(fn, pdf_path, windows, workers, cache_dir):
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(fn, [(pdf_path, first, last, cache_dir) for first, last in windows]))
+    return time.perf_counter() - start, [table for tables in results for table in tables]
+
+
+def chunk_report(label, texts):
+    words = sorted(len(text.split()) for text in texts)
+    if not words:
+        print(f"  {label:<12} no chunks")
+        return
+    over = sum(count > CHUNK_TOKENS for count in words)
+    print(f"  {label:<12} {len(words):6d} chunks  median {words[len(words) // 2]:6d} words  "
+          f"max {words[-1]:6d}  {over} over {CHUNK_TOKENS} words")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pdf', default=DEFAULT_PDF)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--page-window', type=int, default=8)
+    parser.add_argument('--skip-all-pages', action='store_true', help='skip the slow old behaviour')
+    args = parser.parse_args()
+
+    import fitz  # PyMuPDF
+
+    windows = page_windows(args.pdf, args.page_window)
+    start = time.perf_counter()
+    with fitz.open(args.pdf) as document:
+        candidates = sum(has_table_rules(page) for page in document)
+        pages = document.page_count
+    print(f"{args.pdf}: {pages} pages, {candidates} with ruling lines "
+          f"(found in {time.perf_counter() - start:.2f}s), {args.workers} workers")
+
+    cache_dir = tempfile.mkdtemp(prefix='shipsense-tables-')
+    try:
+        if not args.skip_all_pages:
+            elapsed, old_tables = run(all_pages, args.pdf, windows, args.workers, cache_dir)
+            print(f"  all-pages  {elapsed:8.2f} s  {len(old_tables)} tables")
+        elapsed, tables = run(candidates_only, args.pdf, windows, args.workers, cache_dir)
+        print(f"  cold       {elapsed:8.2f} s  {len(tables)} tables")
+        elapsed, warm_tables = run(candidates_only, args.pdf, windows, args.workers, cache_dir)
+        print(f"  warm       {elapsed:8.2f} s  {len(warm_tables)} tables")
+    finally:
+        shutil.rmtree(cache_dir)
+
+    print('chunks')
+    chunk_report('json blobs', [json.dumps(rows) for _, rows in tables])
+    chunk_report('row groups', [chunk.text for page, rows in tables for chunk in chunk_table(rows, page)])
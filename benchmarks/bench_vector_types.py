@@ -0,0 +1,105 @@
+# Recall each INDEX_VECTOR_TYPE (vector_encoding.py) costs against the space it
+# saves, on the bundled Service Guide. Every chunk the indexers would make is
+# embedded with all-MiniLM-L6-v2 and encoded as each type, queries are encoded the
+# way the apps send them, and both are compared by exact search, so the figures
+# show what the encoding loses and not what an HNSW graph approximates on top.
+#   recall@k  share of the float32 top k that the type also ranks in its top k
+#   index     vector bytes stored per chunk and for the whole guide (Elasticsearch
+#             keeps float16 as float32 on disk, Azure stores Edm.Half)
+#   payload   JSON bytes per vector in the bulk / index_documents bodies
+# Queries are the /search questions of query_mix.jsonl plus the first
+# --query-words words of --sampled-queries random chunks.
+#
+#   python benchmarks/bench_vector_types.py
+#   python benchmarks/bench_vector_types.py --k 1 10 20 --sampled-queries 500
+import argparse
+import json
+import os
+import random
+import sys
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'shipsense-openai'))
+
+from chunking import chunk_pages  # noqa: E402
+from pdf_extraction import iter_pdf_blocks, page_windows  # noqa: E402
+from vector_encoding import INDEX_VECTOR_TYPES, vector_payload  # noqa: E402
+
+DEFAULT_PDF = os.path.join(ROOT, 'shipsenseai-azure-native', 'Service_Guide_2024.pdf')
+QUERY_MIX = os.path.join(ROOT, 'benchmarks', 'query_mix.jsonl')
+DIMENSION_BYTES = {'float32': 4, 'float16': 2, 'int8': 1, 'binary': 1 / 8}
+
+
+def load_chunks(pdf_path):
+    # Chunk page window by page window, as the indexers do
+    texts = []
+    heading = None
+    for start, end in page_windows(pdf_path):
+        chunks, heading = chunk_pages(list(iter_pdf_blocks(pdf_path, start, end)), heading=heading)
+        texts.extend(chunk.text for chunk in chunks)
+    return texts
+
+
+def load_queries(chunks, sampled, words, seed=0):
+    with open(QUERY_MIX) as f:
+        queries = [entry['query'] for entry in map(json.loads, f) if entry['endpoint'] == '/search']
+    rng = random.Random(seed)
+    for text in rng.sample(chunks, min(sampled, len(chunks))):
+        queries.append(' '.join(text.split()[:words]))
+    return queries
+
+
+def decode(payloads, vector_type):
+    # The stored vectors as rows that rank by dot product the way the index ranks them
+    if vector_type == 'binary':
+        # For +-1 vectors the dot product is dims - 2 * Hamming distance
+        bits = np.unpackbits(np.frombuffer(b''.join(bytes.fromhex(payload) for payload in payloads), np.uint8))
+        return bits.reshape(len(payloads), -1).astype(np.float32) * 2 - 1
+    vectors = np.asarray(payloads, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def top_k(queries, documents, k):
+    scores = queries @ documents.T
+    best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return [set(row) for row in best]
+
+
+def recall(exact, found):
+    return float(np.mean([len(truth & got) / len(truth) for truth, got in zip(exact, found)]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pdf', default=DEFAULT_PDF)
+    parser.add_argument('--k', type=int, nargs='+', default=[1, 5, 10])
+    parser.add_argument('--sampled-queries', type=int, default=200, help='chunk openings used as extra queries')
+    parser.add_argument('--query-words', type=int, default=12)
+    args = parser.parse_args()
+
+    from sentence_transformers import SentenceTransformer
+    from embedding import encode_batched
+
+    model = SentenceTransformer('all-MiniLM-L6-v2')
+    chunks = load_chunks(args.pdf)
+    queries = load_queries(chunks, args.sampled_queries, args.query_words)
+    chunk_vectors = np.asarray(encode_batched(model, chunks), dtype=np.float32)
+    query_vectors = np.asarray(encode_batched(model, queries), dtype=np.float32)
+    dims = chunk_vectors.shape[1]
+    ks = [k for k in args.k if k <= len(chunks)]
+    print(f"{os.path.basename(args.pdf)}: {len(chunks)} chunks, {len(queries)} queries, {dims} dimensions")
+
+    exact = {k: top_k(decode(query_vectors, 'float32'), decode(chunk_vectors, 'float32'), k) for k in ks}
+    print(f"  {'type':<8} " + ' '.join(f"{f'recall@{k}':>10}" for k in ks)
+          + f" {'index B/vec':>12} {'index MiB':>10} {'payload B/vec':>14}")
+    for vector_type in INDEX_VECTOR_TYPES:
+        documents = [vector_payload(vector, vector_type) for vector in chunk_vectors]
+        stored = decode(documents, vector_type)
+        encoded = decode([vector_payload(vector, vector_type) for vector in query_vectors], vector_type)
+        recalls = ' '.join(f"{recall(exact[k], top_k(encoded, stored, k)):>10.3f}" for k in ks)
+        vector_bytes = dims * DIMENSION_BYTES[vector_type]
+        payload_bytes = np.mean([len(json.dumps(document)) for document in documents])
+        print(f"  {vector_type:<8} {recalls} {vector_bytes:>12.0f} {vector_bytes * len(chunks) / 2**20:>10.2f} "
+              f"{payload_bytes:>14.0f}")
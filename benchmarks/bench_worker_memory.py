@@ -0,0 +1,95 @@
+# Measure per-worker memory of the local vector index when N worker processes
+# open it, comparing the memory-mapped store against loading a private copy.
+# PSS splits shared pages between the processes mapping them, so with mmap it
+# falls as workers are added while private memory stays near zero. Linux only
+# (reads /proc/<pid>/smaps_rollup).
+#
+#   python benchmarks/bench_worker_memory.py --workers 4
+#   python benchmarks/bench_worker_memory.py --index shipsense-openai/local_index
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'shipsense-openai'))
+
+from vector_store import LocalIndexWriter, LocalVectorIndex, dequantize  # noqa: E402
+
+
+def memory_kib():
+    fields = {}
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1])
+    return fields
+
+
+def build_synthetic_index(path, rows, dtype):
+    rng = np.random.default_rng(0)
+    writer = LocalIndexWriter(path)
+    text = 'FedEx Ground Automated Pickup weekly fee applies to on-call pickups. ' * 12
+    for i, vector in enumerate(rng.normal(size=(rows, 384)).astype(np.float32)):
+        writer.add(f'chunk_{i}', f'{i} {text}', f'guide_{i % 4}.pdf', i % 900 + 1, vector)
+    writer.save(dtype=dtype)
+
+
+def worker(path, mode, ready, results, release):
+    index = LocalVectorIndex(path)
+    before = memory_kib()
+    if mode == 'copy':
+        # What a per-worker in-RAM store costs: its own matrix and decoded texts
+        vectors = dequantize(index.vectors, index.scales)
+        texts = [index.text(row) for row in range(len(index))]
+        vectors.sum(), len(texts)
+    else:
+        # Touch every page of the mapped store, as a scan of the whole index would
+        np.asarray(index.vectors, dtype=np.float32).sum()
+        sum(len(index.text(row)) for row in range(len(index)))
+    ready.set()
+    release.wait()  # Measure once every worker holds its pages, so PSS reflects the sharing
+    after = memory_kib()
+    results.put({key: after[key] - before[key] for key in ('Rss', 'Pss', 'Private_Clean', 'Private_Dirty')})
+
+
+def measure(path, mode, workers):
+    ctx = multiprocessing.get_context('fork')
+    results = ctx.Queue()
+    release = ctx.Event()
+    readies = [ctx.Event() for _ in range(workers)]
+    processes = [ctx.Process(target=worker, args=(path, mode, ready, results, release)) for ready in readies]
+    for process in processes:
+        process.start()
+    for ready in readies:
+        ready.wait()
+    release.set()
+    samples = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return {key: sum(sample[key] for sample in samples) / len(samples) for key in samples[0]}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--index', help='existing local index directory (default: build a synthetic one)')
+    parser.add_argument('--rows', type=int, default=200000, help='rows in the synthetic index')
+    parser.add_argument('--dtype', default='float16', help='vector dtype of the synthetic index')
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.index
+        if path is None:
+            path = os.path.join(tmp, 'local_index')
+            build_synthetic_index(path, args.rows, args.dtype)
+        index = LocalVectorIndex(path)
+        print(f"{len(index)} rows, {index.dtype} vectors, {args.workers} workers, growth per worker in MiB")
+        for mode in ('mmap', 'copy'):
+            memory = measure(path, mode, args.workers)
+            print(f"{mode:<5} rss {memory['Rss'] / 1024:8.1f}  pss {memory['Pss'] / 1024:8.1f}  "
+                  f"private {(memory['Private_Clean'] + memory['Private_Dirty']) / 1024:8.1f}")
@@ -0,0 +1,77 @@
+# Closed-loop load test against running ShipSense servers: at each concurrency
+# level, that many clients post to the endpoint back to back. Point it at the
+# Flask server (app.py, port 5000) and the asyncio server (async_app.py, port
+# 8080) of the same variant to compare how many requests one process keeps in
+# flight.
+#
+#   python benchmarks/load_test.py --url http://localhost:5000 --url http://localhost:8080
+#   python benchmarks/load_test.py --url http://localhost:8080 --endpoint /ask --concurrency 1,16,64,256
+import argparse
+import asyncio
+import itertools
+import time
+
+import aiohttp
+
+QUERIES = {
+    '/search': ('How do I file a claim for a damaged package?', 'What are the weight limits for ground shipping?',
+                'Which items are prohibited from shipping?', 'How long does international delivery take?'),
+    '/ask': ('Where is package 794600000001?', 'How many packages are in transit?',
+             'What is the status of tracking number 794600000042?', 'List packages heavier than 20 kg')
+}
+
+
+async def client(session, url, queries, deadline, latencies, errors):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            async with session.post(url, json={'query': next(queries)}) as response:
+                await response.read()
+                if response.status >= 500:
+                    errors.append(response.status)
+                    continue
+        except aiohttp.ClientError as e:
+            errors.append(type(e).__name__)
+            continue
+        latencies.append(time.perf_counter() - start)
+
+
+async def run_level(url, endpoint, concurrency, duration, timeout):
+    latencies, errors = [], []
+    queries = itertools.cycle(QUERIES[endpoint])
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        start = time.perf_counter()
+        deadline = start + duration
+        await asyncio.gather(*(client(session, url + endpoint, queries, deadline, latencies, errors)
+                               for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    latencies.sort()
+    if not latencies:
+        return {'p50': float('nan'), 'p95': float('nan'), 'throughput': 0.0, 'errors': len(errors)}
+    return {
+        'p50': latencies[len(latencies) // 2] * 1000,
+        'p95': latencies[int(len(latencies) * 0.95)] * 1000,
+        'throughput': len(latencies) / elapsed,
+        'errors': len(errors)
+    }
+
+
+async def main(args):
+    levels = [int(level) for level in args.concurrency.split(',')]
+    for url in args.url:
+        print(f"{url}{args.endpoint}, {args.duration:.0f}s per level")
+        for concurrency in levels:
+            stats = await run_level(url, args.endpoint, concurrency, args.duration, args.timeout)
+            print(f"  {concurrency:>4} clients  p50 {stats['p50']:9.1f} ms  p95 {stats['p95']:9.1f} ms  "
+                  f"{stats['throughput']:8.1f} req/s  {stats['errors']} errors")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', action='append', required=True, help='server base URL; repeat to compare servers')
+    parser.add_argument('--endpoint', choices=sorted(QUERIES), default='/search')
+    parser.add_argument('--concurrency', default='1,8,32,128', help='comma-separated client counts')
+    parser.add_argument('--duration', type=float, default=20.0, help='seconds per concurrency level')
+    parser.add_argument('--timeout', type=float, default=120.0, help='per-request timeout in seconds')
+    asyncio.run(main(parser.parse_args()))
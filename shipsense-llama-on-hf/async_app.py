@@ -0,0 +1,298 @@
+import time
+import asyncio
+import logging
+from functools import partial
+from aiohttp import web
+from elasticsearch import AsyncElasticsearch
+from sqlalchemy.exc import SQLAlchemyError
+
+# asyncio serving mode with the same routes as app.py. Handlers await the Hugging
+# Face endpoint and Elasticsearch instead of blocking a thread on them, so one
+# process holds many requests in flight; SQL and query embeddings run in a
+# bounded thread pool.
+#
+#   python async_app.py        # listens on ASYNC_PORT (8080)
+#
+# Models, caches, the pooled engine and the request helpers come from app.py.
+import app as sync_app
+from app import (answer_cache, sql_cache, query_cache, package_lookup, local_index, readiness, engine, hf_endpoint,
+                 HF_ERROR_ANSWER, bm25_request, knn_request, mget_request, search_hits, found_hits, search_prompt,
+                 sql_prompt, hf_request, hf_generated_text, hf_stream_token, encode_queries, execute_sql_query)
+from retrieval import RETRIEVAL_MODE, HYBRID_CANDIDATES, reciprocal_rank_fusion
+from vector_store import normalize
+from vector_encoding import vector_payload
+from cache import ANSWER_CACHE_SIMILARITY
+from sql_cache import bind_params, clean_sql, parameterize_sql, question_template, rows_answer
+from tracking import lookup_answer, lookup_tracking_number
+from db import pool_stats
+from metrics import SEARCH_DURATION, render_metrics
+from async_hf_client import AsyncInferenceClient
+from hf_client import HF_BATCH_GENERATION, InferenceError
+from batching import (EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_WINDOW_MS, LLM_BATCH_SIZE, LLM_BATCH_WINDOW_MS,
+                      AsyncMicroBatcher)
+from tracing import span, traced_async_tokens
+from async_serving import (ASYNC_HOST, ASYNC_PORT, UPSTREAM_LIMITS, Upstreams, request_wants_stream, single_token,
+                           sse_stream, tracing_middleware)
+
+routes = web.RouteTableDef()
+# Flask's encoder, so dates and decimals in /ask rows serialize as they do in app.py
+dumps = sync_app.app.json.dumps
+
+# Function to embed a batch of queries off the event loop
+async def encode_batch(app, queries):
+    return await app['upstreams'].run_sync('embedding', encode_queries, queries)
+
+# Function to embed a query, together with any others that arrive within the batching window;
+# cache hits are answered on the loop, only a read of the shared SQLite file goes to a thread
+async def embed(request, query):
+    upstreams = request.app['upstreams']
+    with span('embedding'):
+        vector = await upstreams.cached(query_cache.embedding, query)
+        if vector is None:
+            vector = await request.app['embedder'].submit(query)
+            await upstreams.cached(query_cache.put_embedding, query, vector)
+        return vector
+
+# Function to run one Elasticsearch query within the search concurrency limit
+async def es_search(request, search_request):
+    async with request.app['upstreams'].limit('search'):
+        return search_hits(await request.app['es'].search(**search_request))
+
+# Function to read cached result ids back as (id, content) pairs
+async def fetch_documents(request, ids):
+    if not ids:
+        return []
+    async with request.app['upstreams'].limit('search'):
+        return found_hits(await request.app['es'].mget(**mget_request(ids)))
+
+# Function to get top documents from Elasticsearch using BM25, kNN or both (RETRIEVAL_MODE)
+async def get_top_documents(request, query, top_n=5):
+    logging.info(f"Fetching top documents for query: {query} ({RETRIEVAL_MODE})")
+    upstreams = request.app['upstreams']
+    try:
+        # A repeated query reads the chunks it found last time by id, until the indexer bumps the
+        # generation; the local index searches in memory, so only its query embedding is cached
+        scope = f"{RETRIEVAL_MODE}:{top_n}"
+        ids = await upstreams.cached(query_cache.results, query, scope) if local_index is None else None
+        if ids is not None:
+            with span('retrieval'):
+                results = await fetch_documents(request, ids)
+        elif local_index is not None:
+            # The local index holds vectors only, so it always answers with kNN
+            query_vector = await embed(request, query)
+            with span('retrieval'):
+                matches = await upstreams.run_sync('search', local_index.search, query_vector, top_n)
+            results = [(chunk['id'], chunk['content']) for chunk, _ in matches]
+        elif RETRIEVAL_MODE == 'bm25':
+            with span('retrieval'):
+                results = await es_search(request, bm25_request(query, top_n))
+        else:
+            # Embed the query once, encoded like the indexed vectors (INDEX_VECTOR_TYPE), for the kNN leg
+            query_vector = vector_payload(await embed(request, query))
+            with span('retrieval'):
+                if RETRIEVAL_MODE == 'knn':
+                    results = await es_search(request, knn_request(query_vector, top_n))
+                else:
+                    # Both legs of a hybrid query run at the same time
+                    ranked_lists = await asyncio.gather(
+                        es_search(request, bm25_request(query, HYBRID_CANDIDATES)),
+                        es_search(request, knn_request(query_vector, HYBRID_CANDIDATES))
+                    )
+                    results = reciprocal_rank_fusion(ranked_lists)[:top_n]
+        if ids is None and local_index is None:
+            await upstreams.cached(query_cache.put_results, query, scope,
+                                     [doc_id for doc_id, _ in results])
+        documents = [content for _, content in results]
+        logging.info(f"Retrieved {len(documents)} documents")
+        return documents
+    except Exception as e:
+        logging.error(f"Error fetching documents: {e}")
+        return []
+
+# Function to generate a batch of prompts in one request (HF_BATCH_GENERATION)
+async def generate_batch(app, prompts):
+    async with app['upstreams'].limit('llm'):
+        results = await app['hf'].generate(*hf_request(prompts))
+    if not isinstance(results, list) or len(results) != len(prompts):
+        raise InferenceError(f"Expected {len(prompts)} results from Hugging Face, got: {results}")
+    return results
+
+# Function to call the Hugging Face inference endpoint
+async def call_hf_inference(request, prompt):
+    try:
+        if request.app['generations'] is not None:
+            result = await request.app['generations'].submit(prompt)
+        else:
+            async with request.app['upstreams'].limit('llm'):
+                result = await request.app['hf'].generate(*hf_request(prompt))
+    except InferenceError as e:
+        logging.error(f"Failed to get a response from Hugging Face: {e}")
+        return HF_ERROR_ANSWER
+    try:
+        return hf_generated_text(result)
+    except (IndexError, KeyError, TypeError):
+        logging.error(f"Unexpected response format from Hugging Face: {result}")
+        return HF_ERROR_ANSWER
+
+# Function to stream tokens from the Hugging Face (text-generation-inference) endpoint
+async def stream_hf_inference(request, prompt):
+    headers, payload = hf_request(prompt, stream=True)
+    try:
+        async for line in request.app['hf'].stream(headers, payload):
+            token = hf_stream_token(line)
+            if token:
+                yield token
+    except InferenceError as e:
+        logging.error(f"Failed to get a response from Hugging Face: {e}")
+        raise RuntimeError(HF_ERROR_ANSWER)
+
+# Semantic Search Endpoint
+@routes.post('/search')
+async def search(request):
+    started = time.perf_counter()
+    body = await request.json()
+    query = body.get('query')
+    stream = request_wants_stream(request, body)
+    upstreams = request.app['upstreams']
+    logging.info(f"Received search query: {query}")
+    try:
+        # Repeat questions are answered from the cache; only a due index version check leaves the loop
+        query_vector = normalize(await embed(request, query)) if ANSWER_CACHE_SIMILARITY > 0 else None
+        with span('cache'):
+            cached = await upstreams.cached(answer_cache.get, query, query_vector)
+        if cached is not None:
+            logging.info("Answered from cache")
+            if stream:
+                return await sse_stream(request, single_token(cached), started)
+            return web.json_response({'answer': cached})
+
+        # Retrieve top documents from Elasticsearch
+        documents = await get_top_documents(request, query)
+
+        if not documents:
+            logging.info("No relevant documents found.")
+            return web.json_response({'answer': 'No relevant documents found.'})
+
+        # Generate a response using Hugging Face's LLaMA
+        prompt = search_prompt(query, documents)
+        if stream:
+            # The stream holds its LLM slot until the last token
+            async with upstreams.limit('llm'):
+                return await sse_stream(request, traced_async_tokens(stream_hf_inference(request, prompt)), started,
+                                        on_complete=lambda answer: answer_cache.put(query, answer, query_vector))
+        with span('llm'):
+            answer = await call_hf_inference(request, prompt)
+        SEARCH_DURATION.observe(time.perf_counter() - started)
+        if answer != HF_ERROR_ANSWER:
+            answer_cache.put(query, answer, query_vector)
+
+        return web.json_response({'answer': answer})
+    except Exception as e:
+        logging.error(f"Search query failed: {e}")
+        return web.json_response({'error': str(e)}, status=500)
+
+# Ask Endpoint
+@routes.post('/ask')
+async def ask(request):
+    query = (await request.json()).get('query')
+    upstreams = request.app['upstreams']
+    logging.info(f"Received ask query: {query}")
+    try:
+        # Plain tracking-number lookups are answered straight from the database
+        tracking_number = lookup_tracking_number(query)
+        if tracking_number is not None:
+            with span('lookup'):
+                result = await upstreams.run_sync('db', package_lookup.find, tracking_number)
+            logging.info(f"Looked up tracking number {tracking_number}: {len(result)} package(s)")
+            return web.json_response({'answer': lookup_answer(tracking_number, result), 'rows': result}, dumps=dumps)
+
+        # Questions that differ only in their tracking number reuse one cached statement
+        template, params = question_template(query)
+        with span('cache'):
+            cached_sql = await upstreams.cached(sql_cache.get, template) if params else None
+        if cached_sql is not None:
+            logging.info(f"Reusing cached SQL for: {template}")
+            result = await upstreams.run_sync('db', execute_sql_query, cached_sql, bind_params(params))
+        else:
+            # Generate the SQL query using Hugging Face's LLaMA
+            with span('sql_generation'):
+                sql_query = clean_sql(await call_hf_inference(request, sql_prompt(query)))
+            logging.info(f"Generated SQL query: {sql_query}")
+
+            # Execute the generated SQL query
+            result = await upstreams.run_sync('db', execute_sql_query, sql_query)
+
+            # Only a statement that ran and takes the identifiers as bind parameters is cached
+            template_sql = parameterize_sql(sql_query, params)
+            if template_sql is not None:
+                sql_cache.put(template, template_sql)
+
+        logging.info(f"SQL query returned {len(result)} rows")
+        # Answered in the same shape as the other variants; the rows are not sent back to the model to phrase
+        return web.json_response({'answer': rows_answer(result), 'rows': result}, dumps=dumps)
+    except SQLAlchemyError as e:
+        logging.error(f"SQL query failed: {e}")
+        return web.json_response({'error': str(e)}, status=400)
+    except Exception as e:
+        logging.error(f"Ask query failed: {e}")
+        return web.json_response({'error': str(e)}, status=500)
+
+# Readiness probe: 503 until the warm-up has loaded the embedding model
+@routes.get('/ready')
+async def ready(request):
+    is_ready, components = readiness.status()
+    return web.json_response({'ready': is_ready, 'components': components}, status=200 if is_ready else 503)
+
+@routes.get('/metrics')
+async def metrics(request):
+    return web.Response(body=render_metrics().encode('utf-8'), headers={'Content-Type': 'text/plain; version=0.0.4'})
+
+@routes.get('/cache/stats')
+async def cache_stats(request):
+    return web.json_response({'search': answer_cache.stats(), 'ask': sql_cache.stats(), 'queries': query_cache.stats()})
+
+@routes.get('/db/stats')
+async def db_stats(request):
+    return web.json_response(pool_stats(engine))
+
+# In-flight and queued calls per upstream against their concurrency limits
+@routes.get('/upstreams/stats')
+async def upstream_stats(request):
+    return web.json_response(request.app['upstreams'].stats())
+
+@routes.get('/hf/stats')
+async def hf_stats(request):
+    return web.json_response(request.app['hf'].stats())
+
+@routes.get('/batch/stats')
+async def batch_stats(request):
+    generations = request.app['generations']
+    return web.json_response({'embedding': request.app['embedder'].stats(),
+                              'llm': generations.stats() if generations is not None else None})
+
+async def on_startup(app):
+    app['upstreams'] = Upstreams()
+    # Concurrent requests share one model.encode call and, with HF_BATCH_GENERATION, one generation request
+    app['embedder'] = AsyncMicroBatcher(partial(encode_batch, app), EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_WINDOW_MS,
+                                        name='embedding')
+    app['generations'] = AsyncMicroBatcher(partial(generate_batch, app), LLM_BATCH_SIZE, LLM_BATCH_WINDOW_MS,
+                                           name='llm') if HF_BATCH_GENERATION else None
+    app['es'] = AsyncElasticsearch(sync_app.es_hosts)
+    # One keep-alive session for the inference endpoint, sized to the LLM concurrency limit
+    app['hf'] = AsyncInferenceClient(hf_endpoint, pool_size=UPSTREAM_LIMITS['llm'])
+
+async def on_cleanup(app):
+    await app['hf'].close()
+    await app['es'].close()
+    app['upstreams'].close()
+
+def create_app():
+    # Latency breakdown of /search and /ask, exported at /metrics (see tracing.py)
+    app = web.Application(middlewares=[tracing_middleware()])
+    app.add_routes(routes)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+if __name__ == '__main__':
+    web.run_app(create_app(), host=ASYNC_HOST, port=ASYNC_PORT)
@@ -0,0 +1,131 @@
+import time
+import asyncio
+import logging
+import aiohttp
+from hf_client import (HF_CONNECT_TIMEOUT, HF_DEADLINE, HF_HEDGE_AFTER, HF_MAX_RETRIES, HF_POOL_SIZE, HF_TIMEOUT,
+                       RETRY_STATUSES, CircuitBreaker, CircuitOpenError, InferenceError, counts_as_failure,
+                       parse_retry_after, retry_delay)
+
+# asyncio counterpart of hf_client.InferenceClient for async_app.py, with the
+# same timeouts, retries, circuit breaker and hedging over one aiohttp session.
+# Unlike the thread-based client, a losing hedge is cancelled outright.
+CLIENT_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError)
+
+
+class AsyncInferenceClient:
+    # Create it in the server's startup hook so the session belongs to its event loop
+    def __init__(self, endpoint, pool_size=HF_POOL_SIZE, breaker=None, hedge_after=HF_HEDGE_AFTER):
+        self.endpoint = endpoint
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=pool_size))
+        self.breaker = breaker or CircuitBreaker()
+        self.hedge_after = hedge_after
+        self.counters = {'requests': 0, 'attempts': 0, 'retries': 0, 'hedges': 0, 'hedge_wins': 0,
+                         'failures': 0, 'rejected': 0}
+
+    async def generate(self, headers, payload):
+        response = await self._request(headers, payload, stream=False, hedge=self.hedge_after > 0)
+        try:
+            return await response.json(content_type=None)
+        except ValueError as e:
+            raise InferenceError(f"Hugging Face returned invalid JSON: {e}") from e
+        finally:
+            response.release()
+
+    async def stream(self, headers, payload):
+        response = await self._request(headers, payload, stream=True, hedge=False)
+        try:
+            async for line in response.content:
+                yield line.decode('utf-8').strip()
+        except CLIENT_ERRORS as e:
+            self.breaker.record_failure()
+            raise InferenceError(f"Hugging Face stream failed: {e}") from e
+        finally:
+            response.release()
+
+    def stats(self):
+        return {**self.counters, 'circuit': self.breaker.stats()}
+
+    async def close(self):
+        await self.session.close()
+
+    async def _request(self, headers, payload, stream, hedge):
+        self.counters['requests'] += 1
+        deadline = time.monotonic() + HF_DEADLINE
+        for attempt in range(HF_MAX_RETRIES + 1):
+            if not self.breaker.allow():
+                self.counters['rejected'] += 1
+                raise CircuitOpenError("Hugging Face endpoint is failing, not sending the request (circuit open)")
+            remaining = deadline - time.monotonic()
+            # A streamed answer may take longer than the deadline; only the gaps between bytes are bounded
+            timeout = aiohttp.ClientTimeout(total=None if stream else remaining,
+                                            sock_connect=min(HF_CONNECT_TIMEOUT, remaining),
+                                            sock_read=min(HF_TIMEOUT, remaining))
+            retry_after = None
+            try:
+                if hedge:
+                    response = await self._hedged(headers, payload, timeout)
+                else:
+                    response = await self._attempt(headers, payload, timeout)
+            except CLIENT_ERRORS as e:
+                error = InferenceError(f"Hugging Face request failed: {e!r}")
+            else:
+                if response.status == 200:
+                    return response
+                error = InferenceError(f"Hugging Face returned {response.status}: {(await response.text())[:500]}",
+                                       response.status)
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                response.release()
+                if response.status not in RETRY_STATUSES:
+                    break
+            if attempt == HF_MAX_RETRIES:
+                break
+            delay = retry_delay(attempt, retry_after)
+            if time.monotonic() + delay >= deadline:
+                break
+            logging.warning(f"{error}; retry {attempt + 1} of {HF_MAX_RETRIES} in {delay:.2f}s")
+            self.counters['retries'] += 1
+            await asyncio.sleep(delay)
+        self.counters['failures'] += 1
+        raise error
+
+    async def _attempt(self, headers, payload, timeout):
+        self.counters['attempts'] += 1
+        try:
+            response = await self.session.post(self.endpoint, headers=headers, json=payload, timeout=timeout)
+        except CLIENT_ERRORS:
+            self.breaker.record_failure()
+            raise
+        if counts_as_failure(response.status):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    async def _hedged(self, headers, payload, timeout):
+        attempts = [asyncio.ensure_future(self._attempt(headers, payload, timeout))]
+        done, _ = await asyncio.wait(attempts, timeout=self.hedge_after)
+        if not done:
+            self.counters['hedges'] += 1
+            attempts.append(asyncio.ensure_future(self._attempt(headers, payload, timeout)))
+        response, error, pending = None, None, set(attempts)
+        while pending and (response is None or response.status != 200):
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                try:
+                    result = task.result()
+                except CLIENT_ERRORS as e:
+                    error = e
+                    continue
+                if response is None or (result.status == 200 and response.status != 200):
+                    if response is not None:
+                        response.release()
+                    response = result
+                    if result.status == 200 and task is not attempts[0]:
+                        self.counters['hedge_wins'] += 1
+                else:
+                    result.release()
+        for task in pending:
+            task.cancel()
+        if response is None:
+            raise error
+        return response
@@ -0,0 +1,259 @@
+import os
+import time
+import random
+import logging
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import requests
+from requests.adapters import HTTPAdapter
+
+# Client for the Hugging Face inference endpoint. One keep-alive session per
+# process, so calls after the first skip the TCP and TLS handshakes. Failed calls
+# (429, 5xx, connection errors, timeouts) are retried with jittered backoff
+# within a deadline, a circuit breaker fails fast while the endpoint is down, and
+# optionally a slow call is hedged with a second identical request.
+# Seconds to open a connection, and to wait between bytes of the response
+HF_CONNECT_TIMEOUT = float(os.getenv('HF_CONNECT_TIMEOUT', '5'))
+HF_TIMEOUT = float(os.getenv('HF_TIMEOUT', '60'))
+# Seconds a call may take across all its attempts and backoff sleeps
+HF_DEADLINE = float(os.getenv('HF_DEADLINE', '120'))
+HF_MAX_RETRIES = int(os.getenv('HF_MAX_RETRIES', '3'))
+# Backoff before retry n is uniform in [0, min(HF_BACKOFF_MAX, HF_BACKOFF_BASE * 2**n)]
+HF_BACKOFF_BASE = float(os.getenv('HF_BACKOFF_BASE', '0.5'))
+HF_BACKOFF_MAX = float(os.getenv('HF_BACKOFF_MAX', '8'))
+# Connections kept open to the endpoint
+HF_POOL_SIZE = int(os.getenv('HF_POOL_SIZE', '32'))
+# Consecutive failures that open the circuit (0 disables it), and seconds before a trial call
+HF_BREAKER_FAILURES = int(os.getenv('HF_BREAKER_FAILURES', '10'))
+HF_BREAKER_RESET = float(os.getenv('HF_BREAKER_RESET', '30'))
+# Seconds after which a second identical request races the first (0 disables
+# hedging). Each hedge is a second generation on the endpoint, so set this near
+# the p95 latency, not the median.
+HF_HEDGE_AFTER = float(os.getenv('HF_HEDGE_AFTER', '0'))
+# Send concurrent prompts as one request with a list of inputs. Inference
+# Endpoints running the text-generation pipeline accept that and answer with one
+# result per input; a bare TGI server does not (it batches on its own), so this
+# is off by default.
+HF_BATCH_GENERATION = os.getenv('HF_BATCH_GENERATION', 'false').lower() in ('1', 'true', 'yes')
+
+# Overloaded or restarting; anything else but 200 is returned to the caller as is
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class InferenceError(Exception):
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class CircuitOpenError(InferenceError):
+    pass
+
+
+def parse_retry_after(value):
+    # Only the delta-seconds form; an HTTP date falls back to the backoff
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_delay(attempt, retry_after=None):
+    # Full jitter, so workers that failed together do not retry together
+    if retry_after is not None:
+        return min(retry_after, HF_BACKOFF_MAX) + random.uniform(0, HF_BACKOFF_BASE)
+    return random.uniform(0, min(HF_BACKOFF_MAX, HF_BACKOFF_BASE * 2 ** attempt))
+
+
+def counts_as_failure(status):
+    return status in RETRY_STATUSES or status >= 500
+
+
+class CircuitBreaker:
+    # closed: calls go through. After `failures` consecutive failures the circuit
+    # opens and calls fail at once for `reset_after` seconds; then one trial call
+    # is let through (half-open), which closes it on success or re-opens it.
+    def __init__(self, failures=HF_BREAKER_FAILURES, reset_after=HF_BREAKER_RESET):
+        self.failures = failures
+        self.reset_after = reset_after
+        self.lock = threading.Lock()
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.opens = 0
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.trial_in_flight or time.monotonic() - self.opened_at < self.reset_after:
+                return False
+            self.trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            if self.opened_at is not None:
+                logging.info("Hugging Face endpoint recovered, closing the circuit")
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.consecutive_failures += 1
+            tripped = self.failures > 0 and self.consecutive_failures >= self.failures
+            if self.trial_in_flight or (self.opened_at is None and tripped):
+                if self.opened_at is None:
+                    self.opens += 1
+                    logging.warning(f"Hugging Face endpoint failed {self.consecutive_failures} times in a row, "
+                                    f"opening the circuit for {self.reset_after:.0f}s")
+                self.opened_at = time.monotonic()
+            self.trial_in_flight = False
+
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        return 'half-open' if time.monotonic() - self.opened_at >= self.reset_after else 'open'
+
+    def stats(self):
+        with self.lock:
+            return {'state': self.state(), 'consecutive_failures': self.consecutive_failures, 'opens': self.opens}
+
+
+class InferenceClient:
+    def __init__(self, endpoint, pool_size=HF_POOL_SIZE, breaker=None, hedge_after=HF_HEDGE_AFTER):
+        self.endpoint = endpoint
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.breaker = breaker or CircuitBreaker()
+        self.hedge_after = hedge_after
+        self.hedger = None
+        if hedge_after > 0:
+            self.hedger = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='hf-hedge')
+        self.lock = threading.Lock()
+        self.counters = {'requests': 0, 'attempts': 0, 'retries': 0, 'hedges': 0, 'hedge_wins': 0,
+                         'failures': 0, 'rejected': 0}
+
+    def generate(self, headers, payload):
+        # Decoded JSON of the endpoint's 200 response; raises InferenceError otherwise
+        response = self._request(headers, payload, stream=False, hedge=self.hedger is not None)
+        try:
+            return response.json()
+        except ValueError as e:
+            raise InferenceError(f"Hugging Face returned invalid JSON: {e}") from e
+        finally:
+            response.close()
+
+    def stream(self, headers, payload):
+        # Lines of a streamed response. Retries happen only before the first byte;
+        # a stream that breaks later raises InferenceError.
+        response = self._request(headers, payload, stream=True, hedge=False)
+        with response:
+            try:
+                yield from response.iter_lines(decode_unicode=True)
+            except requests.RequestException as e:
+                self.breaker.record_failure()
+                raise InferenceError(f"Hugging Face stream failed: {e}") from e
+
+    def stats(self):
+        with self.lock:
+            counters = dict(self.counters)
+        return {**counters, 'circuit': self.breaker.stats()}
+
+    def close(self):
+        if self.hedger is not None:
+            self.hedger.shutdown(wait=False)
+        self.session.close()
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def _request(self, headers, payload, stream, hedge):
+        self._count('requests')
+        deadline = time.monotonic() + HF_DEADLINE
+        for attempt in range(HF_MAX_RETRIES + 1):
+            if not self.breaker.allow():
+                self._count('rejected')
+                raise CircuitOpenError("Hugging Face endpoint is failing, not sending the request (circuit open)")
+            remaining = deadline - time.monotonic()
+            timeout = (min(HF_CONNECT_TIMEOUT, remaining), min(HF_TIMEOUT, remaining))
+            retry_after = None
+            try:
+                if hedge:
+                    response = self._hedged(headers, payload, timeout)
+                else:
+                    response = self._attempt(headers, payload, stream, timeout)
+            except requests.RequestException as e:
+                error = InferenceError(f"Hugging Face request failed: {e}")
+            else:
+                if response.status_code == 200:
+                    return response
+                error = InferenceError(f"Hugging Face returned {response.status_code}: {response.text[:500]}",
+                                       response.status_code)
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                response.close()
+                if response.status_code not in RETRY_STATUSES:
+                    break
+            if attempt == HF_MAX_RETRIES:
+                break
+            delay = retry_delay(attempt, retry_after)
+            if time.monotonic() + delay >= deadline:
+                break
+            logging.warning(f"{error}; retry {attempt + 1} of {HF_MAX_RETRIES} in {delay:.2f}s")
+            self._count('retries')
+            time.sleep(delay)
+        self._count('failures')
+        raise error
+
+    def _attempt(self, headers, payload, stream, timeout):
+        self._count('attempts')
+        try:
+            response = self.session.post(self.endpoint, headers=headers, json=payload, stream=stream, timeout=timeout)
+        except requests.RequestException:
+            self.breaker.record_failure()
+            raise
+        if counts_as_failure(response.status_code):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    def _hedged(self, headers, payload, timeout):
+        # The first attempt gets hedge_after seconds alone; then a second one races
+        # it and the first 200 wins. requests cannot abort the slower one, so it
+        # finishes in the pool and its response is dropped.
+        attempts = [self.hedger.submit(self._attempt, headers, payload, False, timeout)]
+        if not wait(attempts, timeout=self.hedge_after).done:
+            self._count('hedges')
+            attempts.append(self.hedger.submit(self._attempt, headers, payload, False, timeout))
+        response, error, pending = None, None, set(attempts)
+        while pending and (response is None or response.status_code != 200):
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except requests.RequestException as e:
+                    error = e
+                    continue
+                if response is None or (result.status_code == 200 and response.status_code != 200):
+                    if response is not None:
+                        response.close()
+                    response = result
+                    if result.status_code == 200 and future is not attempts[0]:
+                        self._count('hedge_wins')
+                else:
+                    result.close()
+        for future in pending:
+            future.add_done_callback(_close_response)
+        if response is None:
+            raise error
+        return response
+
+
+def _close_response(future):
+    if future.exception() is None:
+        future.result().close()
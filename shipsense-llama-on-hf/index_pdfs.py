@@ -1,10 +1,20 @@
 import os
-import fitz  # PyMuPDF
+import argparse
+from contextlib import contextmanager, nullcontext
 from sentence_transformers import SentenceTransformer
-from elasticsearch import Elasticsearch, RequestsHttpConnection
-from elasticsearch.helpers import bulk
+from elasticsearch import Elasticsearch
 from dotenv import load_dotenv
 import logging
+from embedding import encode_batched
+from pdf_extraction import extract_page_window, page_windows, PAGE_WINDOW
+from pipeline import add_pipeline_arguments, run_pipeline, start_extraction_pool, DEFAULT_WORKERS, DEFAULT_QUEUE_DEPTH
+from chunking import chunk_pages, chunking_settings, token_counter
+from retrieval import RETRIEVAL_BACKEND
+from vector_store import LocalIndexWriter
+from manifest import IndexManifest, PendingDocument, file_sha256, chunk_hash
+from bulk_upload import BulkUploader, elasticsearch_bulk, elasticsearch_lines
+from vector_encoding import INDEX_VECTOR_TYPE, elasticsearch_vector_mapping, vector_payload
+from lazy import Lazy
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -13,54 +23,264 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 load_dotenv()
 
 # Initialize Sentence Transformers model and Elasticsearch client
-model = SentenceTransformer('all-MiniLM-L6-v2')
+# The model is loaded on first use, once the extraction workers are forked (see
+# pipeline.start_extraction_pool)
+model = Lazy('embedding model', lambda: SentenceTransformer('all-MiniLM-L6-v2'))
+# Chunks are sized in the model's own word pieces
+count_tokens = Lazy('tokenizer', lambda: token_counter(model.get().tokenizer))
 es_host = os.getenv('ES_HOST', 'localhost')
 es_port = os.getenv('ES_PORT', '9200')
+# Bulk bodies are mostly embeddings written as JSON numbers, which gzip well
 es = Elasticsearch(
-    [{'host': es_host, 'port': es_port}],
-    connection_class=RequestsHttpConnection,
-    headers={"Content-Type": "application/json"}
+    [{'host': es_host, 'port': int(es_port), 'scheme': 'http'}],
+    http_compress=True,
+    request_timeout=120
 )
 
-def extract_text_from_pdf(pdf_path):
-    doc = fitz.open(pdf_path)
-    text = ""
-    for page_num in range(doc.page_count):
-        page = doc.load_page(page_num)
-        text += page.get_text()
-    return text
+# all-MiniLM-L6-v2 output size
+EMBEDDING_DIMS = 384
 
-def index_text_in_elasticsearch(text, pdf_filename):
+def ensure_index():
+    # Map embeddings as dense_vector so the apps can run kNN queries, and give
+    # content the ngram subfield the BM25 query searches
+    vector_mapping = elasticsearch_vector_mapping(EMBEDDING_DIMS)
+    if es.indices.exists(index='pdf_index'):
+        # The element type of a mapped field cannot change, the index has to be rebuilt
+        mappings = es.indices.get_mapping(index='pdf_index')['pdf_index']['mappings']
+        element_type = mappings.get('properties', {}).get('embedding', {}).get('element_type', 'float')
+        if element_type != vector_mapping.get('element_type', 'float'):
+            raise ValueError(f"pdf_index stores {element_type} vectors, delete it to index with "
+                             f"INDEX_VECTOR_TYPE={INDEX_VECTOR_TYPE}")
+        return
+    es.indices.create(
+        index='pdf_index',
+        settings={
+            'analysis': {
+                'tokenizer': {'ngram_tokenizer': {'type': 'ngram', 'min_gram': 3, 'max_gram': 4}},
+                'analyzer': {'ngram_analyzer': {'type': 'custom', 'tokenizer': 'ngram_tokenizer', 'filter': ['lowercase']}}
+            }
+        },
+        mappings={
+            'properties': {
+                'pdf_filename': {'type': 'keyword'},
+                'page': {'type': 'integer'},
+                'heading': {'type': 'text'},
+                'content': {
+                    'type': 'text',
+                    'fields': {'ngram': {'type': 'text', 'analyzer': 'ngram_analyzer'}}
+                },
+                'embedding': vector_mapping
+            }
+        }
+    )
+    logging.info("Created index pdf_index")
+
+def split_chunks(pages, pdf_filename, heading=None):
+    # Document ids are derived from the chunk content, so an unchanged chunk
+    # keeps its id (and its stored embedding) when the PDF is edited. heading is
+    # the section the pages start in; returns the chunks and the one they end in
+    chunks = {}
+    page_chunks, heading = chunk_pages(pages, heading=heading, count_tokens=count_tokens.get())
+    for chunk in page_chunks:
+        content_hash = chunk_hash(chunk.text)
+        chunks.setdefault(f"{pdf_filename}_{content_hash[:16]}", (chunk, content_hash))
+    return chunks, heading
+
+def index_settings(vector_type):
+    # Documents embedded for another INDEX_VECTOR_TYPE are embedded again
+    settings = chunking_settings()
+    if vector_type != 'float32':
+        settings['vectors'] = vector_type
+    return settings
+
+def build_actions(chunks, pdf_filename, vector_type=INDEX_VECTOR_TYPE):
     actions = []
-    paragraphs = text.split('\n')
-    for i, paragraph in enumerate(paragraphs):
-        if paragraph.strip():  # Index non-empty paragraphs
-            action = {
-                "_index": "pdf_index",
-                "_id": f"{pdf_filename}_{i}",
-                "_source": {
-                    'pdf_filename': pdf_filename,
-                    'content': paragraph,
-                    'embedding': model.encode(paragraph).tolist()
-                }
+    doc_ids = list(chunks)
+    embeddings = encode_batched(model.get(), [chunks[doc_id][0].text for doc_id in doc_ids])
+    for doc_id, embedding in zip(doc_ids, embeddings):
+        chunk = chunks[doc_id][0]
+        action = {
+            "_index": "pdf_index",
+            "_id": doc_id,
+            "_source": {
+                'pdf_filename': pdf_filename,
+                'page': chunk.page,
+                'heading': chunk.heading,
+                'content': chunk.text,
+                'embedding': vector_payload(embedding, vector_type)
             }
-            actions.append(action)
-    if actions:
-        bulk(es, actions)
-        logging.info(f"Indexed {len(actions)} paragraphs from {pdf_filename}")
+        }
+        actions.append(action)
+    return actions
+
+def delete_actions(doc_ids):
+    return [{"_op_type": "delete", "_index": "pdf_index", "_id": doc_id} for doc_id in doc_ids]
+
+@contextmanager
+def refresh_paused():
+    # Refreshing makes new segments searchable; during a load it only churns
+    # segments, so it is switched off until the upload is done
+    settings = es.indices.get_settings(index='pdf_index', name='index.refresh_interval')
+    previous = settings.body.get('pdf_index', {}).get('settings', {}).get('index', {}).get('refresh_interval')
+    if previous == '-1':
+        # Left behind by a run that was killed mid-load, restore the default
+        previous = None
+    es.indices.put_settings(index='pdf_index', settings={'index': {'refresh_interval': '-1'}})
+    try:
+        yield
+    finally:
+        es.indices.put_settings(index='pdf_index', settings={'index': {'refresh_interval': previous}})
+        es.indices.refresh(index='pdf_index')
+
+def bump_generation():
+    # The apps drop cached answers and query results when this number changes;
+    # it lives in the index mapping's _meta, next to what it describes
+    meta = es.indices.get_mapping(index='pdf_index')['pdf_index']['mappings'].get('_meta', {})
+    generation = meta.get('generation', 0) + 1
+    es.indices.put_mapping(index='pdf_index', meta={**meta, 'generation': generation})
+    return generation
+
+def index_pdfs_in_directory(directory_path, workers=DEFAULT_WORKERS, queue_depth=DEFAULT_QUEUE_DEPTH, full=False, page_window=PAGE_WINDOW):
+    # Before anything starts threads or loads the model
+    pool = start_extraction_pool(workers)
+    filenames = [name for name in os.listdir(directory_path) if name.endswith('.pdf')]
+    logging.info(f"Found {len(filenames)} PDF files in directory {directory_path}")
+    if RETRIEVAL_BACKEND == 'local':
+        # Build the in-process index instead of uploading; its manifest lives alongside it
+        local_index = LocalIndexWriter()
+        # It takes full-precision vectors and quantizes them itself (LOCAL_INDEX_DTYPE)
+        vector_type = 'float32'
+        manifest = IndexManifest(os.path.join(local_index.path, 'manifest.json'), settings=index_settings(vector_type))
+        uploader = None
+    else:
+        local_index = None
+        vector_type = INDEX_VECTOR_TYPE
+        ensure_index()
+        manifest = IndexManifest(settings=index_settings(vector_type))
+        # Chunks of all documents share byte-sized bulk requests sent in parallel (see bulk_upload.py)
+        uploader = BulkUploader(elasticsearch_bulk(es), name='Elasticsearch')
+    pending = {}
+
+    def remove_chunks(filename, doc_ids, on_done):
+        if local_index is not None:
+            local_index.delete(doc_ids)
+            on_done([])
+        else:
+            uploader.add([elasticsearch_lines(action) for action in delete_actions(doc_ids)], on_done)
 
-def index_pdfs_in_directory(directory_path):
-    total_files = len([name for name in os.listdir(directory_path) if name.endswith('.pdf')])
-    logging.info(f"Found {total_files} PDF files in directory {directory_path}")
+    def finish(filename):
+        # Every page window is uploaded: drop chunks that disappeared from the PDF
+        document = pending.pop(filename)
+        removed = [doc_id for doc_id in document.indexed if doc_id not in document.chunks]
 
-    for filename in os.listdir(directory_path):
-        if filename.endswith('.pdf'):
+        def removed_stale(errors):
+            if errors:
+                logging.error(f"Failed to remove stale chunks of {filename}, it will be retried on the next run: "
+                              f"{errors[0]}")
+                return
+            manifest.update(filename, document.file_hash, document.chunks)
+            if local_index is None:  # The local index manifest is saved together with the index
+                manifest.save()
+            logging.info(f"Completed indexing for {filename}, removed {len(removed)} stale chunks")
+        remove_chunks(filename, removed, removed_stale)
+
+    def jobs():
+        for filename in filenames:
             pdf_path = os.path.join(directory_path, filename)
-            logging.info(f"Extracting text from {filename}")
-            text = extract_text_from_pdf(pdf_path)
-            index_text_in_elasticsearch(text, filename)
-            logging.info(f"Completed indexing for {filename}")
+            file_hash = file_sha256(pdf_path)
+            if not full and manifest.is_unchanged(filename, file_hash=file_hash):
+                logging.info(f"Skipping unchanged {filename}")
+                continue
+            windows = page_windows(pdf_path, page_window)
+            pending[filename] = PendingDocument(file_hash, manifest.chunks(filename), len(windows))
+            if not windows:
+                finish(filename)
+            for start, end in windows:
+                yield filename, (pdf_path, start, end)
+
+    def embed(filename, source, pages):
+        # Only embed chunks the index does not already hold
+        document = pending[filename]
+        known = {} if full else document.indexed
+        changed = {}
+        chunks, document.heading = split_chunks(pages, filename, document.heading)
+        for doc_id, chunk in chunks.items():
+            if doc_id in document.chunks:  # Already seen in an earlier page window
+                continue
+            document.chunks[doc_id] = chunk[1]
+            if doc_id not in known:
+                changed[doc_id] = chunk
+        actions = build_actions(changed, filename, vector_type)
+        if local_index is not None:
+            for action in actions:
+                source = action['_source']
+                local_index.add(action['_id'], source['content'], filename, source['page'], source['embedding'])
+            return []
+        return actions
+
+    def window_uploaded(filename, count, errors):
+        # A document is only recorded once all of its windows made it into the index,
+        # a failed window leaves it to be retried on the next run
+        if errors:
+            logging.error(f"Failed to index {len(errors)} of {count} chunks from {filename}, it will be retried "
+                          f"on the next run: {errors[0]}")
+            return
+        if count:
+            logging.info(f"Indexed {count} chunks from {filename}")
+        if pending[filename].window_done():
+            finish(filename)
+
+    def upload(filename, actions):
+        if uploader is None:
+            window_uploaded(filename, len(actions), [])
+            return
+        uploader.add([elasticsearch_lines(action) for action in actions],
+                     lambda errors: window_uploaded(filename, len(actions), errors))
+
+    def removed_document(filename):
+        def on_done(errors):
+            if errors:
+                logging.error(f"Failed to remove {filename} from the index: {errors[0]}")
+                return
+            manifest.remove(filename)
+            if local_index is None:
+                manifest.save()
+            logging.info(f"Removed {filename} from the index")
+        return on_done
+
+    with refresh_paused() if uploader is not None else nullcontext():
+        # Page windows are extracted in a process pool, embedded here and uploaded in the background
+        try:
+            run_pipeline(jobs(), extract_page_window, embed, upload, workers=workers, queue_depth=queue_depth,
+                         pool=pool)
+        finally:
+            pool.shutdown()
+        if uploader is not None:
+            uploader.join()
+
+        # Drop everything indexed from PDFs that are no longer in the directory
+        for filename in set(manifest.names()) - set(filenames):
+            remove_chunks(filename, list(manifest.chunks(filename)), removed_document(filename))
+
+        if uploader is not None:
+            uploader.close()
+
+    if uploader is not None and uploader.stats()['documents']:
+        generation = bump_generation()
+        logging.info(f"Bumped pdf_index to generation {generation}")
+
+    if local_index is not None:
+        if local_index.dirty or not local_index.exists:
+            generation = local_index.save()
+            logging.info(f"Saved local index generation {generation} to {local_index.path}")
+        manifest.save()
 
 if __name__ == "__main__":
-    directory_path = 'knowledgebase'  # Directory containing the PDF files
-    index_pdfs_in_directory(directory_path)
+    parser = argparse.ArgumentParser(description='Index the PDFs in a directory into Elasticsearch')
+    parser.add_argument('directory', nargs='?', default='knowledgebase', help='directory containing the PDF files')
+    parser.add_argument('--full', action='store_true', help='re-embed every document, ignoring the manifest')
+    parser.add_argument('--page-window', type=int, default=PAGE_WINDOW, help='pages extracted and embedded together')
+    add_pipeline_arguments(parser)
+    args = parser.parse_args()
+    index_pdfs_in_directory(args.directory, workers=args.workers, queue_depth=args.queue_depth, full=args.full,
+                            page_window=args.page_window)
@@ -0,0 +1,99 @@
+import os
+import json
+import hashlib
+import threading
+
+# Records what has already been indexed so unchanged documents and chunks are skipped
+MANIFEST_PATH = os.getenv('INDEX_MANIFEST', 'index_manifest.json')
+MANIFEST_VERSION = 1
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def bytes_sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def chunk_hash(content):
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+class IndexManifest:
+    def __init__(self, path=MANIFEST_PATH, settings=None):
+        self.path = path
+        self.settings = settings or {}
+        self.settings_changed = False
+        self.lock = threading.Lock()
+        self.documents = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            # A manifest from another layout version cannot be trusted, start over
+            if data.get('version') == MANIFEST_VERSION:
+                self.documents = data.get('documents', {})
+                # Documents chunked with other settings must be re-chunked, but their
+                # chunk lists are kept so the old chunks can still be deleted
+                self.settings_changed = data.get('settings', {}) != self.settings
+
+    def names(self):
+        with self.lock:
+            return list(self.documents)
+
+    def chunks(self, name):
+        with self.lock:
+            return dict(self.documents.get(name, {}).get('chunks', {}))
+
+    def is_unchanged(self, name, file_hash=None, etag=None):
+        with self.lock:
+            entry = self.documents.get(name)
+        if entry is None or self.settings_changed:
+            return False
+        if etag is not None and entry.get('etag') == etag:
+            return True
+        return file_hash is not None and entry.get('file_hash') == file_hash
+
+    def update(self, name, file_hash, chunks, etag=None):
+        with self.lock:
+            self.documents[name] = {'file_hash': file_hash, 'etag': etag, 'chunks': chunks}
+
+    def set_etag(self, name, etag):
+        with self.lock:
+            if name in self.documents:
+                self.documents[name]['etag'] = etag
+
+    def remove(self, name):
+        with self.lock:
+            self.documents.pop(name, None)
+
+    def save(self):
+        # Write to a temporary file first so a crash never leaves a truncated manifest
+        tmp_path = f"{self.path}.tmp"
+        with self.lock:
+            with open(tmp_path, 'w') as f:
+                json.dump({'version': MANIFEST_VERSION, 'settings': self.settings, 'documents': self.documents}, f)
+            os.replace(tmp_path, self.path)
+
+
+class PendingDocument:
+    # Tracks a document whose page windows are still moving through the pipeline
+    def __init__(self, file_hash, indexed, windows, etag=None):
+        self.file_hash = file_hash
+        self.etag = etag
+        self.indexed = indexed
+        self.chunks = {}
+        # Section the next page window starts in; the pipeline hands a document's
+        # windows over in order
+        self.heading = None
+        self.remaining = windows
+        self.lock = threading.Lock()
+
+    def window_done(self):
+        with self.lock:
+            self.remaining -= 1
+            return self.remaining == 0
@@ -0,0 +1,84 @@
+import bisect
+import threading
+
+# Process-local metrics, served in the Prometheus text format from /metrics
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+REGISTRY = []
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS, labels=None, register=True):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.labels = labels or {}
+        self.lock = threading.Lock()
+        self.counts = [0] * (len(self.buckets) + 1)  # the last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        if register:
+            REGISTRY.append(self)
+
+    def observe(self, value):
+        with self.lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        return '\n'.join(lines + self.samples())
+
+    def samples(self):
+        labels = ''.join(f'{name}="{value}",' for name, value in self.labels.items())
+        with self.lock:
+            lines = []
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{{{labels}le="{le}"}} {cumulative}')
+            suffix = f"{{{labels.rstrip(',')}}}" if labels else ''
+            lines.append(f"{self.name}_sum{suffix} {self.sum}")
+            lines.append(f"{self.name}_count{suffix} {self.count}")
+        return lines
+
+
+class HistogramFamily:
+    # One histogram per combination of label values, rendered under one name
+    def __init__(self, name, help_text, labelnames, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.children = {}
+        REGISTRY.append(self)
+
+    def labels(self, *values):
+        with self.lock:
+            child = self.children.get(values)
+            if child is None:
+                child = Histogram(self.name, self.help_text, self.buckets, dict(zip(self.labelnames, values)),
+                                  register=False)
+                self.children[values] = child
+            return child
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            children = list(self.children.values())
+        for child in children:
+            lines.extend(child.samples())
+        return '\n'.join(lines)
+
+
+SEARCH_TIME_TO_FIRST_TOKEN = Histogram(
+    'search_time_to_first_token_seconds', 'Time from a /search request to the first answer token sent to the client')
+SEARCH_DURATION = Histogram(
+    'search_duration_seconds', 'Time from a /search request to the complete answer')
+
+
+def render_metrics():
+    return '\n'.join(metric.render() for metric in REGISTRY) + '\n'
@@ -0,0 +1,53 @@
+import os
+import fitz  # PyMuPDF
+
+# Kept free of model and client setup so extraction can run in worker processes
+
+# Number of pages extracted, embedded and uploaded together
+PAGE_WINDOW = int(os.getenv('PAGE_WINDOW', '8'))
+
+
+def iter_pdf_pages(pdf_path, start=0, end=None):
+    # Yield (page_number, text) one page at a time, page numbers are 1-based
+    doc = fitz.open(pdf_path)
+    try:
+        end = doc.page_count if end is None else min(end, doc.page_count)
+        for page_num in range(start, end):
+            yield page_num + 1, doc.load_page(page_num).get_text()
+    finally:
+        doc.close()
+
+def iter_pdf_paragraphs(pdf_path, start=0, end=None):
+    for page_number, text in iter_pdf_pages(pdf_path, start, end):
+        for paragraph in text.split('\n'):
+            if paragraph.strip():
+                yield page_number, paragraph
+
+def iter_pdf_blocks(pdf_path, start=0, end=None):
+    # Yield (page_number, [(block_text, font_size), ...]) one page at a time. The
+    # font size lets the chunker tell headings from body text.
+    doc = fitz.open(pdf_path)
+    try:
+        end = doc.page_count if end is None else min(end, doc.page_count)
+        for page_num in range(start, end):
+            blocks = []
+            for block in doc.load_page(page_num).get_text('dict')['blocks']:
+                spans = [span for line in block.get('lines', []) for span in line['spans']]
+                text = ' '.join(' '.join(span['text'] for span in spans).split())
+                if text:
+                    blocks.append((text, max(span['size'] for span in spans)))
+            yield page_num + 1, blocks
+    finally:
+        doc.close()
+
+def page_windows(pdf_path, window=PAGE_WINDOW):
+    with fitz.open(pdf_path) as doc:
+        page_count = doc.page_count
+    return [(start, min(start + window, page_count)) for start in range(0, page_count, window)]
+
+def extract_page_window(source):
+    pdf_path, start, end = source
+    return list(iter_pdf_blocks(pdf_path, start, end))
+
+def extract_text_from_pdf(pdf_path):
+    return ''.join(text for _, text in iter_pdf_pages(pdf_path))
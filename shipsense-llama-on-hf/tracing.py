@@ -0,0 +1,193 @@
+import os
+import sys
+import time
+import random
+import logging
+import threading
+import contextvars
+from collections import Counter
+from contextlib import contextmanager
+from flask import g, request
+from metrics import HistogramFamily
+
+# Per-request latency breakdown for /search and /ask. Each request gets a trace;
+# span(stage) times one stage of it (embedding, retrieval, context, llm,
+# sql_generation, sql_execution, ...). Stage and request times are exported as
+# histograms at /metrics, returned in a Server-Timing header and logged as one
+# line per request, at WARNING once the request takes TRACE_SLOW_MS or more.
+TRACE_SLOW_MS = float(os.getenv('TRACE_SLOW_MS', '5000'))
+# Share of traced requests whose stacks are sampled every PROFILE_INTERVAL_MS and
+# written to PROFILE_DIR as folded stacks (flamegraph.pl, speedscope). Off by default.
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', '5'))
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+REQUEST_DURATION = HistogramFamily(
+    'request_duration_seconds', 'Time to handle a request, by endpoint and status', ('endpoint', 'status'),
+    STAGE_BUCKETS)
+REQUEST_STAGE_DURATION = HistogramFamily(
+    'request_stage_duration_seconds', 'Time spent in each stage of a request', ('endpoint', 'stage'), STAGE_BUCKETS)
+
+_current = contextvars.ContextVar('trace', default=None)
+
+
+class Trace:
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.status = None
+        self.profile = None
+
+    def record(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        REQUEST_STAGE_DURATION.labels(self.endpoint, stage).observe(seconds)
+
+    def server_timing(self):
+        return ', '.join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in self.stages.items())
+
+
+class StackSampler:
+    # Counts the stacks of the threads serving profiled requests. Under
+    # async_app.py every request shares the loop thread, so a profile there shows
+    # what the loop was busy with while that request was in flight.
+    def __init__(self, interval):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.targets = {}
+        self.pid = None
+
+    def start(self, thread_id):
+        counts = Counter()
+        with self.lock:
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                threading.Thread(target=self._run, name='stack-sampler', daemon=True).start()
+            self.targets[thread_id] = counts
+        return counts
+
+    def stop(self, thread_id):
+        with self.lock:
+            self.targets.pop(thread_id, None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                targets = dict(self.targets)
+            if not targets:
+                continue
+            frames = sys._current_frames()
+            for thread_id, counts in targets.items():
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                if stack:
+                    counts[';'.join(reversed(stack))] += 1
+
+
+sampler = StackSampler(PROFILE_INTERVAL_MS / 1000)
+
+
+def start_trace(endpoint):
+    trace = Trace(endpoint)
+    _current.set(trace)
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        trace.profile = (threading.get_ident(), sampler.start(threading.get_ident()))
+    return trace
+
+
+def finish_trace(trace):
+    elapsed = time.perf_counter() - trace.started
+    REQUEST_DURATION.labels(trace.endpoint, str(trace.status)).observe(elapsed)
+    breakdown = ', '.join(f"{stage} {seconds * 1000:.0f} ms" for stage, seconds in trace.stages.items())
+    level = logging.WARNING if elapsed * 1000 >= TRACE_SLOW_MS else logging.INFO
+    logging.log(level, f"/{trace.endpoint} {trace.status} in {elapsed * 1000:.0f} ms ({breakdown or 'no stages'})")
+    if trace.profile is not None:
+        write_profile(trace)
+    if _current.get() is trace:
+        _current.set(None)
+
+
+def write_profile(trace):
+    thread_id, counts = trace.profile
+    sampler.stop(thread_id)
+    if not counts:
+        return
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{trace.endpoint}-{time.time_ns()}.folded")
+    with open(path, 'w') as f:
+        for stack, count in counts.most_common():
+            f.write(f"{stack} {count}\n")
+    logging.info(f"Wrote {sum(counts.values())} stack samples to {path}")
+
+
+@contextmanager
+def span(stage):
+    # Also works as a decorator on plain functions
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.record(stage, time.perf_counter() - start)
+
+
+def traced_tokens(tokens, stage='llm'):
+    # For streamed answers: the stage lasts until the last token was consumed
+    trace = _current.get()
+
+    def generate():
+        start = time.perf_counter()
+        try:
+            yield from tokens
+        finally:
+            if trace is not None:
+                trace.record(stage, time.perf_counter() - start)
+    return generate()
+
+
+def traced_async_tokens(tokens, stage='llm'):
+    trace = _current.get()
+
+    async def generate():
+        start = time.perf_counter()
+        try:
+            async for token in tokens:
+                yield token
+        finally:
+            if trace is not None:
+                trace.record(stage, time.perf_counter() - start)
+    return generate()
+
+
+def init_tracing(app, endpoints=('search', 'ask')):
+    # Traces the given Flask endpoints; a streamed response is finished when its
+    # generator is, since stream_with_context keeps the request open until then
+    @app.before_request
+    def begin_trace():
+        if request.endpoint in endpoints:
+            g.trace = start_trace(request.endpoint)
+
+    @app.after_request
+    def add_server_timing(response):
+        trace = g.get('trace')
+        if trace is not None:
+            trace.status = response.status_code
+            response.headers['Server-Timing'] = trace.server_timing()
+        return response
+
+    @app.teardown_request
+    def end_trace(error):
+        trace = g.pop('trace', None)
+        if trace is not None:
+            if error is not None:
+                trace.status = 500
+            finish_trace(trace)
@@ -0,0 +1,57 @@
+import os
+import numpy as np
+
+# How the indexers store chunk embeddings in Elasticsearch / Azure AI Search, and
+# how the apps send query vectors to match them:
+#   float32  full precision (the default)
+#   float16  half precision. Azure stores Edm.Half; Elasticsearch has no half
+#            type and keeps float32 on disk, but the bulk bodies shrink and its
+#            HNSW graph holds int8 copies (int8_hnsw)
+#   int8     a signed byte per dimension, scaled to the vector's largest value.
+#            Cosine similarity ignores the scale, so none is stored
+#   binary   a sign bit per dimension (48 bytes for all-MiniLM-L6-v2), compared
+#            by Hamming distance; needs Elasticsearch 8.15+
+# Switching types needs the index deleted so the indexers can create it with the
+# new mapping; they re-embed every document once it is gone. The apps must run
+# with the same setting. benchmarks/bench_vector_types.py reports what each type
+# costs in recall on the Service Guide.
+INDEX_VECTOR_TYPE = os.getenv('INDEX_VECTOR_TYPE', 'float32')
+INDEX_VECTOR_TYPES = ('float32', 'float16', 'int8', 'binary')
+if INDEX_VECTOR_TYPE not in INDEX_VECTOR_TYPES:
+    raise ValueError(f"INDEX_VECTOR_TYPE must be one of {', '.join(INDEX_VECTOR_TYPES)}, got {INDEX_VECTOR_TYPE!r}")
+
+
+def vector_payload(embedding, vector_type=INDEX_VECTOR_TYPE, hex_bits=True):
+    # The JSON value of a document or query embedding stored as vector_type.
+    # Binary vectors are a hex string for Elasticsearch, or a list of unsigned
+    # bytes with hex_bits=False for Azure's packedBit fields.
+    embedding = np.asarray(embedding, dtype=np.float32)
+    if vector_type == 'float32':
+        # float32 values written as float64 JSON take ~20 characters each; for the
+        # values of a normalized vector eight decimals hold what the index's
+        # float32 keeps, in half the size
+        return [round(value, 8) for value in embedding.tolist()]
+    if vector_type == 'float16':
+        # The shortest decimal that reads back as the same half-precision value
+        return [float(np.format_float_positional(value, unique=True)) for value in embedding.astype(np.float16)]
+    if vector_type == 'int8':
+        scale = max(float(np.abs(embedding).max()), 1e-12) / 127.0
+        return np.round(embedding / scale).astype(np.int8).tolist()
+    if vector_type == 'binary':
+        bits = np.packbits(embedding > 0)
+        return bits.tobytes().hex() if hex_bits else bits.tolist()
+    raise ValueError(f"vector_type must be one of {', '.join(INDEX_VECTOR_TYPES)}, got {vector_type!r}")
+
+
+def elasticsearch_vector_mapping(dims, vector_type=INDEX_VECTOR_TYPE):
+    # dense_vector mapping of the embedding field for vector_type
+    if vector_type == 'binary':
+        # For bit vectors l2_norm is the Hamming distance, the only similarity they support
+        return {'type': 'dense_vector', 'dims': dims, 'element_type': 'bit', 'index': True, 'similarity': 'l2_norm'}
+    mapping = {'type': 'dense_vector', 'dims': dims, 'index': True, 'similarity': 'cosine'}
+    if vector_type == 'int8':
+        # Already bytes, the graph needs no further quantization
+        mapping.update({'element_type': 'byte', 'index_options': {'type': 'hnsw'}})
+    elif vector_type == 'float16':
+        mapping['index_options'] = {'type': 'int8_hnsw'}
+    return mapping
@@ -0,0 +1,278 @@
+import os
+import json
+import mmap
+import threading
+import numpy as np
+
+# In-process vector index used when RETRIEVAL_BACKEND=local. The indexers build
+# it next to their manifest and the apps memory-map it, so retrieval needs no
+# search service at all.
+#
+# On-disk layout of one build (every file name carries the generation):
+#   vectors-N.npy   quantized vector matrix, one row per chunk
+#   texts-N.bin     UTF-8 chunk contents back to back
+#   offsets-N.npy   int64 start of each chunk in texts-N.bin, plus the end
+#   rows-N.npy      structured array of (id, file, page) per chunk
+#   meta.json       generation, dtype, file names and the list of PDF names
+# Everything is opened read-only with mmap, so gunicorn workers on one box share
+# a single page-cache copy and opening an index copies nothing.
+LOCAL_INDEX_PATH = os.getenv('LOCAL_INDEX_PATH', 'local_index')
+# Storage type of the vectors: float32, float16 or int8 (one scale per vector)
+LOCAL_INDEX_DTYPE = os.getenv('LOCAL_INDEX_DTYPE', 'float16')
+# Number of IVF lists; 0 keeps a flat matrix and searches it exhaustively
+LOCAL_INDEX_NLIST = int(os.getenv('LOCAL_INDEX_NLIST', '0'))
+# Number of IVF lists scanned per query
+LOCAL_INDEX_NPROBE = int(os.getenv('LOCAL_INDEX_NPROBE', '8'))
+
+LOCAL_INDEX_DTYPES = ('float32', 'float16', 'int8')
+KMEANS_ITERATIONS = 10
+# Rows scored per matmul when searching, bounds the float32 scratch space
+SEARCH_BLOCK_ROWS = 8192
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def quantize(vectors, dtype):
+    # Returns the stored matrix and, for int8, the per-vector scale to undo it
+    if dtype == 'float32':
+        return vectors.astype(np.float32), None
+    if dtype == 'float16':
+        return vectors.astype(np.float16), None
+    if dtype == 'int8':
+        scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127.0
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    raise ValueError(f"LOCAL_INDEX_DTYPE must be one of {', '.join(LOCAL_INDEX_DTYPES)}, got {dtype!r}")
+
+
+def dequantize(data, scales):
+    vectors = np.asarray(data, dtype=np.float32)
+    return vectors * scales[:, None] if scales is not None else vectors
+
+
+def kmeans(vectors, nlist, iterations=KMEANS_ITERATIONS, seed=0):
+    # Spherical k-means over normalized vectors, good enough for an IVF coarse quantizer
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        for i in range(nlist):
+            members = vectors[assignments == i]
+            if len(members):
+                centroids[i] = members.mean(axis=0)
+        centroids = normalize(centroids)
+    return centroids, np.argmax(vectors @ centroids.T, axis=1)
+
+
+def read_generation(path=LOCAL_INDEX_PATH):
+    # Generation of the build currently published at path, without mapping it
+    with open(os.path.join(path, 'meta.json')) as f:
+        return json.load(f)['generation']
+
+
+class LocalIndexWriter:
+    # Holds the whole index in memory while the indexer runs; loads the previous
+    # build first so an incremental run only adds and removes what changed
+    def __init__(self, path=LOCAL_INDEX_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.chunks = {}
+        self.generation = 0
+        self.dirty = False
+        self.exists = os.path.exists(os.path.join(path, 'meta.json'))
+        if self.exists:
+            index = LocalVectorIndex(path)
+            self.generation = index.generation
+            vectors = dequantize(index.vectors, index.scales)
+            for row in range(len(index)):
+                chunk = index.chunk(row)
+                self.chunks[chunk['id']] = (chunk, vectors[row])
+        os.makedirs(path, exist_ok=True)
+
+    def add(self, doc_id, content, pdf_filename, page, embedding):
+        chunk = {'id': doc_id, 'content': content, 'pdf_filename': pdf_filename, 'page': page}
+        with self.lock:
+            self.chunks[doc_id] = (chunk, embedding)
+            self.dirty = True
+
+    def delete(self, doc_ids):
+        with self.lock:
+            for doc_id in doc_ids:
+                if self.chunks.pop(doc_id, None) is not None:
+                    self.dirty = True
+
+    def save(self, dtype=LOCAL_INDEX_DTYPE, nlist=LOCAL_INDEX_NLIST):
+        with self.lock:
+            entries = list(self.chunks.values())
+        chunks = [chunk for chunk, _ in entries]
+        vectors = normalize([vector for _, vector in entries]) if entries else np.zeros((0, 0), np.float32)
+
+        centroids = None
+        list_offsets = None
+        nlist = min(nlist, len(chunks))
+        if nlist > 1:
+            # Store each inverted list contiguously so a probe is a single slice
+            centroids, assignments = kmeans(vectors, nlist)
+            order = np.argsort(assignments, kind='stable')
+            vectors = vectors[order]
+            chunks = [chunks[i] for i in order]
+            list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=nlist))])
+
+        data, scales = quantize(vectors, dtype)
+        generation = self.generation + 1
+        files = {
+            'vectors': f'vectors-{generation}.npy',
+            'texts': f'texts-{generation}.bin',
+            'offsets': f'offsets-{generation}.npy',
+            'rows': f'rows-{generation}.npy',
+        }
+        np.save(os.path.join(self.path, files['vectors']), data)
+        if scales is not None:
+            files['scales'] = f'scales-{generation}.npy'
+            np.save(os.path.join(self.path, files['scales']), scales)
+        if centroids is not None:
+            files['centroids'] = f'centroids-{generation}.npy'
+            files['list_offsets'] = f'list_offsets-{generation}.npy'
+            np.save(os.path.join(self.path, files['centroids']), centroids)
+            np.save(os.path.join(self.path, files['list_offsets']), list_offsets)
+
+        offsets = np.zeros(len(chunks) + 1, dtype=np.int64)
+        with open(os.path.join(self.path, files['texts']), 'wb') as f:
+            for i, chunk in enumerate(chunks):
+                encoded = chunk['content'].encode('utf-8')
+                f.write(encoded)
+                offsets[i + 1] = offsets[i] + len(encoded)
+        np.save(os.path.join(self.path, files['offsets']), offsets)
+
+        filenames = sorted({chunk['pdf_filename'] for chunk in chunks})
+        file_numbers = {name: i for i, name in enumerate(filenames)}
+        ids = [chunk['id'].encode('utf-8') for chunk in chunks]
+        rows = np.zeros(len(chunks), dtype=[('id', f'S{max(map(len, ids), default=1)}'), ('file', np.int32), ('page', np.int32)])
+        rows['id'] = ids
+        rows['file'] = [file_numbers[chunk['pdf_filename']] for chunk in chunks]
+        rows['page'] = [chunk['page'] or 0 for chunk in chunks]
+        np.save(os.path.join(self.path, files['rows']), rows)
+
+        # meta.json names the live files; swapping it in is what publishes the build.
+        # Processes that mapped the previous files keep reading them (an unlinked
+        # file stays mapped) until their next search sees the new generation.
+        meta = {'generation': generation, 'dtype': dtype, 'count': len(chunks), 'files': files, 'filenames': filenames}
+        tmp_path = os.path.join(self.path, 'meta.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, os.path.join(self.path, 'meta.json'))
+        self.generation = generation
+        self.dirty = False
+
+        for name in os.listdir(self.path):
+            if name not in files.values() and name != 'meta.json' and name.rsplit('-', 1)[-1].split('.')[0].isdigit():
+                os.remove(os.path.join(self.path, name))
+        return generation
+
+
+class LocalVectorIndex:
+    def __init__(self, path=LOCAL_INDEX_PATH):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        files = meta['files']
+        self.generation = meta['generation']
+        self.dtype = meta['dtype']
+        self.filenames = meta['filenames']
+        self.vectors = np.load(os.path.join(path, files['vectors']), mmap_mode='r')
+        self.offsets = np.load(os.path.join(path, files['offsets']), mmap_mode='r')
+        self.rows = np.load(os.path.join(path, files['rows']), mmap_mode='r')
+        self.scales = np.load(os.path.join(path, files['scales']), mmap_mode='r') if 'scales' in files else None
+        self.centroids = np.load(os.path.join(path, files['centroids'])) if 'centroids' in files else None
+        self.list_offsets = np.load(os.path.join(path, files['list_offsets'])) if 'list_offsets' in files else None
+        self.texts = None
+        if self.offsets[-1] > 0:  # mmap cannot map an empty file
+            with open(os.path.join(path, files['texts']), 'rb') as f:
+                self.texts = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def text(self, row):
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        return self.texts[start:end].decode('utf-8') if end > start else ''
+
+    def chunk(self, row):
+        # Only the rows a query returns are ever decoded into Python objects
+        record = self.rows[row]
+        return {
+            'id': record['id'].decode('utf-8'),
+            'content': self.text(row),
+            'pdf_filename': self.filenames[record['file']],
+            'page': int(record['page'])
+        }
+
+    def _score(self, start, end, query):
+        scores = np.empty(end - start, dtype=np.float32)
+        for block in range(start, end, SEARCH_BLOCK_ROWS):
+            block_end = min(block + SEARCH_BLOCK_ROWS, end)
+            scores[block - start:block_end - start] = np.asarray(self.vectors[block:block_end], dtype=np.float32) @ query
+        if self.scales is not None:
+            scores *= self.scales[start:end]
+        return scores
+
+    def search(self, query_vector, top_n=5, nprobe=LOCAL_INDEX_NPROBE):
+        # Returns (chunk, cosine similarity) pairs, best first
+        if not len(self):
+            return []
+        query = normalize(query_vector)
+        if self.centroids is None:
+            ranges = [(0, len(self))]
+        else:
+            probes = np.argsort(self.centroids @ query)[::-1][:nprobe]
+            ranges = [(int(self.list_offsets[i]), int(self.list_offsets[i + 1])) for i in probes]
+        candidates = np.concatenate([np.arange(start, end) for start, end in ranges])
+        scores = np.concatenate([self._score(start, end, query) for start, end in ranges])
+        top_n = min(top_n, len(candidates))
+        if top_n == 0:
+            return []
+        best = np.argpartition(-scores, top_n - 1)[:top_n]
+        best = best[np.argsort(-scores[best])]
+        return [(self.chunk(candidates[i]), float(scores[i])) for i in best]
+
+
+class LocalIndexReader:
+    # What the apps search. Every search reads meta.json's generation and maps the
+    # new build once the indexer has published one; until the first build there is
+    # nothing to map and searches find nothing.
+    def __init__(self, path=LOCAL_INDEX_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.index = None
+
+    def generation(self):
+        try:
+            return read_generation(self.path)
+        except FileNotFoundError:
+            return 0
+
+    def current(self):
+        generation = self.generation()
+        if not generation:
+            return None
+        index = self.index
+        if index is not None and index.generation == generation:
+            return index
+        with self.lock:
+            if self.index is None or self.index.generation != generation:
+                try:
+                    self.index = LocalVectorIndex(self.path)
+                except FileNotFoundError:
+                    # A newer build replaced this one while it was being mapped; the next search maps that
+                    pass
+            return self.index
+
+    def __len__(self):
+        index = self.current()
+        return len(index) if index is not None else 0
+
+    def search(self, query_vector, top_n=5, nprobe=LOCAL_INDEX_NPROBE):
+        index = self.current()
+        return index.search(query_vector, top_n, nprobe) if index is not None else []
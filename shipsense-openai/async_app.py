@@ -0,0 +1,258 @@
+import time
+import asyncio
+import logging
+from functools import partial
+from aiohttp import web
+from elasticsearch import AsyncElasticsearch
+from sqlalchemy.exc import SQLAlchemyError
+
+# asyncio serving mode with the same routes as app.py. Handlers await the LLM and
+# Elasticsearch instead of blocking a thread on them, so one process holds many
+# requests in flight; SQL and query embeddings run in a bounded thread pool.
+#
+#   python async_app.py        # listens on ASYNC_PORT (8080)
+#
+# Models, caches, the pooled engine and the LangChain objects come from app.py.
+import app as sync_app
+from app import (answer_cache, sql_cache, query_cache, package_lookup, db_chain, llm, local_index, readiness, engine,
+                 encode_queries, bm25_request, knn_request, mget_request, search_hits, found_hits, search_prompt,
+                 execute_sql_query)
+from retrieval import RETRIEVAL_MODE, HYBRID_CANDIDATES, reciprocal_rank_fusion
+from vector_store import normalize
+from vector_encoding import vector_payload
+from cache import ANSWER_CACHE_SIMILARITY
+from sql_cache import answer_prompt, bind_params, clean_sql, parameterize_sql, question_template, rows_answer
+from tracking import lookup_answer, lookup_tracking_number
+from db import pool_stats
+from metrics import SEARCH_DURATION, render_metrics
+from batching import (EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_WINDOW_MS, LLM_BATCH_SIZE, LLM_BATCH_WINDOW_MS,
+                      AsyncMicroBatcher)
+from tracing import span, traced_async_tokens
+from async_serving import (ASYNC_HOST, ASYNC_PORT, Upstreams, request_wants_stream, single_token, sse_stream,
+                           tracing_middleware)
+
+routes = web.RouteTableDef()
+# Flask's encoder, so dates and decimals in /ask rows serialize as they do in app.py
+dumps = sync_app.app.json.dumps
+
+
+async def encode_batch(app, queries):
+    return await app['upstreams'].run_sync('embedding', encode_queries, queries)
+
+
+async def complete_batch(app, prompts):
+    # The completions API takes a list of prompts, so a batch is one request
+    client = await app['upstreams'].load('llm', llm)
+    async with app['upstreams'].limit('llm'):
+        result = await client.agenerate(prompts)
+    return [generations[0].text for generations in result.generations]
+
+
+async def embed(request, query):
+    # Cache hits are answered on the loop, only a read of the shared SQLite file goes to a thread
+    upstreams = request.app['upstreams']
+    with span('embedding'):
+        vector = await upstreams.cached(query_cache.embedding, query)
+        if vector is None:
+            vector = await request.app['embedder'].submit(query)
+            await upstreams.cached(query_cache.put_embedding, query, vector)
+        return vector
+
+
+async def es_search(request, search_request):
+    async with request.app['upstreams'].limit('search'):
+        return search_hits(await request.app['es'].search(**search_request))
+
+
+async def fetch_documents(request, ids):
+    if not ids:
+        return []
+    async with request.app['upstreams'].limit('search'):
+        return found_hits(await request.app['es'].mget(**mget_request(ids)))
+
+
+async def search_documents(request, query, top_n):
+    if RETRIEVAL_MODE == 'bm25':
+        with span('retrieval'):
+            return await es_search(request, bm25_request(query, top_n))
+    # Embed the query once, encoded like the indexed vectors (INDEX_VECTOR_TYPE), for the kNN leg
+    query_vector = vector_payload(await embed(request, query))
+    with span('retrieval'):
+        if RETRIEVAL_MODE == 'knn':
+            return await es_search(request, knn_request(query_vector, top_n))
+        # Both legs of a hybrid query run at the same time
+        ranked_lists = await asyncio.gather(
+            es_search(request, bm25_request(query, HYBRID_CANDIDATES)),
+            es_search(request, knn_request(query_vector, HYBRID_CANDIDATES))
+        )
+        return reciprocal_rank_fusion(ranked_lists)[:top_n]
+
+
+async def get_top_documents(request, query, top_n=5):
+    upstreams = request.app['upstreams']
+    if local_index is not None:
+        # The local index holds vectors only, so it always answers with kNN. It
+        # searches in memory, so only the query embedding is worth caching.
+        query_vector = await embed(request, query)
+        with span('retrieval'):
+            matches = await upstreams.run_sync('search', local_index.search, query_vector, top_n)
+        return [chunk['content'] for chunk, _ in matches]
+    # A repeated query reads the chunks it found last time by id, until the indexer bumps the generation
+    scope = f"{RETRIEVAL_MODE}:{top_n}"
+    ids = await upstreams.cached(query_cache.results, query, scope)
+    if ids is not None:
+        with span('retrieval'):
+            return [content for _, content in await fetch_documents(request, ids)]
+    results = await search_documents(request, query, top_n)
+    await upstreams.cached(query_cache.put_results, query, scope, [doc_id for doc_id, _ in results])
+    return [content for _, content in results]
+
+
+# Semantic Search Endpoint
+@routes.post('/search')
+async def search(request):
+    started = time.perf_counter()
+    body = await request.json()
+    query = body.get('query')
+    stream = request_wants_stream(request, body)
+    upstreams = request.app['upstreams']
+
+    try:
+        # Repeat questions are answered from the cache; only a due index version check leaves the loop
+        query_vector = normalize(await embed(request, query)) if ANSWER_CACHE_SIMILARITY > 0 else None
+        with span('cache'):
+            cached = await upstreams.cached(answer_cache.get, query, query_vector)
+        if cached is not None:
+            if stream:
+                return await sse_stream(request, single_token(cached), started)
+            return web.json_response({'answer': cached})
+
+        documents = await get_top_documents(request, query)
+        if not documents:
+            return web.json_response({'answer': 'No relevant documents found.'})
+
+        # Generate a response using the LLM
+        prompt = search_prompt(query, documents)
+        if stream:
+            client = await upstreams.load('llm', llm)
+            async with upstreams.limit('llm'):
+                return await sse_stream(request, traced_async_tokens(client.astream(prompt)), started,
+                                        on_complete=lambda answer: answer_cache.put(query, answer, query_vector))
+        with span('llm'):
+            response = await request.app['completions'].submit(prompt)
+        SEARCH_DURATION.observe(time.perf_counter() - started)
+        answer_cache.put(query, response, query_vector)
+        return web.json_response({'answer': response})
+    except Exception as e:
+        logging.error(f"Search query failed: {e}")
+        return web.json_response({'error': str(e)}, status=500)
+
+
+# Ask Endpoint
+@routes.post('/ask')
+async def ask(request):
+    query = (await request.json()).get('query')
+    upstreams = request.app['upstreams']
+
+    try:
+        # Plain tracking-number lookups are answered straight from the database
+        tracking_number = lookup_tracking_number(query)
+        if tracking_number is not None:
+            with span('lookup'):
+                result = await upstreams.run_sync('db', package_lookup.find, tracking_number)
+            return web.json_response({'answer': lookup_answer(tracking_number, result), 'rows': result}, dumps=dumps)
+
+        # Questions that differ only in their tracking number reuse one cached statement
+        template, params = question_template(query)
+        with span('cache'):
+            cached_sql = await upstreams.cached(sql_cache.get, template) if params else None
+        if cached_sql is not None:
+            result = await upstreams.run_sync('db', execute_sql_query, cached_sql, bind_params(params))
+        else:
+            # Use LangChain to generate the SQL query, then execute it
+            with span('sql_generation'):
+                chain = await upstreams.load('db', db_chain)
+                async with upstreams.limit('llm'):
+                    sql_query = clean_sql(await chain.arun(query))
+            result = await upstreams.run_sync('db', execute_sql_query, sql_query)
+
+            # Only a statement that ran and takes the identifiers as bind parameters is cached
+            template_sql = parameterize_sql(sql_query, params)
+            if template_sql is not None:
+                sql_cache.put(template, template_sql)
+
+        # The LLM phrases the answer from the rows, as the chain did; the rows come along.
+        # Rows from a cached statement are answered without it, so a hit never waits for the LLM
+        if cached_sql is not None:
+            answer = rows_answer(result)
+        else:
+            with span('llm'):
+                answer = (await request.app['completions'].submit(answer_prompt(query, result))).strip()
+        return web.json_response({'answer': answer, 'rows': result}, dumps=dumps)
+    except SQLAlchemyError as e:
+        logging.error(f"SQL query failed: {e}")
+        return web.json_response({'error': str(e)}, status=400)
+    except Exception as e:
+        logging.error(f"Ask query failed: {e}")
+        return web.json_response({'error': str(e)}, status=500)
+
+
+# Readiness probe: 503 until the warm-up has loaded the model and LangChain
+@routes.get('/ready')
+async def ready(request):
+    is_ready, components = readiness.status()
+    return web.json_response({'ready': is_ready, 'components': components}, status=200 if is_ready else 503)
+
+
+@routes.get('/metrics')
+async def metrics(request):
+    return web.Response(body=render_metrics().encode('utf-8'), headers={'Content-Type': 'text/plain; version=0.0.4'})
+
+
+@routes.get('/cache/stats')
+async def cache_stats(request):
+    return web.json_response({'search': answer_cache.stats(), 'ask': sql_cache.stats(), 'queries': query_cache.stats()})
+
+
+@routes.get('/db/stats')
+async def db_stats(request):
+    return web.json_response(pool_stats(engine))
+
+
+# In-flight and queued calls per upstream against their concurrency limits
+@routes.get('/upstreams/stats')
+async def upstream_stats(request):
+    return web.json_response(request.app['upstreams'].stats())
+
+
+@routes.get('/batch/stats')
+async def batch_stats(request):
+    return web.json_response({'embedding': request.app['embedder'].stats(), 'llm': request.app['completions'].stats()})
+
+
+async def on_startup(app):
+    app['upstreams'] = Upstreams()
+    # Concurrent requests share one model.encode call and one completion request (see batching.py)
+    app['embedder'] = AsyncMicroBatcher(partial(encode_batch, app), EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_WINDOW_MS,
+                                        name='embedding')
+    app['completions'] = AsyncMicroBatcher(partial(complete_batch, app), LLM_BATCH_SIZE, LLM_BATCH_WINDOW_MS,
+                                           name='llm')
+    app['es'] = AsyncElasticsearch(sync_app.es_hosts)
+
+
+async def on_cleanup(app):
+    await app['es'].close()
+    app['upstreams'].close()
+
+
+def create_app():
+    # Latency breakdown of /search and /ask, exported at /metrics (see tracing.py)
+    app = web.Application(middlewares=[tracing_middleware()])
+    app.add_routes(routes)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+if __name__ == '__main__':
+    web.run_app(create_app(), host=ASYNC_HOST, port=ASYNC_PORT)
@@ -0,0 +1,144 @@
+import os
+import asyncio
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from aiohttp import web
+from cache import BLOCKING
+from db import DB_MAX_OVERFLOW, DB_POOL_SIZE
+from streaming import SSE_HEADERS, AnswerRecorder, sse_event
+from tracing import finish_trace, start_trace
+
+# Shared pieces of the asyncio serving mode (async_app.py). Every upstream gets
+# its own concurrency bound, so a slow LLM cannot starve search or SQL and a
+# burst of requests queues in the process instead of piling onto a service.
+UPSTREAM_LIMITS = {
+    'llm': int(os.getenv('LLM_CONCURRENCY', '32')),
+    'search': int(os.getenv('SEARCH_CONCURRENCY', '32')),
+    # SQL runs on the pooled engine in threads; more than the pool holds would only wait for a connection
+    'db': int(os.getenv('DB_CONCURRENCY', str(DB_POOL_SIZE + DB_MAX_OVERFLOW))),
+    # Query embeddings are CPU bound; the model releases the GIL, but cores are few
+    'embedding': int(os.getenv('EMBEDDING_CONCURRENCY', '2')),
+    # Cache lookups that need the SQLite tier or a version check; hits in memory never take a slot
+    'cache': int(os.getenv('CACHE_CONCURRENCY', '4'))
+}
+ASYNC_HOST = os.getenv('ASYNC_HOST', '0.0.0.0')
+ASYNC_PORT = int(os.getenv('ASYNC_PORT', '8080'))
+
+
+class Upstreams:
+    # Created in the server's startup hook so the semaphores belong to its event loop
+    def __init__(self, limits=UPSTREAM_LIMITS):
+        self.limits = dict(limits)
+        self.semaphores = {name: asyncio.Semaphore(limit) for name, limit in self.limits.items()}
+        self.in_flight = {name: 0 for name in self.limits}
+        self.waiting = {name: 0 for name in self.limits}
+        # Blocking work (SQL, embeddings, sync-only client calls) runs here, never on the loop
+        self.executor = ThreadPoolExecutor(max_workers=self.limits['db'] + self.limits['embedding'] + self.limits['cache'] + 4,
+                                           thread_name_prefix='upstream')
+
+    def limit(self, name):
+        return _Slot(self, name)
+
+    async def run_sync(self, name, fn, *args, **kwargs):
+        # The request's context goes along, so spans opened in fn land in its trace
+        context = contextvars.copy_context()
+        async with self.limit(name):
+            return await asyncio.get_running_loop().run_in_executor(self.executor,
+                                                                    partial(context.run, fn, *args, **kwargs))
+
+    async def cached(self, fn, *args):
+        # fn is a cache lookup or put; it answers on the loop unless it needs I/O,
+        # so hits never queue behind slow retrievals for a thread
+        value = fn(*args, blocking=False)
+        if value is BLOCKING:
+            value = await self.run_sync('cache', fn, *args)
+        return value
+
+    async def load(self, name, component):
+        # A lazy.Lazy component; the first call builds it in the pool, so loading never blocks the loop
+        if component.loaded:
+            return component.get()
+        return await self.run_sync(name, component.get)
+
+    def stats(self):
+        return {name: {'limit': self.limits[name], 'in_flight': self.in_flight[name], 'waiting': self.waiting[name]}
+                for name in self.limits}
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+class _Slot:
+    def __init__(self, upstreams, name):
+        self.upstreams = upstreams
+        self.name = name
+
+    async def __aenter__(self):
+        upstreams = self.upstreams
+        upstreams.waiting[self.name] += 1
+        try:
+            await upstreams.semaphores[self.name].acquire()
+        finally:
+            upstreams.waiting[self.name] -= 1
+        upstreams.in_flight[self.name] += 1
+
+    async def __aexit__(self, *exc_info):
+        self.upstreams.in_flight[self.name] -= 1
+        self.upstreams.semaphores[self.name].release()
+
+
+async def sse_stream(request, tokens, started, on_complete=None):
+    # aiohttp counterpart of streaming.sse_response; tokens is an async iterator
+    response = web.StreamResponse(headers={**SSE_HEADERS, 'Content-Type': 'text/event-stream'})
+    await response.prepare(request)
+    recorder = AnswerRecorder(started)
+    try:
+        async for token in tokens:
+            if not token:
+                continue
+            recorder.add(token)
+            await response.write(sse_event({'token': token}).encode('utf-8'))
+    except Exception as e:
+        logging.error(f"Streaming the answer failed: {e}")
+        await response.write(sse_event({'error': str(e)}, event='error').encode('utf-8'))
+        return response
+    answer = recorder.finish()
+    if on_complete is not None:
+        on_complete(answer)
+    await response.write(sse_event({'answer': answer}, event='done').encode('utf-8'))
+    await response.write_eof()
+    return response
+
+
+def tracing_middleware(endpoints=('/search', '/ask')):
+    # aiohttp counterpart of tracing.init_tracing
+    @web.middleware
+    async def trace_request(request, handler):
+        if request.path not in endpoints:
+            return await handler(request)
+        trace = start_trace(request.path.strip('/'))
+        try:
+            response = await handler(request)
+            trace.status = response.status
+            if not response.prepared:
+                response.headers['Server-Timing'] = trace.server_timing()
+            return response
+        except web.HTTPException as e:
+            trace.status = e.status
+            raise
+        except Exception:
+            trace.status = 500
+            raise
+        finally:
+            finish_trace(trace)
+    return trace_request
+
+
+async def single_token(text):
+    yield text
+
+
+def request_wants_stream(request, body):
+    return bool(body.get('stream')) or 'text/event-stream' in request.headers.get('Accept', '')
@@ -0,0 +1,260 @@
+import os
+import json
+import time
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Upload stage of the indexers. Documents from every page window are packed into
+# requests of at most BULK_MAX_BYTES (and BULK_MAX_DOCS documents), which go out
+# BULK_CONCURRENCY at a time while embedding carries on. Documents the backend
+# rejects because it is overloaded (429, or 503 on Azure) are sent again on
+# their own after an exponential backoff, up to BULK_MAX_RETRIES times; the
+# request size is halved while the backend pushes back and grows again once it
+# keeps up. Other errors fail just the documents they belong to.
+BULK_MAX_BYTES = int(os.getenv('BULK_MAX_BYTES', str(5 * 1024 * 1024)))
+# Azure AI Search accepts at most 1000 documents per request
+BULK_MAX_DOCS = int(os.getenv('BULK_MAX_DOCS', '1000'))
+BULK_CONCURRENCY = int(os.getenv('BULK_CONCURRENCY', '4'))
+BULK_MAX_RETRIES = int(os.getenv('BULK_MAX_RETRIES', '8'))
+BULK_BACKOFF = float(os.getenv('BULK_BACKOFF', '0.5'))
+BULK_MAX_BACKOFF = float(os.getenv('BULK_MAX_BACKOFF', '30'))
+MIN_BULK_BYTES = 64 * 1024
+RETRY_STATUSES = (429, 503)
+
+# Outcome of a document that should be sent again later
+RETRY = object()
+
+
+def elasticsearch_lines(action):
+    # A helpers-style action ({'_op_type', '_index', '_id', '_source'}) as _bulk body lines
+    op_type = action.get('_op_type', 'index')
+    metadata = json.dumps({op_type: {'_index': action['_index'], '_id': action['_id']}})
+    if op_type == 'delete':
+        return f"{metadata}\n".encode('utf-8')
+    return f"{metadata}\n{json.dumps(action['_source'])}\n".encode('utf-8')
+
+
+def elasticsearch_bulk(es):
+    # Sends elasticsearch_lines() items in one _bulk request; the response lists
+    # an outcome per item in request order
+    def send(items):
+        try:
+            response = es.bulk(operations=b''.join(items))
+        except Exception as e:
+            if getattr(e, 'status_code', None) in RETRY_STATUSES:
+                return [RETRY] * len(items)
+            raise
+        if not response['errors']:
+            return [None] * len(items)
+        outcomes = []
+        for item in response['items']:
+            (op_type, result), = item.items()
+            status = result['status']
+            # Deleting a chunk that is already gone is not an error
+            if status < 300 or (op_type == 'delete' and status == 404):
+                outcomes.append(None)
+            elif status in RETRY_STATUSES:
+                outcomes.append(RETRY)
+            else:
+                outcomes.append(f"{status} {result.get('error')}")
+        return outcomes
+    return send
+
+
+def azure_search_batch(search_client):
+    # Items are (action, document) pairs, action being 'upload' or 'delete';
+    # one index_documents request carries both
+    from azure.search.documents import IndexDocumentsBatch
+
+    def send(items):
+        batch = IndexDocumentsBatch()
+        for action, document in items:
+            if action == 'delete':
+                batch.add_delete_actions([document])
+            else:
+                batch.add_upload_actions([document])
+        try:
+            results = search_client.index_documents(batch)
+        except Exception as e:
+            if getattr(e, 'status_code', None) in RETRY_STATUSES:
+                return [RETRY] * len(items)
+            raise
+        outcomes = []
+        for (action, _), result in zip(items, results):
+            if result.succeeded or (action == 'delete' and result.status_code == 404):
+                outcomes.append(None)
+            elif result.status_code in RETRY_STATUSES:
+                outcomes.append(RETRY)
+            else:
+                outcomes.append(f"{result.status_code} {result.error_message}")
+        return outcomes
+    return send
+
+
+def json_size(item):
+    return len(json.dumps(item[1]))
+
+
+class _Group:
+    # The documents of one add() call; on_done gets their errors once all are settled
+    def __init__(self, count, on_done):
+        self.remaining = count
+        self.errors = []
+        self.on_done = on_done
+
+
+class BulkUploader:
+    # send(items) makes one request and returns an outcome per item: None when it
+    # was stored, RETRY when the backend was too busy, or an error message.
+    # add() returns as soon as its items are queued; it blocks while
+    # 2 * concurrency requests are waiting, so a slow backend slows the pipeline
+    # down instead of filling memory. on_done callbacks run one at a time on the
+    # upload threads and may add() more items.
+    def __init__(self, send, size=len, name='bulk', max_bytes=BULK_MAX_BYTES, max_docs=BULK_MAX_DOCS,
+                 concurrency=BULK_CONCURRENCY, max_retries=BULK_MAX_RETRIES, backoff=BULK_BACKOFF,
+                 max_backoff=BULK_MAX_BACKOFF):
+        self.send = send
+        self.size = size
+        self.name = name
+        self.max_bytes = max_bytes
+        self.max_docs = max_docs
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.target_bytes = max_bytes
+        self.lock = threading.Condition()
+        self.callbacks = threading.RLock()
+        self.local = threading.local()
+        self.slots = threading.BoundedSemaphore(2 * concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f'{name}-bulk')
+        self.batch = []
+        self.batch_bytes = 0
+        self.in_flight = 0
+        self.started = time.perf_counter()
+        self.counters = {'documents': 0, 'requests': 0, 'bytes': 0, 'throttled': 0, 'retried': 0, 'failed': 0}
+
+    def add(self, items, on_done=None):
+        group = _Group(len(items), on_done)
+        if not items:
+            self._settle([], [group])
+            return
+        for item in items:
+            size = self.size(item)
+            full = None
+            with self.lock:
+                if self.batch and (self.batch_bytes + size > self.target_bytes or len(self.batch) >= self.max_docs):
+                    full = self._take()
+                self.batch.append((item, size, group))
+                self.batch_bytes += size
+            if full is not None:
+                self._submit(full)
+
+    def flush(self):
+        with self.lock:
+            full = self._take() if self.batch else None
+        if full is not None:
+            self._submit(full)
+
+    def join(self):
+        # Waits for everything added so far, including what callbacks add meanwhile
+        while True:
+            self.flush()
+            with self.lock:
+                if not self.batch and not self.in_flight:
+                    return
+                self.lock.wait(0.1)
+
+    def close(self):
+        self.join()
+        self.executor.shutdown()
+        stats = self.stats()
+        logging.info(f"Uploaded {stats['documents']} documents to {self.name} in {stats['requests']} requests "
+                     f"({stats['bytes'] / 1e6:.1f} MB, {stats['retried']} retried, {stats['failed']} failed) "
+                     f"in {stats['seconds']:.1f}s")
+
+    def stats(self):
+        with self.lock:
+            return {**self.counters, 'target_bytes': self.target_bytes,
+                    'seconds': round(time.perf_counter() - self.started, 2)}
+
+    def _take(self):
+        batch, self.batch, self.batch_bytes = self.batch, [], 0
+        self.in_flight += 1
+        return batch
+
+    def _submit(self, batch):
+        # Callbacks run on the upload threads; waiting for a slot there could wait on themselves
+        holds_slot = not getattr(self.local, 'in_callback', False)
+        if holds_slot:
+            self.slots.acquire()
+        self.executor.submit(self._run, batch, holds_slot)
+
+    def _run(self, batch, holds_slot):
+        settled = []
+        pending = batch
+        attempt = 0
+        try:
+            while pending:
+                try:
+                    outcomes = self.send([item for item, _, _ in pending])
+                    if len(outcomes) != len(pending):
+                        raise RuntimeError(f"{len(outcomes)} outcomes for {len(pending)} documents")
+                except Exception as e:
+                    logging.error(f"{self.name} bulk request of {len(pending)} documents failed: {e}")
+                    outcomes = [str(e)] * len(pending)
+                retry = [entry for entry, outcome in zip(pending, outcomes) if outcome is RETRY]
+                settled.extend((entry, outcome) for entry, outcome in zip(pending, outcomes) if outcome is not RETRY)
+                self._record(pending, outcomes, retry)
+                if retry and attempt >= self.max_retries:
+                    settled.extend((entry, f"still throttled after {attempt} retries") for entry in retry)
+                    retry = []
+                elif retry:
+                    # Full jitter, so throttled threads do not all come back at once
+                    time.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt)))
+                    attempt += 1
+                pending = retry
+        finally:
+            if holds_slot:
+                self.slots.release()
+            groups = []
+            for (_, _, group), error in settled:
+                if error is not None:
+                    group.errors.append(error)
+                groups.append(group)
+            self._settle(settled, groups)
+            with self.lock:
+                self.in_flight -= 1
+                self.lock.notify_all()
+
+    def _record(self, sent, outcomes, retry):
+        with self.lock:
+            self.counters['requests'] += 1
+            self.counters['bytes'] += sum(size for _, size, _ in sent)
+            self.counters['documents'] += sum(outcome is None for outcome in outcomes)
+            if retry:
+                self.counters['throttled'] += 1
+                self.counters['retried'] += len(retry)
+                self.target_bytes = max(min(MIN_BULK_BYTES, self.max_bytes), self.target_bytes // 2)
+            else:
+                self.target_bytes = min(self.max_bytes, self.target_bytes * 5 // 4)
+
+    def _settle(self, settled, groups):
+        failed = sum(error is not None for _, error in settled)
+        if failed:
+            with self.lock:
+                self.counters['failed'] += failed
+        with self.callbacks:
+            in_callback = getattr(self.local, 'in_callback', False)
+            self.local.in_callback = True
+            try:
+                for group in groups:
+                    group.remaining -= 1
+                    if group.remaining <= 0 and group.on_done is not None:
+                        try:
+                            group.on_done(group.errors)
+                        except Exception as e:
+                            logging.error(f"{self.name} upload callback failed: {e}")
+            finally:
+                self.local.in_callback = in_callback
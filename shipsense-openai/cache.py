@@ -0,0 +1,341 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# Answers to /search kept in memory, so a repeated question skips retrieval and the LLM
+ANSWER_CACHE_SIZE = int(os.getenv('ANSWER_CACHE_SIZE', '1024'))
+# Seconds an answer stays valid; 0 disables the cache
+ANSWER_CACHE_TTL = float(os.getenv('ANSWER_CACHE_TTL', '3600'))
+# Cosine similarity above which a differently worded question reuses a cached
+# answer, e.g. 0.95. 0 matches on the normalized query text only.
+ANSWER_CACHE_SIMILARITY = float(os.getenv('ANSWER_CACHE_SIMILARITY', '0'))
+# Seconds between checks of whether the search index has been rebuilt
+ANSWER_CACHE_VERSION_INTERVAL = float(os.getenv('ANSWER_CACHE_VERSION_INTERVAL', '30'))
+# Query embeddings and result ids kept in each process (see QueryCache); 0 disables it
+QUERY_CACHE_SIZE = int(os.getenv('QUERY_CACHE_SIZE', '4096'))
+# SQLite file shared by the app processes on a box as a second tier, e.g.
+# /dev/shm/shipsense-queries.db; unset keeps the cache in process
+QUERY_CACHE_PATH = os.getenv('QUERY_CACHE_PATH')
+# Rows the SQLite tier keeps before the oldest are dropped
+QUERY_CACHE_STORE_SIZE = int(os.getenv('QUERY_CACHE_STORE_SIZE', '100000'))
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+
+# What a lookup or put made with blocking=False returns, having done nothing,
+# when it would need I/O: the SQLite tier or a version check. The asyncio apps
+# answer everything else on the event loop and repeat only these in a thread.
+BLOCKING = object()
+
+
+def normalize_query(query):
+    # "What's the  Signature options fee?" and "whats the signature options fee" share a key
+    return ' '.join(_PUNCTUATION.sub('', query.lower()).split())
+
+
+class AnswerCache:
+    # LRU with a per-entry TTL. version_fn returns something that changes whenever
+    # the cached values go stale (the index is rebuilt, the schema changes); a new
+    # value empties the cache.
+    def __init__(self, max_size=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL, similarity=ANSWER_CACHE_SIMILARITY,
+                 version_fn=None, version_interval=ANSWER_CACHE_VERSION_INTERVAL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.similarity = similarity
+        self.version_fn = version_fn
+        self.version_interval = version_interval
+        self.version = None
+        self.version_checked = 0.0
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> (answer, expires, vector)
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.max_size > 0
+
+    def _version_due(self):
+        return self.version_fn is not None and time.monotonic() - self.version_checked >= self.version_interval
+
+    def _check_version(self):
+        if not self._version_due():
+            return
+        self.version_checked = time.monotonic()
+        try:
+            version = self.version_fn()
+        except Exception as e:
+            logging.error(f"Could not read the cache version: {e}")
+            return
+        with self.lock:
+            if version != self.version:
+                if self.version is not None:
+                    logging.info(f"Cache version changed ({self.version} -> {version}), dropping {len(self.entries)} cached entries")
+                    self.invalidations += 1
+                self.entries.clear()
+                self.version = version
+
+    def _similar(self, vector, now):
+        # Linear scan; the cache is small and a miss is about to cost an LLM call anyway
+        keys = [key for key, (_, expires, cached) in self.entries.items() if cached is not None and expires > now]
+        if not keys:
+            return None
+        matrix = np.stack([self.entries[key][2] for key in keys])
+        scores = matrix @ vector
+        best = int(np.argmax(scores))
+        return keys[best] if scores[best] >= self.similarity else None
+
+    def get(self, query, vector=None, blocking=True):
+        # vector is the normalized query embedding, only used when similarity matching is on
+        if not self.enabled:
+            return None
+        if not blocking and self._version_due():
+            return BLOCKING
+        self._check_version()
+        key = normalize_query(query)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] <= now:
+                del self.entries[key]
+                entry = None
+            if entry is None and self.similarity > 0 and vector is not None:
+                key = self._similar(vector, now)
+                entry = self.entries.get(key) if key is not None else None
+                if entry is not None:
+                    self.similar_hits += 1
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, query, answer, vector=None):
+        if not self.enabled:
+            return
+        key = normalize_query(query)
+        with self.lock:
+            self.entries[key] = (answer, time.monotonic() + self.ttl, vector)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.invalidations += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'similar_hits': self.similar_hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'version': self.version
+            }
+
+
+class QueryCache:
+    # Query embeddings and the ids of the top results retrieval returned, keyed
+    # by the normalized query. Each process keeps an LRU in front of an optional
+    # SQLite file (path) that the workers on a box share, so a query embedded or
+    # searched by one worker is a hit in the others too. Result ids are tagged
+    # with the index generation that version_fn returns and are ignored once the
+    # indexers bump it; embeddings only depend on the model and are kept.
+    def __init__(self, max_size=QUERY_CACHE_SIZE, path=QUERY_CACHE_PATH, store_size=QUERY_CACHE_STORE_SIZE,
+                 version_fn=None, version_interval=ANSWER_CACHE_VERSION_INTERVAL):
+        self.max_size = max_size
+        self.path = path
+        self.store_size = store_size
+        self.version_fn = version_fn
+        self.version_interval = version_interval
+        self.generation = None
+        self.version_checked = 0.0
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # (kind, key) -> (generation, value); embeddings have generation 0
+        self.local = threading.local()
+        self.pid = os.getpid()
+        self.writes = 0
+        self.counters = {'hits': 0, 'store_hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0,
+                         'store_errors': 0}
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    def _store(self):
+        # One connection per thread; a forked worker opens its own
+        if self.path is None:
+            return None
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.local = threading.local()
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            # Readers never wait for the writer, and a crash at worst loses recent entries
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS query_cache (kind TEXT, key TEXT, generation INTEGER, '
+                               'value BLOB, stored REAL, PRIMARY KEY (kind, key))')
+            self.local.connection = connection
+        return connection
+
+    def _version_due(self):
+        return self.version_fn is not None and time.monotonic() - self.version_checked >= self.version_interval
+
+    def _check_version(self):
+        if not self._version_due():
+            return
+        self.version_checked = time.monotonic()
+        try:
+            generation = self.version_fn()
+        except Exception as e:
+            logging.error(f"Could not read the index generation: {e}")
+            return
+        with self.lock:
+            if generation == self.generation:
+                return
+            if self.generation is not None:
+                logging.info(f"Index generation changed ({self.generation} -> {generation}), "
+                             f"dropping cached query results")
+                self.counters['invalidations'] += 1
+            self.generation = generation
+            for key in [key for key in self.entries if key[0] == 'results']:
+                del self.entries[key]
+        try:
+            store = self._store()
+            if store is not None:
+                # Only older generations; rows of a newer one, from a worker that saw it first, stay
+                store.execute("DELETE FROM query_cache WHERE kind = 'results' AND generation < ?", (generation,))
+        except sqlite3.Error as e:
+            self._store_failed(e)
+
+    def _store_failed(self, e):
+        # The SQLite tier is an optimization; without it lookups just miss
+        logging.error(f"Query cache store {self.path} failed: {e}")
+        with self.lock:
+            self.counters['store_errors'] += 1
+
+    def _get(self, kind, key, generation, blocking=True):
+        with self.lock:
+            entry = self.entries.get((kind, key))
+            if entry is not None and entry[0] == generation:
+                self.entries.move_to_end((kind, key))
+                self.counters['hits'] += 1
+                return entry[1]
+        if not blocking and self.path is not None:
+            return BLOCKING
+        row = None
+        try:
+            store = self._store()
+            if store is not None:
+                row = store.execute('SELECT value FROM query_cache WHERE kind = ? AND key = ? AND generation = ?',
+                                    (kind, key, generation)).fetchone()
+        except sqlite3.Error as e:
+            self._store_failed(e)
+        with self.lock:
+            self.counters['store_hits' if row is not None else 'misses'] += 1
+        return row[0] if row is not None else None
+
+    def _put(self, kind, key, generation, value, stored):
+        with self.lock:
+            self.entries[(kind, key)] = (generation, value)
+            self.entries.move_to_end((kind, key))
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.counters['evictions'] += 1
+            self.writes += 1
+            prune = self.writes % 1000 == 0
+        if stored is None:
+            return
+        try:
+            store = self._store()
+            if store is None:
+                return
+            store.execute('INSERT OR REPLACE INTO query_cache VALUES (?, ?, ?, ?, ?)',
+                          (kind, key, generation, stored, time.time()))
+            if prune:
+                store.execute('DELETE FROM query_cache WHERE rowid IN (SELECT rowid FROM query_cache '
+                              'ORDER BY stored DESC LIMIT -1 OFFSET ?)', (self.store_size,))
+        except sqlite3.Error as e:
+            self._store_failed(e)
+
+    def embedding(self, query, blocking=True):
+        if not self.enabled:
+            return None
+        key = normalize_query(query)
+        value = self._get('embedding', key, 0, blocking)
+        if value is BLOCKING:
+            return value
+        if isinstance(value, bytes):
+            value = np.frombuffer(value, dtype=np.float32)
+            self._put('embedding', key, 0, value, None)
+        return value
+
+    def put_embedding(self, query, vector, blocking=True):
+        if not self.enabled:
+            return None
+        if not blocking and self.path is not None:
+            return BLOCKING
+        vector = np.array(vector, dtype=np.float32)
+        vector.setflags(write=False)
+        self._put('embedding', normalize_query(query), 0, vector, vector.tobytes())
+
+    def results(self, query, scope, blocking=True):
+        # scope tells apart lookups that rank differently for the same query,
+        # e.g. the retrieval mode and the number of results
+        if not self.enabled:
+            return None
+        if not blocking and self._version_due():
+            return BLOCKING
+        self._check_version()
+        generation = self.generation
+        if generation is None:  # Results cannot be told apart from stale ones yet
+            return None
+        key = f"{scope}:{normalize_query(query)}"
+        value = self._get('results', key, generation, blocking)
+        if value is BLOCKING:
+            return value
+        if isinstance(value, bytes):
+            value = json.loads(value)
+            self._put('results', key, generation, value, None)
+        return list(value) if value is not None else None
+
+    def put_results(self, query, scope, ids, blocking=True):
+        generation = self.generation
+        if not self.enabled or generation is None:
+            return None
+        if not blocking and self.path is not None:
+            return BLOCKING
+        ids = list(ids)
+        self._put('results', f"{scope}:{normalize_query(query)}", generation, ids, json.dumps(ids).encode('utf-8'))
+
+    def stats(self):
+        with self.lock:
+            lookups = self.counters['hits'] + self.counters['store_hits'] + self.counters['misses']
+            return {
+                'size': len(self.entries),
+                'max_size': self.max_size,
+                'store': self.path,
+                **self.counters,
+                'hit_rate': (self.counters['hits'] + self.counters['store_hits']) / lookups if lookups else 0.0,
+                'generation': self.generation
+            }
@@ -0,0 +1,17 @@
+import os
+
+# Number of texts sent to the model in a single encode() call
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', '64'))
+
+
+def encode_batched(model, texts, batch_size=EMBEDDING_BATCH_SIZE):
+    # Encode texts in batches sorted by length so each batch pads to a similar
+    # token count, then put the vectors back in input order
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    embeddings = [None] * len(texts)
+    for start in range(0, len(order), batch_size):
+        batch = order[start:start + batch_size]
+        vectors = model.encode([texts[i] for i in batch], batch_size=batch_size)
+        for i, vector in zip(batch, vectors):
+            embeddings[i] = vector
+    return embeddings
@@ -0,0 +1,96 @@
+import os
+import time
+import logging
+import threading
+
+# The embedding model (torch) and LangChain are slow to import and the SQL chain
+# reflects the schema when built, so they are created on first use instead of at
+# import and a new process starts serving in about a second. With WARM_UP (the
+# default) a background thread builds them right after startup; /ready answers
+# 503 until it is done, so a load balancer only sends traffic to warm processes.
+WARM_UP = os.getenv('WARM_UP', 'true').lower() in ('1', 'true', 'yes')
+
+
+class Lazy:
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory
+        self.lock = threading.Lock()
+        self.value = None
+        self.loaded = False
+        self.error = None
+        self.seconds = None
+        # A process forked mid-load would inherit the lock held by a thread it does not have
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def get(self):
+        if self.loaded:
+            return self.value
+        with self.lock:
+            if not self.loaded:
+                start = time.perf_counter()
+                try:
+                    self.value = self.factory()
+                except Exception as e:
+                    self.error = e
+                    raise
+                self.seconds = time.perf_counter() - start
+                self.error = None
+                self.loaded = True
+                logging.info(f"Loaded {self.name} in {self.seconds:.1f}s")
+        return self.value
+
+    def state(self):
+        if self.loaded:
+            return {'state': 'loaded', 'seconds': round(self.seconds, 2)}
+        if self.lock.locked():
+            return {'state': 'loading'}
+        if self.error is not None:
+            return {'state': 'failed', 'error': str(self.error)}
+        return {'state': 'not loaded'}
+
+    def _after_fork(self):
+        if not self.loaded:
+            self.lock = threading.Lock()
+
+
+class Readiness:
+    # What /ready reports: ready once every component the app warms up has
+    # loaded. Without WARM_UP the process is ready at once and the first
+    # requests pay for loading.
+    def __init__(self, components, warm_up=WARM_UP):
+        self.components = list(components)
+        self.warm_up = warm_up
+        self.lock = threading.Lock()
+        self.pid = None
+        self.thread = None
+
+    def start(self):
+        if not self.warm_up:
+            return
+        with self.lock:
+            # Threads do not survive a fork, so each worker process warms up its own
+            # copy; after a failure the next /ready check tries again
+            forked = self.pid != os.getpid()
+            failed = self.thread is not None and not self.thread.is_alive() and not self.loaded()
+            if forked or failed:
+                self.pid = os.getpid()
+                self.thread = threading.Thread(target=self._warm_up, name='warm-up', daemon=True)
+                self.thread.start()
+
+    def loaded(self):
+        return all(component.loaded for component in self.components)
+
+    def status(self):
+        self.start()
+        ready = not self.warm_up or self.loaded()
+        return ready, {component.name: component.state() for component in self.components}
+
+    def _warm_up(self):
+        start = time.perf_counter()
+        for component in self.components:
+            try:
+                component.get()
+            except Exception as e:
+                logging.error(f"Warming up {component.name} failed: {e}")
+        logging.info(f"Warm-up finished in {time.perf_counter() - start:.1f}s")
@@ -5,9 +5,16 @@ db = SQLAlchemy()
 class Package(db.Model):
     __tablename__ = 'packages'
     id = db.Column(db.Integer, primary_key=True)
-    tracking_number = db.Column(db.String, unique=True, nullable=False)
+    tracking_number = db.Column(db.String(50), unique=True, nullable=False)
     dimensions = db.Column(db.String)
     weight = db.Column(db.Numeric)
     status = db.Column(db.String)
     eta = db.Column(db.Date)
     last_update = db.Column(db.DateTime, default=db.func.current_timestamp())
+
+class PackageHistory(db.Model):
+    __tablename__ = 'package_history'
+    id = db.Column(db.Integer, primary_key=True)
+    tracking_number = db.Column(db.String(50), db.ForeignKey('packages.tracking_number'), index=True, nullable=False)
+    location = db.Column(db.String(100))
+    timestamp = db.Column(db.DateTime, default=db.func.current_timestamp())
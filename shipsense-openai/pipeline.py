@@ -0,0 +1,110 @@
+import os
+import queue
+import threading
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait
+
+DEFAULT_WORKERS = int(os.getenv('INDEX_WORKERS', os.cpu_count() or 1))
+DEFAULT_QUEUE_DEPTH = int(os.getenv('INDEX_QUEUE_DEPTH', '4'))
+
+# Marks the end of a stage's output
+_DONE = object()
+
+
+def add_pipeline_arguments(parser):
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help='number of extraction processes')
+    parser.add_argument('--queue-depth', type=int, default=DEFAULT_QUEUE_DEPTH,
+                        help='max documents buffered between pipeline stages')
+
+
+def start_extraction_pool(workers=DEFAULT_WORKERS):
+    # Fork so workers inherit the already-imported extraction code instead of
+    # re-running the indexer script (and reloading the embedding model) on spawn.
+    # Call it on the main thread before the model is loaded: a process forked
+    # while torch's OpenMP threads or other threads hold locks can leave workers
+    # stuck on them. A fork pool starts all its workers on the first submit.
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'))
+    pool.submit(os.getpid).result()
+    return pool
+
+
+def _extract_stage(jobs, extract_fn, pool, workers, queue_depth, out_queue):
+    pending = {}
+
+    def drain():
+        # Results go out in submission order, so the page windows of a document
+        # reach embed_fn one after the other (the indexers carry the section
+        # heading from one window to the next)
+        for future in list(pending):
+            if not future.done():
+                return
+            name, source = pending.pop(future)
+            try:
+                out_queue.put((name, source, future.result()))
+            except Exception as e:
+                logging.error(f"Failed to extract {name}: {e}")
+
+    try:
+        for name, source in jobs:
+            pending[pool.submit(extract_fn, source)] = (name, source)
+            drain()
+            # Keep at most workers + queue_depth documents in flight
+            if len(pending) >= workers + queue_depth:
+                wait([next(iter(pending))])
+                drain()
+        wait(pending)
+        drain()
+    except Exception as e:
+        logging.error(f"Extraction stage failed: {e}")
+    finally:
+        out_queue.put(_DONE)
+
+
+def _upload_stage(upload_fn, in_queue):
+    while True:
+        item = in_queue.get()
+        if item is _DONE:
+            return
+        name, payload = item
+        try:
+            upload_fn(name, payload)
+        except Exception as e:
+            logging.error(f"Failed to upload {name}: {e}")
+
+
+def run_pipeline(jobs, extract_fn, embed_fn, upload_fn, workers=DEFAULT_WORKERS, queue_depth=DEFAULT_QUEUE_DEPTH,
+                 pool=None):
+    # jobs yields (name, source) pairs. extract_fn(source) runs in a process pool,
+    # embed_fn(name, source, extracted) runs in this thread (it owns the model) and
+    # upload_fn(name, payload) runs in a background thread. Bounded queues between
+    # the stages keep memory flat when one stage is slower than the others. pool
+    # comes from start_extraction_pool; without one it is started here.
+    own_pool = pool is None
+    if own_pool:
+        pool = start_extraction_pool(workers)
+    extracted = queue.Queue(maxsize=queue_depth)
+    embedded = queue.Queue(maxsize=queue_depth)
+
+    extractor = threading.Thread(target=_extract_stage, args=(jobs, extract_fn, pool, workers, queue_depth, extracted),
+                                 daemon=True)
+    uploader = threading.Thread(target=_upload_stage, args=(upload_fn, embedded), daemon=True)
+    extractor.start()
+    uploader.start()
+
+    while True:
+        item = extracted.get()
+        if item is _DONE:
+            break
+        name, source, result = item
+        try:
+            embedded.put((name, embed_fn(name, source, result)))
+        except Exception as e:
+            logging.error(f"Failed to embed {name}: {e}")
+
+    embedded.put(_DONE)
+    extractor.join()
+    uploader.join()
+    if own_pool:
+        pool.shutdown()
@@ -0,0 +1,34 @@
+import os
+
+# bm25 (keyword only), knn (dense vectors only) or hybrid (both, fused by rank)
+RETRIEVAL_MODE = os.getenv('RETRIEVAL_MODE', 'bm25')
+RETRIEVAL_MODES = ('bm25', 'knn', 'hybrid')
+if RETRIEVAL_MODE not in RETRIEVAL_MODES:
+    raise ValueError(f"RETRIEVAL_MODE must be one of {', '.join(RETRIEVAL_MODES)}, got {RETRIEVAL_MODE!r}")
+
+# How many candidates each retriever contributes before fusion
+HYBRID_CANDIDATES = int(os.getenv('HYBRID_CANDIDATES', '50'))
+# Damping constant from the reciprocal rank fusion paper
+RRF_K = int(os.getenv('RRF_K', '60'))
+
+
+def reciprocal_rank_fusion(ranked_lists, k=RRF_K):
+    # Each list holds (doc_id, content) pairs, best first. A document scores
+    # sum(1 / (k + rank)) over the lists it appears in.
+    scores = {}
+    contents = {}
+    for ranked in ranked_lists:
+        for rank, (doc_id, content) in enumerate(ranked, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+            contents[doc_id] = content
+    return [(doc_id, contents[doc_id]) for doc_id in sorted(scores, key=scores.get, reverse=True)]
+
+# search (Elasticsearch / Azure Cognitive Search) or local (the in-process vector_store index)
+RETRIEVAL_BACKEND = os.getenv('RETRIEVAL_BACKEND', 'search')
+RETRIEVAL_BACKENDS = ('search', 'local')
+if RETRIEVAL_BACKEND not in RETRIEVAL_BACKENDS:
+    raise ValueError(f"RETRIEVAL_BACKEND must be one of {', '.join(RETRIEVAL_BACKENDS)}, got {RETRIEVAL_BACKEND!r}")
+
+# Azure AI Search indexes carry no metadata, so index_pdfs_function.py keeps the
+# index generation (see cache.QueryCache) in a document of its own under this key
+INDEX_GENERATION_KEY = 'index-generation'
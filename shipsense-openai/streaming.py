@@ -0,0 +1,69 @@
+import json
+import time
+import logging
+from flask import Response, stream_with_context
+from metrics import SEARCH_DURATION, SEARCH_TIME_TO_FIRST_TOKEN
+
+# /search streams its answer as server-sent events when the request body has
+# "stream": true or the client accepts text/event-stream:
+#   data: {"token": "..."}      one per chunk the LLM produces
+#   event: done                 once, with the whole answer
+#   data: {"answer": "..."}
+#   event: error                instead of done if generation fails
+#   data: {"error": "..."}
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no'  # keep nginx and similar proxies from buffering the stream
+}
+
+
+def wants_stream(request):
+    return bool((request.json or {}).get('stream')) or 'text/event-stream' in request.headers.get('Accept', '')
+
+
+def sse_event(data, event=None):
+    prefix = f"event: {event}\n" if event else ''
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+
+class AnswerRecorder:
+    # Collects the streamed chunks and records time to first token and total time.
+    # started is the request's time.perf_counter(), so both cover retrieval and
+    # prompt building too.
+    def __init__(self, started):
+        self.started = started
+        self.parts = []
+
+    def add(self, token):
+        if not self.parts:
+            first_token = time.perf_counter() - self.started
+            SEARCH_TIME_TO_FIRST_TOKEN.observe(first_token)
+            logging.info(f"Time to first token: {first_token * 1000:.0f} ms")
+        self.parts.append(token)
+
+    def finish(self):
+        SEARCH_DURATION.observe(time.perf_counter() - self.started)
+        return ''.join(self.parts)
+
+
+def sse_response(tokens, started, on_complete=None):
+    # tokens yields answer chunks. on_complete gets the full answer once
+    # generation finished without error.
+    def generate():
+        recorder = AnswerRecorder(started)
+        try:
+            for token in tokens:
+                if not token:
+                    continue
+                recorder.add(token)
+                yield sse_event({'token': token})
+        except Exception as e:
+            logging.error(f"Streaming the answer failed: {e}")
+            yield sse_event({'error': str(e)}, event='error')
+            return
+        answer = recorder.finish()
+        if on_complete is not None:
+            on_complete(answer)
+        yield sse_event({'answer': answer}, event='done')
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=SSE_HEADERS)
@@ -1,9 +1,9 @@
-from sqlalchemy import create_engine, Column, Integer, String, DECIMAL, Date, DateTime, ForeignKey, func
-from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 import os
 from dotenv import load_dotenv
 import logging
+from models import Base, Package, PackageHistory
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -22,26 +22,6 @@ logging.info(f"DB Connection String: {db_connection_string}")
 
 # Initialize the SQLAlchemy engine
 engine = create_engine(db_connection_string)
-Base = declarative_base()
-
-# Define the Packages table
-class Package(Base):
-    __tablename__ = 'Packages'
-    id = Column(Integer, primary_key=True)
-    tracking_number = Column(String(50), unique=True, nullable=False)
-    dimensions = Column(String(100))
-    weight = Column(DECIMAL(10, 2))
-    status = Column(String(50))
-    eta = Column(Date)
-    last_update = Column(DateTime, server_default=func.now())
-
-# Define the PackageHistory table
-class PackageHistory(Base):
-    __tablename__ = 'PackageHistory'
-    id = Column(Integer, primary_key=True)
-    tracking_number = Column(String(50), ForeignKey('Packages.tracking_number'))
-    location = Column(String(100))
-    timestamp = Column(DateTime, server_default=func.now())
 
 # Create the tables
 Base.metadata.create_all(engine)
@@ -1,15 +1,31 @@
-from flask import Flask, render_template, request, jsonify, session
+from flask import Flask, Response, render_template, request, jsonify, session
 import os
+import time
 import openai
 from dotenv import load_dotenv
 from azure.search.documents import SearchClient
+from azure.search.documents.models import VectorizedQuery
 from azure.core.credentials import AzureKeyCredential
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy import create_engine
+from sqlalchemy import text
 import logging
-from langchain.llms import OpenAI
-from langchain_experimental.sql import SQLDatabaseChain
-from langchain.sql_database import SQLDatabase
+from retrieval import RETRIEVAL_BACKEND, RETRIEVAL_MODE, INDEX_GENERATION_KEY
+from vector_store import LocalIndexReader, normalize
+from vector_encoding import vector_payload
+from cache import AnswerCache, QueryCache, ANSWER_CACHE_SIMILARITY
+from db import DATABASE_URL, create_pooled_engine, pool_stats
+from metrics import SEARCH_DURATION, render_metrics
+from streaming import sse_response, wants_stream
+from tracing import init_tracing, span, traced_tokens
+from lazy import Lazy, Readiness
+from batching import (EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_WINDOW_MS, LLM_BATCH_CONCURRENCY, LLM_BATCH_SIZE,
+                      LLM_BATCH_WINDOW_MS, MicroBatcher)
+from models import Package, PackageHistory
+from tracking import PackageLookup, lookup_answer, lookup_tracking_number
+from sql_cache import (SQL_CACHE_SIZE, SQL_CACHE_TTL, answer_prompt, bind_params, clean_sql, parameterize_sql,
+                       question_template, rows_answer, schema_version)
+from context import CONTEXT_CANDIDATES, CONTEXT_TOKEN_BUDGET, build_context, observe_context
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -19,6 +35,8 @@ load_dotenv()
 
 app = Flask(__name__)
 app.secret_key = os.urandom(24)
+# Latency breakdown of /search and /ask, exported at /metrics (see tracing.py)
+init_tracing(app)
 
 
 # Initialize Azure Cognitive Search
@@ -28,37 +46,194 @@ search_index_name = os.getenv('SEARCH_INDEX_NAME')
 search_client = SearchClient(endpoint=search_service_endpoint, index_name=search_index_name,
                              credential=AzureKeyCredential(search_service_api_key))
 
+
+def load_embedding_model():
+    # sentence_transformers pulls in torch, so it is only imported here
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer('all-MiniLM-L6-v2')
+
+
+def load_llm():
+    from langchain.llms import OpenAI
+    return OpenAI(api_key=openai.api_key)
+
+
+def load_db_chain():
+    from langchain_experimental.sql import SQLDatabaseChain
+    from langchain.sql_database import SQLDatabase
+    # LangChain reuses the app's pooled engine instead of opening its own; building
+    # SQLDatabase reflects the schema
+    sql_database = SQLDatabase(engine)
+    # The chain only writes the SQL; /ask runs it and has the LLM phrase the answer from
+    # the rows, so cached statements are run and answered the same way
+    return SQLDatabaseChain(llm=llm.get(), database=sql_database, return_sql=True)
+
+
+# The model and LangChain are loaded on first use or by the warm-up (see lazy.py)
+model = Lazy('embedding model', load_embedding_model)
+# The embedding model is only needed when queries are answered or cached by vector
+needs_model = RETRIEVAL_MODE != 'bm25' or RETRIEVAL_BACKEND == 'local' or ANSWER_CACHE_SIMILARITY > 0
+
+# With RETRIEVAL_BACKEND=local, chunks come from the memory-mapped index built by index_pdfs_function.py,
+# remapped whenever it publishes a new generation
+local_index = LocalIndexReader() if RETRIEVAL_BACKEND == 'local' else None
+
 # Initialize Public OpenAI API
 openai.api_key = os.getenv('OPENAI_API_KEY')
 
 # Initialize Azure SQL Database
-db_connection_string = os.getenv('SQL_CONNECTION_STRING')
+db_connection_string = DATABASE_URL or os.getenv('SQL_CONNECTION_STRING')
 if not db_connection_string:
     logging.error("SQL_CONNECTION_STRING is not set. Please check your .env file.")
     exit(1)
 
-# Initialize the SQLAlchemy engine
+# Initialize the SQLAlchemy engine, pooled and shared by every request (see db.py for the pool settings)
 try:
-    engine = create_engine(db_connection_string)
+    engine = create_pooled_engine(db_connection_string)
     logging.info("Successfully connected to the database")
 except Exception as e:
     logging.error(f"Failed to connect to the database: {e}")
     exit(1)
 
 # Initialize LangChain components
-llm = OpenAI(api_key=openai.api_key)
-sql_database = SQLDatabase.from_uri(db_connection_string)
-db_chain = SQLDatabaseChain(llm=llm, database=sql_database)
+llm = Lazy('LLM client', load_llm)
+db_chain = Lazy('SQL chain', load_db_chain)
+
+
+def encode_queries(queries):
+    return model.get().encode(queries)
+
+
+def complete_batch(prompts):
+    # The completions API takes a list of prompts, so a batch is one request
+    result = llm.get().generate(prompts)
+    return [generations[0].text for generations in result.generations]
+
+
+# Concurrent requests share one model.encode call and one completion request (see batching.py)
+query_embedder = MicroBatcher(encode_queries, EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_WINDOW_MS, name='embedding')
+completion_batcher = MicroBatcher(complete_batch, LLM_BATCH_SIZE, LLM_BATCH_WINDOW_MS, LLM_BATCH_CONCURRENCY,
+                                  name='llm')
+
+# /ready turns 200 once these are loaded; the warm-up starts right away (WARM_UP)
+readiness = Readiness(([model] if needs_model else []) + [llm, db_chain])
+readiness.start()
+
+
+def index_version():
+    # The generation index_pdfs_function.py bumps after every run that changed the
+    # index, so cached answers and query results never outlive it
+    if local_index is not None:
+        return local_index.generation()
+    try:
+        document = search_client.get_document(INDEX_GENERATION_KEY, selected_fields=['generation'])
+    except ResourceNotFoundError:
+        return 0
+    return document['generation'] or 0
+
+
+answer_cache = AnswerCache(version_fn=index_version)
+# Embeddings and result ids of repeated queries, per process and optionally in a
+# SQLite file the workers share (QUERY_CACHE_PATH)
+query_cache = QueryCache(version_fn=index_version)
+# Parameterized SQL per /ask question template, dropped when the database schema changes
+sql_cache = AnswerCache(SQL_CACHE_SIZE, SQL_CACHE_TTL, similarity=0, version_fn=lambda: schema_version(engine))
+package_lookup = PackageLookup(engine, Package.__table__, PackageHistory.__table__)
+
+
+def search_arguments(query, top, query_vector=None):
+    # Keyword arguments for SearchClient.search, shared with the async client in async_app.py
+    if RETRIEVAL_MODE == 'bm25':
+        return {'search_text': query, 'select': ['id', 'content'], 'top': top}
+    # With search_text set too, Azure fuses the keyword and vector rankings with reciprocal rank fusion
+    vector_query = VectorizedQuery(vector=query_vector, k_nearest_neighbors=top, fields='embedding')
+    return {
+        'search_text': query if RETRIEVAL_MODE == 'hybrid' else None,
+        'vector_queries': [vector_query],
+        'select': ['id', 'content'],
+        'top': top
+    }
+
+
+def fetch_arguments(ids):
+    # Cached result ids read back in one request; document keys are URL-safe Base64, so never hold a comma
+    return {'search_text': '*', 'filter': f"search.in(id, '{','.join(ids)}', ',')", 'select': ['id', 'content'],
+            'top': len(ids)}
+
 
+def in_id_order(ids, contents):
+    # contents maps id -> content; the filter returns matches in no particular order
+    return [contents[doc_id] for doc_id in ids if doc_id in contents]
 
-def get_top_documents(query):
-    logging.info("Fetching top documents for query: %s", query)
-    results = search_client.search(search_text=query, select=['content'], top=200)
-    documents = [doc['content'] for doc in results]
+
+@span('embedding')
+def embed_query(query):
+    vector = query_cache.embedding(query)
+    if vector is None:
+        vector = query_embedder.submit(query)
+        query_cache.put_embedding(query, vector)
+    return vector
+
+
+@span('retrieval')
+def fetch_documents(ids):
+    if not ids:
+        return []
+    try:
+        return in_id_order(ids, {doc['id']: doc['content'] for doc in search_client.search(**fetch_arguments(ids))})
+    except HttpResponseError as e:
+        # Indexes created before the id field was filterable cannot be read by id; recreate them to cache results
+        logging.error("Could not read cached results by id, searching instead: %s", e)
+        return None
+
+
+def get_top_documents(query, top=CONTEXT_CANDIDATES):
+    logging.info("Fetching top documents for query: %s (%s)", query, RETRIEVAL_MODE)
+    # A repeated query reads the chunks it found last time by id, until the indexer bumps the
+    # generation; the local index searches in memory, so only its query embedding is cached
+    scope = f"{RETRIEVAL_MODE}:{top}"
+    ids = query_cache.results(query, scope) if local_index is None else None
+    documents = fetch_documents(ids) if ids is not None else None
+    if documents is None and local_index is not None:
+        # The local index holds vectors only, so it always answers with kNN
+        query_vector = embed_query(query)
+        with span('retrieval'):
+            documents = [chunk['content'] for chunk, _ in local_index.search(query_vector, top)]
+    elif documents is None:
+        # Embed the query once for the vector leg, encoded like the indexed vectors (INDEX_VECTOR_TYPE)
+        query_vector = vector_payload(embed_query(query), hex_bits=False) if RETRIEVAL_MODE != 'bm25' else None
+        with span('retrieval'):
+            # The pager fetches lazily, so the documents are read inside the span
+            results = list(search_client.search(**search_arguments(query, top, query_vector)))
+        query_cache.put_results(query, scope, [doc['id'] for doc in results])
+        documents = [doc['content'] for doc in results]
     logging.info("Retrieved %d documents", len(documents))
     return documents
 
 
+@span('context')
+def search_prompt(query, documents, chat_history):
+    # Construct the prompt with chat history and context
+    history_context = "\n".join([f"User: {entry['user']}\nAssistant: {entry['assistant']}" for entry in chat_history])
+    # Rerank, drop near-duplicates and keep what fits in the token budget
+    context, stats = build_context(query, documents)
+    observe_context(stats)
+    logging.info("Context tokens before %d after %d (budget %d), chunks before %d after %d",
+                 stats['tokens_before'], stats['tokens_after'], CONTEXT_TOKEN_BUDGET,
+                 stats['chunks_before'], stats['chunks_after'])
+
+    logging.debug("Context for OpenAI prompt: %s", context)
+    return f"You are a FedEx Chatbot Assitant. Based on given context and conversation between you the assitant and the user answer the following question :\n\nContext:\n{context}\n\nChat History:\n{history_context}\n\nQuestion: {query}\n\nAnswer:"
+
+
+@span('sql_execution')
+def execute_sql_query(sql_query, params=None):
+    logging.info("Executing SQL query: %s %s", sql_query, params or '')
+    with engine.connect() as connection:
+        rows = connection.execute(text(sql_query), params or {}).fetchall()
+    return [dict(row._mapping) for row in rows]
+
+
 @app.route('/')
 def index():
     return render_template("index.html")
@@ -67,10 +242,21 @@ def index():
 # Semantic Search Endpoint
 @app.route('/search', methods=['POST'])
 def search():
+    started = time.perf_counter()
     query = request.json.get('query')
+    stream = wants_stream(request)
     logging.info("Received search request with query: %s", query)
 
     try:
+        # Only opening questions are cached; with chat history the answer depends on the conversation
+        cacheable = not request.json.get('chat_history')
+        query_vector = normalize(embed_query(query)) if cacheable and ANSWER_CACHE_SIMILARITY > 0 else None
+        with span('cache'):
+            cached = answer_cache.get(query, query_vector) if cacheable else None
+        if cached is not None:
+            logging.info("Answered from cache")
+            return sse_response([cached], started) if stream else jsonify({'answer': cached})
+
         documents = get_top_documents(query)
 
         if not documents:
@@ -78,32 +264,59 @@ def search():
             return jsonify({'answer': 'No relevant documents found.'})
 
         # Retrieve chat history from the session
-        data = request.json
-        query = data.get('query')
-        chat_history = data.get('chat_history', [])
-        logging.info("Received search request with query: %s", query)
-        logging.info("Received chat history: %s", chat_history)
-        chat_history = data.get('chat_history', [])
-
-        print(chat_history)
-        # Construct the prompt with chat history and context
-        history_context = "\n".join([f"User: {entry['user']}\nAssistant: {entry['assistant']}" for entry in chat_history])
-        print(history_context)
-        context = "\n\n".join(documents)  # Limit to top 3 documents for coherence
+        chat_history = request.json.get('chat_history', [])
+        logging.debug("Received chat history: %s", chat_history)
+        prompt = search_prompt(query, documents, chat_history)
 
-        logging.info("Context for OpenAI prompt: %s", context)
-        prompt = f"You are a FedEx Chatbot Assitant. Based on given context and conversation between you the assitant and the user answer the following question :\n\nContext:\n{context}\n\nChat History:\n{history_context}\n\nQuestion: {query}\n\nAnswer:"
+        def answered(response):
+            logging.debug("OpenAI response: %s", response)
+            if cacheable:
+                answer_cache.put(query, response, query_vector)
 
-        response = llm(prompt=prompt)
+        if stream:
+            # Tokens are sent to the browser as the LLM produces them
+            return sse_response(traced_tokens(llm.get().stream(prompt)), started, on_complete=answered)
 
-
-        logging.info("OpenAI response: %s", response)
+        with span('llm'):
+            response = completion_batcher.submit(prompt)
+        SEARCH_DURATION.observe(time.perf_counter() - started)
+        answered(response)
         return jsonify({'answer': response})
     except Exception as e:
         logging.error("Search query failed: %s", e)
         return jsonify({'error': str(e)}), 500
 
 
+# Readiness probe: 503 until the warm-up has loaded the model and LangChain
+@app.route('/ready', methods=['GET'])
+def ready():
+    is_ready, components = readiness.status()
+    return jsonify({'ready': is_ready, 'components': components}), 200 if is_ready else 503
+
+
+# Prometheus metrics, including time to first token of streamed answers
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
+# Answer and SQL cache hit/miss counters
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify({'search': answer_cache.stats(), 'ask': sql_cache.stats(), 'queries': query_cache.stats()})
+
+
+# Connection pool usage and checkout wait times
+@app.route('/db/stats', methods=['GET'])
+def db_stats():
+    return jsonify(pool_stats(engine))
+
+
+# Batch sizes of the query embedding and completion coalescers
+@app.route('/batch/stats', methods=['GET'])
+def batch_stats():
+    return jsonify({'embedding': query_embedder.stats(), 'llm': completion_batcher.stats()})
+
 # Ask Endpoint
 @app.route('/ask', methods=['POST'])
 def ask():
@@ -111,10 +324,42 @@ def ask():
     logging.info("Received ask request with query: %s", query)
 
     try:
-        # Use LangChain to generate and execute the SQL query
-        result = db_chain.run(query)
-        logging.info("SQL query executed successfully, retrieved result: %s", result)
-        return jsonify(result)
+        # Plain tracking-number lookups are answered straight from the database
+        tracking_number = lookup_tracking_number(query)
+        if tracking_number is not None:
+            with span('lookup'):
+                result = package_lookup.find(tracking_number)
+            logging.info("Looked up tracking number %s: %d package(s)", tracking_number, len(result))
+            return jsonify({'answer': lookup_answer(tracking_number, result), 'rows': result})
+
+        # Questions that differ only in their tracking number reuse one cached statement
+        template, params = question_template(query)
+        with span('cache'):
+            cached_sql = sql_cache.get(template) if params else None
+        if cached_sql is not None:
+            logging.info("Reusing cached SQL for: %s", template)
+            result = execute_sql_query(cached_sql, bind_params(params))
+        else:
+            # Use LangChain to generate the SQL query, then execute it
+            with span('sql_generation'):
+                sql_query = clean_sql(db_chain.get().run(query))
+            result = execute_sql_query(sql_query)
+
+            # Only a statement that ran and takes the identifiers as bind parameters is cached
+            template_sql = parameterize_sql(sql_query, params)
+            if template_sql is not None:
+                sql_cache.put(template, template_sql)
+        logging.info("SQL query executed successfully, retrieved %d rows", len(result))
+        logging.debug("SQL query result: %s", result)
+
+        # The LLM phrases the answer from the rows, as the chain did; the rows come along.
+        # Rows from a cached statement are answered without it, so a hit never waits for the LLM
+        if cached_sql is not None:
+            answer = rows_answer(result)
+        else:
+            with span('llm'):
+                answer = completion_batcher.submit(answer_prompt(query, result)).strip()
+        return jsonify({'answer': answer, 'rows': result})
     except SQLAlchemyError as e:
         logging.error("SQL query failed: %s", e)
         return jsonify({'error': str(e)}), 400
@@ -0,0 +1,193 @@
+import os
+import time
+import queue
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Request coalescing. Queries that arrive together are embedded in one
+# model.encode call, and non-streamed answers share one generation request where
+# the backend takes a list of prompts (OpenAI completions, HF endpoints with
+# HF_BATCH_GENERATION). A request waits at most the window for others to join.
+# A size of 1 or a window of 0 turns batching off.
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', '64'))
+EMBEDDING_BATCH_WINDOW_MS = float(os.getenv('EMBEDDING_BATCH_WINDOW_MS', '5'))
+LLM_BATCH_SIZE = int(os.getenv('LLM_BATCH_SIZE', '8'))
+LLM_BATCH_WINDOW_MS = float(os.getenv('LLM_BATCH_WINDOW_MS', '20'))
+# Generation batches in flight at once (Flask apps; async_app.py uses LLM_CONCURRENCY)
+LLM_BATCH_CONCURRENCY = int(os.getenv('LLM_BATCH_CONCURRENCY', '8'))
+
+
+class BatchStats:
+    def __init__(self, max_batch, window_ms):
+        self.max_batch = max_batch
+        self.window_ms = window_ms
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.largest = 0
+        self.failed = 0
+
+    def record(self, size, failed=False):
+        with self.lock:
+            self.batches += 1
+            self.items += size
+            self.largest = max(self.largest, size)
+            self.failed += failed
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'max_batch': self.max_batch,
+                'window_ms': self.window_ms,
+                'batches': self.batches,
+                'items': self.items,
+                'mean_batch_size': round(self.items / self.batches, 2) if self.batches else 0.0,
+                'largest_batch': self.largest,
+                'failed_batches': self.failed
+            }
+
+
+class _Pending:
+    def __init__(self, item):
+        self.item = item
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher:
+    # For the threaded Flask apps. submit() blocks the calling request thread; a
+    # collector thread gathers items until max_batch are waiting or window_ms has
+    # passed since the first, calls fn once with the list and hands each caller
+    # its element of the returned list. While `concurrency` batches are running,
+    # new items queue up and go out together in the next one.
+    def __init__(self, fn, max_batch, window_ms, concurrency=1, name='batch'):
+        self.fn = fn
+        self.max_batch = max_batch
+        self.window = window_ms / 1000
+        self.concurrency = concurrency
+        self.name = name
+        self.counters = BatchStats(max_batch, window_ms)
+        self.lock = threading.Lock()
+        self.pid = None
+
+    @property
+    def enabled(self):
+        return self.max_batch > 1 and self.window > 0
+
+    def submit(self, item):
+        if not self.enabled:
+            return self.fn([item])[0]
+        pending = _Pending(item)
+        self._queue().put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def stats(self):
+        return self.counters.snapshot()
+
+    def _queue(self):
+        with self.lock:
+            # Threads do not survive a fork, so each worker process starts its own collector
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.items = queue.Queue()
+                self.slots = threading.BoundedSemaphore(self.concurrency)
+                self.executor = ThreadPoolExecutor(max_workers=self.concurrency,
+                                                   thread_name_prefix=f'{self.name}-batch')
+                threading.Thread(target=self._collect, name=f'{self.name}-batcher', daemon=True).start()
+            return self.items
+
+    def _collect(self):
+        while True:
+            self.slots.acquire()
+            batch = [self.items.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self.items.get(timeout=remaining) if remaining > 0 else self.items.get_nowait())
+                except queue.Empty:
+                    break
+            self.executor.submit(self._run, batch)
+
+    def _run(self, batch):
+        try:
+            results = self.fn([pending.item for pending in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(f"{self.name} batch returned {len(results)} results for {len(batch)} items")
+        except Exception as e:
+            self.counters.record(len(batch), failed=True)
+            for pending in batch:
+                pending.error = e
+        else:
+            self.counters.record(len(batch))
+            for pending, result in zip(batch, results):
+                pending.result = result
+        finally:
+            self.slots.release()
+            for pending in batch:
+                pending.done.set()
+
+
+class AsyncMicroBatcher:
+    # asyncio counterpart for async_app.py; fn is a coroutine function taking the
+    # list of items. Concurrency is bounded by the upstream limits fn applies.
+    def __init__(self, fn, max_batch, window_ms, name='batch'):
+        self.fn = fn
+        self.max_batch = max_batch
+        self.window = window_ms / 1000
+        self.name = name
+        self.counters = BatchStats(max_batch, window_ms)
+        self.pending = []
+        self.timer = None
+        self.tasks = set()  # the loop only keeps weak references to running tasks
+
+    @property
+    def enabled(self):
+        return self.max_batch > 1 and self.window > 0
+
+    async def submit(self, item):
+        if not self.enabled:
+            return (await self.fn([item]))[0]
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((item, future))
+        if len(self.pending) >= self.max_batch:
+            self._flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def stats(self):
+        return self.counters.snapshot()
+
+    def _flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _run(self, batch):
+        try:
+            results = await self.fn([item for item, _ in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(f"{self.name} batch returned {len(results)} results for {len(batch)} items")
+        except Exception as e:
+            self.counters.record(len(batch), failed=True)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            self.counters.record(len(batch))
+            for (_, future), result in zip(batch, results):
+                # A caller that went away (client disconnected) has a cancelled future
+                if not future.done():
+                    future.set_result(result)
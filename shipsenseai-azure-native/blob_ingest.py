@@ -0,0 +1,84 @@
+import os
+import hashlib
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pdf_extraction import SharedPdf
+
+# Blobs downloaded ahead of the one being extracted, and ranged requests per download
+BLOB_PREFETCH = int(os.getenv('BLOB_PREFETCH', '2'))
+BLOB_DOWNLOAD_CONCURRENCY = int(os.getenv('BLOB_DOWNLOAD_CONCURRENCY', '4'))
+
+
+def download_pdf(container_client, blob):
+    # Streams the blob into shared memory, hashing it on the way, so it never
+    # touches the disk and is never held twice. Returns (SharedPdf, sha256).
+    downloader = container_client.get_blob_client(blob).download_blob(max_concurrency=BLOB_DOWNLOAD_CONCURRENCY)
+    pdf = SharedPdf(downloader.size, label=blob.name)
+    try:
+        digest = hashlib.sha256()
+        offset = 0
+        for chunk in downloader.chunks():
+            pdf.memory.buf[offset:offset + len(chunk)] = chunk
+            digest.update(chunk)
+            offset += len(chunk)
+    except Exception:
+        pdf.unlink()
+        raise
+    return pdf, digest.hexdigest()
+
+
+def prefetch(blobs, download, depth=BLOB_PREFETCH):
+    # Yields (blob, future) in order while the next `depth` downloads run.
+    # Downloads not yet started when the consumer stops are cancelled.
+    downloads = deque()
+    with ThreadPoolExecutor(max_workers=max(1, depth), thread_name_prefix='blob-download') as pool:
+        try:
+            while True:
+                while len(downloads) <= depth:
+                    blob = next(blobs, None)
+                    if blob is None:
+                        break
+                    downloads.append((blob, pool.submit(download, blob)))
+                if not downloads:
+                    return
+                yield downloads.popleft()
+        finally:
+            for _, future in downloads:
+                future.cancel()
+
+
+class BlobBuffers:
+    # The shared-memory copies of downloaded blobs that are still alive. The
+    # indexer releases each one once its windows are extracted; close() unlinks
+    # whatever is left, prefetched or in flight when the pipeline failed or was
+    # interrupted, so nothing stays behind in /dev/shm.
+    def __init__(self, container_client):
+        self.container_client = container_client
+        self.lock = threading.Lock()
+        self.buffers = {}
+        self.closed = False
+
+    def download(self, blob):
+        pdf, file_hash = download_pdf(self.container_client, blob)
+        with self.lock:
+            if not self.closed:
+                self.buffers[blob.name] = pdf
+                return pdf, file_hash
+        # Finished after close(), nobody will release it
+        pdf.unlink()
+        raise RuntimeError(f"Download of {blob.name} finished after the indexer stopped")
+
+    def release(self, blob_name):
+        with self.lock:
+            pdf = self.buffers.pop(blob_name, None)
+        if pdf is not None:
+            pdf.unlink()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            left = list(self.buffers.values())
+            self.buffers.clear()
+        for pdf in left:
+            pdf.unlink()
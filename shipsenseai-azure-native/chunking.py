@@ -0,0 +1,158 @@
+import os
+import re
+from collections import Counter, namedtuple
+from functools import lru_cache
+
+# Chunk sizes are counted in the embedding model's word pieces (see token_counter).
+# all-MiniLM-L6-v2 truncates its input at 256 of them; 160 leaves room for the
+# section heading each chunk is prefixed with and the two special tokens. Rate
+# tables and codes split into several pieces per word, so counting whitespace
+# words let such chunks run past the limit and lose their tail.
+CHUNK_TOKENS = int(os.getenv('CHUNK_TOKENS', '160'))
+CHUNK_OVERLAP = int(os.getenv('CHUNK_OVERLAP', '32'))
+MIN_CHUNK_TOKENS = int(os.getenv('MIN_CHUNK_TOKENS', '4'))
+
+# A block set this much larger than the page's body text starts a new section
+HEADING_SIZE_RATIO = 1.15
+HEADING_MAX_TOKENS = 15
+
+# Blocks near the top or bottom of a page that repeat on this share of a window's
+# pages are headers and footers
+REPEATED_BLOCK_RATIO = 0.6
+PAGE_EDGE_BLOCKS = 3
+
+Chunk = namedtuple('Chunk', ['text', 'page', 'heading'])
+
+_DIGITS = re.compile(r'\d+')
+_LETTERS = re.compile(r'[A-Za-z]')
+
+
+def chunking_settings():
+    # Stored in the index manifest so changing them forces a re-chunk
+    return {'chunk_tokens': CHUNK_TOKENS, 'chunk_overlap': CHUNK_OVERLAP, 'min_chunk_tokens': MIN_CHUNK_TOKENS,
+            'token_unit': 'word-piece'}
+
+
+def token_counter(tokenizer):
+    # Word pieces per whitespace word for the model's tokenizer (model.tokenizer).
+    # BERT tokenizers split on whitespace before anything else, so the counts of a
+    # text's words add up to the count of the text.
+    @lru_cache(maxsize=65536)
+    def count_tokens(word):
+        return max(1, len(tokenizer.tokenize(word)))
+    return count_tokens
+
+
+def _one_token(word):
+    return 1
+
+
+def _body_size(blocks):
+    sizes = Counter()
+    for text, size in blocks:
+        sizes[round(size, 1)] += len(text)
+    return sizes.most_common(1)[0][0] if sizes else 0
+
+
+def _edge_blocks(blocks):
+    # Page numbers differ from page to page, so compare blocks with digits masked.
+    # Blocks without letters (rate cells, page numbers alone) are never furniture.
+    edges = blocks[:PAGE_EDGE_BLOCKS] + blocks[-PAGE_EDGE_BLOCKS:]
+    return {_DIGITS.sub('#', text) for text, _ in edges if _LETTERS.search(text)}
+
+
+def _repeated_blocks(pages):
+    if len(pages) < 3:
+        return set()
+    seen = Counter()
+    for _, blocks in pages:
+        seen.update(_edge_blocks(blocks))
+    return {text for text, count in seen.items() if count >= REPEATED_BLOCK_RATIO * len(pages)}
+
+
+def chunk_pages(pages, max_tokens=CHUNK_TOKENS, overlap=CHUNK_OVERLAP, min_tokens=MIN_CHUNK_TOKENS, heading=None,
+                count_tokens=None):
+    # pages is a list of (page_number, [(block_text, font_size), ...]). Blocks are
+    # packed into chunks of up to max_tokens tokens, counted per word by
+    # count_tokens (see token_counter) or one per word without it. A chunk never
+    # spans a heading or a page break, and consecutive chunks of one section share
+    # up to `overlap` tokens. heading is the section the pages start in, the last
+    # one of the previous page window. Returns the chunks and the section the
+    # pages end in, to pass on with the next window.
+    count_tokens = count_tokens or _one_token
+    overlap = min(overlap, max_tokens // 2)
+    repeated = _repeated_blocks(pages)
+    chunks = []
+
+    for page_number, blocks in pages:
+        body_size = _body_size(blocks)
+        words, sizes = [], []
+        total = 0
+        carried = 0  # leading words repeated from the previous chunk
+
+        def flush():
+            if sum(sizes[carried:]) >= min_tokens:
+                text = ' '.join(words)
+                if heading and not text.startswith(heading):
+                    text = f"{heading}\n{text}"
+                chunks.append(Chunk(text, page_number, heading))
+
+        edges = _edge_blocks(blocks)
+        for text, size in blocks:
+            masked = _DIGITS.sub('#', text)
+            if masked in repeated and masked in edges:
+                continue
+            block_words = text.split()
+            if body_size and size >= body_size * HEADING_SIZE_RATIO and len(block_words) <= HEADING_MAX_TOKENS:
+                flush()
+                heading = ' '.join(block_words)
+                words, sizes, total, carried = [], [], 0, 0
+                continue
+            for word in block_words:
+                word_size = count_tokens(word)
+                if words and total + word_size > max_tokens:
+                    flush()
+                    # Carry the trailing words that fit in `overlap` tokens
+                    carried, total = 0, 0
+                    while carried < len(sizes) and total + sizes[-carried - 1] <= overlap:
+                        carried += 1
+                        total += sizes[-carried]
+                    words, sizes = words[len(words) - carried:], sizes[len(sizes) - carried:]
+                words.append(word)
+                sizes.append(word_size)
+                total += word_size
+        flush()
+
+    return chunks, heading
+
+
+def _table_row(cells):
+    return ' | '.join(' '.join(str(cell).split()) for cell in cells)
+
+
+def chunk_table(rows, page_number, max_tokens=CHUNK_TOKENS, heading=None, count_tokens=None):
+    # rows is a table as lists of cell strings, the first row being its header.
+    # Rows are packed into chunks of up to max_tokens tokens (counted as in
+    # chunk_pages) and every chunk starts with the header, so each one can be read
+    # and embedded on its own.
+    count_tokens = count_tokens or _one_token
+    lines = [_table_row(row) for row in rows]
+    lines = [line for line in lines if line.strip(' |')]
+    if not lines:
+        return []
+    header, body = lines[0], lines[1:]
+    if not body:
+        return [Chunk(header, page_number, heading)]
+    chunks = []
+    group = []
+    header_tokens = sum(map(count_tokens, header.split()))
+    tokens = header_tokens
+    for line in body:
+        line_tokens = sum(map(count_tokens, line.split()))
+        if group and tokens + line_tokens > max_tokens:
+            chunks.append(Chunk('\n'.join([header] + group), page_number, heading))
+            group, tokens = [], header_tokens
+        group.append(line)
+        tokens += line_tokens
+    chunks.append(Chunk('\n'.join([header] + group), page_number, heading))
+    return chunks
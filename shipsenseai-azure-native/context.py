@@ -0,0 +1,91 @@
+import os
+import re
+from metrics import HistogramFamily
+
+# Upper bound on the retrieved context put into the /search prompt, in tokens
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', '1500'))
+# How many search results are considered before reranking and packing
+CONTEXT_CANDIDATES = int(os.getenv('CONTEXT_CANDIDATES', '30'))
+# Chunks sharing at least this share of their word trigrams count as duplicates
+DEDUP_THRESHOLD = float(os.getenv('CONTEXT_DEDUP_THRESHOLD', '0.8'))
+
+# Weight of query-term coverage against the search engine's own ranking
+COVERAGE_WEIGHT = 0.5
+RANK_DAMPING = 10
+
+TOKEN_BUCKETS = (100, 250, 500, 1000, 1500, 2000, 3000, 5000, 10000, 20000)
+CHUNK_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 50, 100)
+# Size of the /search context before and after build_context trims it, exported at /metrics
+CONTEXT_TOKENS = HistogramFamily(
+    'search_context_tokens', 'Tokens of retrieved context per /search prompt, before and after trimming', ('stage',),
+    TOKEN_BUCKETS)
+CONTEXT_CHUNKS = HistogramFamily(
+    'search_context_chunks', 'Chunks of retrieved context per /search prompt, before and after trimming', ('stage',),
+    CHUNK_BUCKETS)
+
+_TOKENS = re.compile(r"\w+|[^\w\s]")
+_WORDS = re.compile(r"\w+")
+
+
+def count_tokens(text):
+    # Words and punctuation marks, a close enough stand-in for the model's BPE tokens
+    return len(_TOKENS.findall(text))
+
+
+def _shingles(text):
+    words = _WORDS.findall(text.lower())
+    return {tuple(words[i:i + 3]) for i in range(max(len(words) - 2, 1))}
+
+
+def _is_duplicate(shingles, kept):
+    for other in kept:
+        overlap = len(shingles & other)
+        if overlap and overlap / min(len(shingles), len(other)) >= DEDUP_THRESHOLD:
+            return True
+    return False
+
+
+def rerank(query, documents):
+    # Blend the search rank with how many distinct query terms each chunk contains,
+    # so a chunk that answers the whole question beats one matching a single word
+    terms = set(_WORDS.findall(query.lower()))
+    scored = []
+    for rank, document in enumerate(documents):
+        words = set(_WORDS.findall(document.lower()))
+        coverage = len(terms & words) / len(terms) if terms else 0.0
+        rank_score = RANK_DAMPING / (RANK_DAMPING + rank)
+        scored.append(((1 - COVERAGE_WEIGHT) * rank_score + COVERAGE_WEIGHT * coverage, document))
+    scored.sort(key=lambda item: item[0], reverse=True)
+    return [document for _, document in scored]
+
+
+def build_context(query, documents, budget=CONTEXT_TOKEN_BUDGET):
+    # Returns the context string and the token counts before and after assembly
+    tokens_before = sum(count_tokens(document) for document in documents)
+    selected = []
+    kept_shingles = []
+    used = 0
+    for document in rerank(query, documents):
+        tokens = count_tokens(document)
+        if used + tokens > budget:
+            continue  # A smaller chunk further down may still fit
+        shingles = _shingles(document)
+        if _is_duplicate(shingles, kept_shingles):
+            continue
+        selected.append(document)
+        kept_shingles.append(shingles)
+        used += tokens
+    stats = {
+        'chunks_before': len(documents),
+        'chunks_after': len(selected),
+        'tokens_before': tokens_before,
+        'tokens_after': used
+    }
+    return "\n\n".join(selected), stats
+
+
+def observe_context(stats):
+    # Records one build_context call's stats in the histograms above
+    for stage in ('before', 'after'):
+        CONTEXT_TOKENS.labels(stage).observe(stats[f'tokens_{stage}'])
+        CONTEXT_CHUNKS.labels(stage).observe(stats[f'chunks_{stage}'])
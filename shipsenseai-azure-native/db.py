@@ -0,0 +1,85 @@
+import os
+import time
+import threading
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+
+# One pooled engine per process, shared by the /ask queries, the tracking-number
+# lookups and LangChain's SQLDatabase. DATABASE_URL overrides the variant's own
+# connection settings (MYSQL_* or SQL_CONNECTION_STRING).
+DATABASE_URL = os.getenv('DATABASE_URL')
+# Connections kept open, and how many more may be opened under load
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '10'))
+# Seconds a request waits for a free connection before failing
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+# Seconds after which a connection is replaced; stays under the server's idle
+# timeout (MySQL wait_timeout, the Azure SQL gateway's 30 minutes)
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))
+# Test each connection on checkout so a dropped one is replaced, not returned as an error
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+
+
+class PoolMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record(self, waited, timed_out=False):
+        with self.lock:
+            self.checkouts += 1
+            self.timeouts += timed_out
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+
+# Shared across pool re-creations (engine.dispose() builds a new pool object)
+pool_metrics = PoolMetrics()
+
+
+class TimedQueuePool(QueuePool):
+    # QueuePool that records how long each checkout waited for a connection
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except Exception:
+            pool_metrics.record(time.perf_counter() - start, timed_out=True)
+            raise
+        pool_metrics.record(time.perf_counter() - start)
+        return connection
+
+
+def engine_options():
+    # The openai and llama apps hand these to Flask-SQLAlchemy, which builds their engine
+    return {
+        'poolclass': TimedQueuePool,
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING
+    }
+
+
+def create_pooled_engine(url):
+    return create_engine(url, **engine_options())
+
+
+def pool_stats(engine):
+    pool = engine.pool
+    with pool_metrics.lock:
+        checkouts = pool_metrics.checkouts
+        return {
+            'pool_size': pool.size(),
+            'checked_out': pool.checkedout(),
+            'idle': pool.checkedin(),
+            'overflow': max(pool.overflow(), 0),
+            'checkouts': checkouts,
+            'timeouts': pool_metrics.timeouts,
+            'wait_avg_ms': pool_metrics.wait_total / checkouts * 1000 if checkouts else 0.0,
+            'wait_max_ms': pool_metrics.wait_max * 1000
+        }
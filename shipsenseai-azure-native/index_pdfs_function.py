@@ -1,14 +1,38 @@
 import os
-import fitz  # PyMuPDF
-import camelot
+import argparse
 from azure.storage.blob import BlobServiceClient
 from azure.core.credentials import AzureKeyCredential
 from azure.search.documents import SearchClient
+from azure.search.documents.indexes import SearchIndexClient
+from azure.search.documents.indexes.models import (
+    HnswAlgorithmConfiguration,
+    HnswParameters,
+    SearchField,
+    SearchFieldDataType,
+    SearchIndex,
+    SimpleField,
+    SearchableField,
+    VectorEncodingFormat,
+    VectorSearch,
+    VectorSearchAlgorithmMetric,
+    VectorSearchProfile,
+)
+from azure.core.exceptions import ResourceNotFoundError
 from sentence_transformers import SentenceTransformer
 from dotenv import load_dotenv
 import logging
-import json
 import base64
+from embedding import encode_batched
+from pdf_extraction import extract_page_window, page_windows, PAGE_WINDOW
+from blob_ingest import BlobBuffers, prefetch
+from pipeline import add_pipeline_arguments, run_pipeline, start_extraction_pool, DEFAULT_WORKERS, DEFAULT_QUEUE_DEPTH
+from chunking import chunk_pages, chunk_table, chunking_settings, token_counter
+from retrieval import RETRIEVAL_BACKEND, INDEX_GENERATION_KEY
+from vector_store import LocalIndexWriter
+from manifest import IndexManifest, PendingDocument, chunk_hash
+from bulk_upload import BulkUploader, azure_search_batch, json_size
+from vector_encoding import INDEX_VECTOR_TYPE, vector_payload
+from lazy import Lazy
 
 # Initialize logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -45,33 +69,84 @@ except ValueError as e:
 search_client = SearchClient(endpoint=SEARCH_SERVICE_ENDPOINT, index_name=SEARCH_INDEX_NAME,
                              credential=AzureKeyCredential(SEARCH_SERVICE_API_KEY))
 
-# Initialize Sentence Transformer model
-model = SentenceTransformer('all-MiniLM-L6-v2')
+search_index_client = SearchIndexClient(endpoint=SEARCH_SERVICE_ENDPOINT, credential=AzureKeyCredential(SEARCH_SERVICE_API_KEY))
 
-def extract_text_from_pdf(pdf_path):
-    logging.info("Extracting text from PDF: %s", pdf_path)
+# Initialize Sentence Transformer model; it is loaded on first use, once the
+# extraction workers are forked (see pipeline.start_extraction_pool)
+model = Lazy('embedding model', lambda: SentenceTransformer('all-MiniLM-L6-v2'))
+# Chunks are sized in the model's own word pieces
+count_tokens = Lazy('tokenizer', lambda: token_counter(model.get().tokenizer))
+EMBEDDING_DIMS = 384  # all-MiniLM-L6-v2 output size
+# Element type of the embedding field for each INDEX_VECTOR_TYPE; binary vectors
+# are packed eight dimensions to a byte
+VECTOR_FIELD_TYPES = {
+    'float32': 'Edm.Single',
+    'float16': 'Edm.Half',
+    'int8': 'Edm.SByte',
+    'binary': 'Edm.Byte',
+}
+
+def ensure_search_index():
+    # Create the index with an HNSW vector profile on the embedding field so the
+    # app can run vector and hybrid queries
+    field_type = SearchFieldDataType.Collection(VECTOR_FIELD_TYPES[INDEX_VECTOR_TYPE])
     try:
-        doc = fitz.open(pdf_path)
-        text = ""
-        for page_num in range(doc.page_count):
-            page = doc.load_page(page_num)
-            text += page.get_text()
-        logging.info("Extracted text from PDF: %s", pdf_path)
-        return text
-    except Exception as e:
-        logging.error(f"Failed to extract text from PDF {pdf_path}: {e}")
-        return ""
-
-def extract_tables_from_pdf(pdf_path):
-    logging.info("Extracting tables from PDF: %s", pdf_path)
+        existing = search_index_client.get_index(SEARCH_INDEX_NAME)
+    except ResourceNotFoundError:
+        existing = None
+    if existing is not None:
+        # The type of a field cannot change, the index has to be rebuilt
+        stored_type = next((field.type for field in existing.fields if field.name == 'embedding'), field_type)
+        if stored_type != field_type:
+            raise ValueError(f"{SEARCH_INDEX_NAME} stores {stored_type} vectors, delete it to index with "
+                             f"INDEX_VECTOR_TYPE={INDEX_VECTOR_TYPE}")
+        # Fields can be added to an existing index; older ones lack the generation
+        if not any(field.name == 'generation' for field in existing.fields):
+            existing.fields.append(SimpleField(name='generation', type=SearchFieldDataType.Int32))
+            search_index_client.create_or_update_index(existing)
+            logging.info("Added the generation field to search index: %s", SEARCH_INDEX_NAME)
+        return
+    binary = INDEX_VECTOR_TYPE == 'binary'
+    index = SearchIndex(
+        name=SEARCH_INDEX_NAME,
+        fields=[
+            # Filterable so the apps can read cached result ids back in one request
+            SimpleField(name='id', type=SearchFieldDataType.String, key=True, filterable=True),
+            SimpleField(name='pdf_filename', type=SearchFieldDataType.String, filterable=True),
+            SimpleField(name='page', type=SearchFieldDataType.Int32, filterable=True),
+            SearchableField(name='content', type=SearchFieldDataType.String),
+            # Only set on the INDEX_GENERATION_KEY document, see bump_generation()
+            SimpleField(name='generation', type=SearchFieldDataType.Int32),
+            SearchField(
+                name='embedding',
+                type=field_type,
+                searchable=True,
+                vector_search_dimensions=EMBEDDING_DIMS,
+                vector_search_profile_name='embedding-profile',
+                vector_encoding_format=VectorEncodingFormat.PACKED_BIT if binary else None
+            ),
+        ],
+        vector_search=VectorSearch(
+            # Sign bits are compared by Hamming distance, everything else by cosine
+            algorithms=[HnswAlgorithmConfiguration(
+                name='embedding-hnsw',
+                parameters=HnswParameters(metric=VectorSearchAlgorithmMetric.HAMMING) if binary else None
+            )],
+            profiles=[VectorSearchProfile(name='embedding-profile', algorithm_configuration_name='embedding-hnsw')]
+        )
+    )
+    search_index_client.create_index(index)
+    logging.info("Created search index: %s", SEARCH_INDEX_NAME)
+
+def bump_generation():
+    # The apps drop cached answers and query results when this number changes
     try:
-        tables = camelot.read_pdf(pdf_path, pages='all')
-        table_data = [table.df.to_dict(orient='records') for table in tables]
-        logging.info("Extracted %d tables from PDF: %s", len(tables), pdf_path)
-        return table_data
-    except Exception as e:
-        logging.error(f"Failed to extract tables from PDF {pdf_path}: {e}")
-        return []
+        generation = search_client.get_document(INDEX_GENERATION_KEY, selected_fields=['generation'])['generation']
+    except ResourceNotFoundError:
+        generation = None
+    generation = (generation or 0) + 1
+    search_client.upload_documents([{'id': INDEX_GENERATION_KEY, 'generation': generation}])
+    return generation
 
 def encode_document_key(key):
     # Encode the document key using URL-safe Base64 encoding
@@ -79,65 +154,231 @@ def encode_document_key(key):
     encoded_str = encoded_bytes.decode('utf-8')
     return encoded_str.rstrip('=')
 
-def index_text_and_tables_in_search(text, tables, pdf_filename):
-    logging.info("Indexing text and tables from PDF: %s", pdf_filename)
-    paragraphs = text.split('\n')
-    actions = []
+def split_text_and_tables(pages, tables, pdf_filename, heading=None):
+    # Document keys are derived from the content, so an unchanged chunk or
+    # table keeps its key (and its stored embedding) when the PDF is edited.
+    # heading is the section the pages start in; returns the chunks and the one
+    # they end in
+    chunks = {}
 
     # Index textual data
-    for i, paragraph in enumerate(paragraphs):
-        if paragraph.strip():  # Index non-empty paragraphs
-            embedding = model.encode(paragraph).tolist()
-            document = {
-                'id': encode_document_key(f"{pdf_filename}_text_{i}"),
-                'pdf_filename': pdf_filename,
-                'content': paragraph,
-                'embedding': embedding
-            }
-            actions.append(document)
-
-    # Index tabular data
-    for i, table in enumerate(tables):
-        table_json = json.dumps(table)
-        embedding = model.encode(table_json).tolist()
+    page_chunks, heading = chunk_pages(pages, heading=heading, count_tokens=count_tokens.get())
+    for chunk in page_chunks:
+        content_hash = chunk_hash(chunk.text)
+        chunks.setdefault(encode_document_key(f"{pdf_filename}_text_{content_hash[:16]}"), (chunk.text, content_hash, chunk.page))
+
+    # Index tabular data in groups of rows, each led by the table's header row
+    for page_number, rows in tables:
+        for chunk in chunk_table(rows, page_number, count_tokens=count_tokens.get()):
+            content_hash = chunk_hash(chunk.text)
+            chunks.setdefault(encode_document_key(f"{pdf_filename}_table_{content_hash[:16]}"), (chunk.text, content_hash, chunk.page))
+
+    return chunks, heading
+
+def build_search_documents(chunks, pdf_filename, vector_type=INDEX_VECTOR_TYPE):
+    logging.info("Embedding text and tables from PDF: %s", pdf_filename)
+    actions = []
+    for key, (content, _, page_number) in chunks.items():
         document = {
-            'id': encode_document_key(f"{pdf_filename}_table_{i}"),
+            'id': key,
             'pdf_filename': pdf_filename,
-            'content': table_json,
-            'embedding': embedding
+            'page': page_number,
+            'content': content
         }
         actions.append(document)
 
-    # Break actions into smaller chunks and upload
-    chunk_size = 1000
-    for i in range(0, len(actions), chunk_size):
-        chunk = actions[i:i+chunk_size]
-        try:
-            search_client.upload_documents(chunk)
-            logging.info("Indexed %d documents from %s", len(chunk), pdf_filename)
-        except Exception as e:
-            logging.error(f"Failed to index chunk of documents from PDF {pdf_filename}: {e}")
-
-def index_pdfs_in_blob_storage(container_name):
+    # Embed paragraphs and tables together in length-sorted batches
+    embeddings = encode_batched(model.get(), [document['content'] for document in actions])
+    for document, embedding in zip(actions, embeddings):
+        document['embedding'] = vector_payload(embedding, vector_type, hex_bits=False)
+    return actions
+
+def index_settings(vector_type):
+    # Tables used to be indexed as one JSON blob each; re-chunk documents indexed that way
+    settings = {**chunking_settings(), 'tables': 'row-groups'}
+    # Documents embedded for another INDEX_VECTOR_TYPE are embedded again
+    if vector_type != 'float32':
+        settings['vectors'] = vector_type
+    return settings
+
+def index_pdfs_in_blob_storage(container_name, workers=DEFAULT_WORKERS, queue_depth=DEFAULT_QUEUE_DEPTH, full=False, page_window=PAGE_WINDOW):
     logging.info("Indexing PDFs in blob storage container: %s", container_name)
+    # Before anything starts threads or loads the model
+    pool = start_extraction_pool(workers)
     container_client = blob_service_client.get_container_client(container_name)
-    blobs = container_client.list_blobs()
-    for blob in blobs:
-        if blob.name.endswith('.pdf'):
+    if RETRIEVAL_BACKEND == 'local':
+        # Build the in-process index instead of uploading; its manifest lives alongside it
+        local_index = LocalIndexWriter()
+        # It takes full-precision vectors and quantizes them itself (LOCAL_INDEX_DTYPE)
+        vector_type = 'float32'
+        manifest = IndexManifest(os.path.join(local_index.path, 'manifest.json'), settings=index_settings(vector_type))
+    else:
+        local_index = None
+        vector_type = INDEX_VECTOR_TYPE
+        ensure_search_index()
+        manifest = IndexManifest(settings=index_settings(vector_type))
+    # Uploads and deletes of all blobs share byte-sized index requests sent in
+    # parallel (see bulk_upload.py); Azure AI Search has no refresh to pause
+    uploader = BulkUploader(azure_search_batch(search_client), size=json_size, name='Azure AI Search')
+    blob_names = []
+    pending = {}
+    # Downloaded PDFs by blob name and how many of their windows are still being extracted
+    buffers = BlobBuffers(container_client)
+    unextracted = {}
+
+    def release(blob_name):
+        buffers.release(blob_name)
+
+    def remove_chunks(blob_name, keys, on_done):
+        if local_index is not None:
+            local_index.delete(keys)
+            on_done([])
+            return
+        uploader.add([('delete', {'id': key}) for key in keys], on_done)
+
+    def save_manifest():
+        # The local index manifest is saved together with the index
+        if local_index is None:
+            manifest.save()
+
+    def finish(blob_name):
+        # Every page window is uploaded: drop chunks that disappeared from the PDF
+        document = pending.pop(blob_name)
+        removed = [key for key in document.indexed if key not in document.chunks]
+
+        def removed_stale(errors):
+            if errors:
+                logging.error("Failed to remove stale chunks of %s, it will be retried on the next run: %s",
+                              blob_name, errors[0])
+                return
+            manifest.update(blob_name, document.file_hash, document.chunks, etag=document.etag)
+            save_manifest()
+            logging.info("Completed processing blob: %s, removed %d stale chunks", blob_name, len(removed))
+        remove_chunks(blob_name, removed, removed_stale)
+
+    def changed_blobs():
+        for blob in container_client.list_blobs():
+            if not blob.name.endswith('.pdf'):
+                continue
+            blob_names.append(blob.name)
+            # An unchanged etag means the blob has not been rewritten, no need to download it
+            if not full and manifest.is_unchanged(blob.name, etag=blob.etag):
+                logging.info("Skipping unchanged blob: %s", blob.name)
+                continue
+            yield blob
+
+    def download_blobs():
+        # The next blobs download while the current one is extracted (BLOB_PREFETCH)
+        for blob, download in prefetch(changed_blobs(), buffers.download):
             logging.info("Processing blob: %s", blob.name)
             try:
-                pdf_blob = container_client.get_blob_client(blob).download_blob().readall()
-                pdf_path = f"/tmp/{blob.name}"
-                with open(pdf_path, 'wb') as f:
-                    f.write(pdf_blob)
-                text = extract_text_from_pdf(pdf_path)
-                tables = extract_tables_from_pdf(pdf_path)
-                index_text_and_tables_in_search(text, tables, blob.name)
-                os.remove(pdf_path)
-                logging.info("Completed processing blob: %s", blob.name)
+                pdf, file_hash = download.result()
+            except Exception as e:
+                logging.error(f"Failed to download blob {blob.name}: {e}")
+                continue
+            try:
+                if not full and manifest.is_unchanged(blob.name, file_hash=file_hash):
+                    logging.info("Skipping re-uploaded but unchanged blob: %s", blob.name)
+                    release(blob.name)
+                    manifest.set_etag(blob.name, blob.etag)
+                    save_manifest()
+                    continue
+                # Extraction workers map this copy by name, it is released once they are done with it
+                windows = page_windows(pdf, page_window)
+                unextracted[blob.name] = len(windows)
+                pending[blob.name] = PendingDocument(file_hash, manifest.chunks(blob.name), len(windows), etag=blob.etag)
+                if not windows:
+                    release(blob.name)
+                    finish(blob.name)
             except Exception as e:
                 logging.error(f"Failed to process blob {blob.name}: {e}")
+                release(blob.name)
+                continue
+            for start, end in windows:
+                yield blob.name, (pdf, start, end)
+
+    def embed_window(blob_name, source, extracted):
+        # Only embed chunks the index does not already hold
+        pages, tables = extracted
+        unextracted[blob_name] -= 1
+        if not unextracted[blob_name]:
+            # The workers are done with the downloaded copy
+            release(blob_name)
+        document = pending[blob_name]
+        known = {} if full else document.indexed
+        changed = {}
+        chunks, document.heading = split_text_and_tables(pages, tables, blob_name, document.heading)
+        for key, chunk in chunks.items():
+            if key in document.chunks:  # Already seen in an earlier page window
+                continue
+            document.chunks[key] = chunk[1]
+            if key not in known:
+                changed[key] = chunk
+        documents = build_search_documents(changed, blob_name, vector_type)
+        if local_index is not None:
+            for document in documents:
+                local_index.add(document['id'], document['content'], blob_name, document['page'], document['embedding'])
+            documents = []
+        return documents
+
+    def window_uploaded(blob_name, count, errors):
+        if errors:
+            # Leave the manifest alone so the blob is picked up again on the next run
+            logging.error("Blob %s was only partially indexed (%d of %d documents failed), it will be retried on "
+                          "the next run: %s", blob_name, len(errors), count, errors[0])
+            return
+        if count:
+            logging.info("Indexed %d documents from %s", count, blob_name)
+        if pending[blob_name].window_done():
+            finish(blob_name)
+
+    def upload_window(blob_name, documents):
+        uploader.add([('upload', document) for document in documents],
+                     lambda errors: window_uploaded(blob_name, len(documents), errors))
+
+    def removed_blob(blob_name):
+        def on_done(errors):
+            if errors:
+                logging.error("Failed to remove blob %s from the index: %s", blob_name, errors[0])
+                return
+            manifest.remove(blob_name)
+            save_manifest()
+            logging.info("Removed blob from the index: %s", blob_name)
+        return on_done
+
+    # Page windows are extracted in a process pool, embedded here and uploaded in the background
+    try:
+        run_pipeline(download_blobs(), extract_page_window, embed_window, upload_window, workers=workers,
+                     queue_depth=queue_depth, pool=pool)
+    finally:
+        pool.shutdown()
+        # Copies of blobs with a window that failed to extract, and on an error or
+        # interrupt every download not extracted yet
+        buffers.close()
+    uploader.join()
+
+    # Drop everything indexed from blobs that are no longer in the container
+    for blob_name in set(manifest.names()) - set(blob_names):
+        remove_chunks(blob_name, list(manifest.chunks(blob_name)), removed_blob(blob_name))
+    uploader.close()
+
+    if local_index is None and uploader.stats()['documents']:
+        generation = bump_generation()
+        logging.info("Bumped search index %s to generation %d", SEARCH_INDEX_NAME, generation)
+
+    if local_index is not None:
+        if local_index.dirty or not local_index.exists:
+            generation = local_index.save()
+            logging.info("Saved local index generation %d to %s", generation, local_index.path)
+        manifest.save()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Index the PDFs in a blob container into Azure Cognitive Search')
+    parser.add_argument('container', nargs='?', default='your-container-name', help='blob container holding the PDF files')
+    parser.add_argument('--full', action='store_true', help='re-embed every document, ignoring the manifest')
+    parser.add_argument('--page-window', type=int, default=PAGE_WINDOW, help='pages extracted and embedded together')
+    add_pipeline_arguments(parser)
+    args = parser.parse_args()
     logging.info("Starting PDF indexing process")
-    index_pdfs_in_blob_storage('your-container-name')
+    index_pdfs_in_blob_storage(args.container, workers=args.workers, queue_depth=args.queue_depth, full=args.full,
+                               page_window=args.page_window)
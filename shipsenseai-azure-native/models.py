@@ -0,0 +1,23 @@
+from sqlalchemy import Column, Integer, String, DECIMAL, Date, DateTime, ForeignKey, func
+from sqlalchemy.orm import declarative_base
+
+Base = declarative_base()
+
+# Define the Packages table
+class Package(Base):
+    __tablename__ = 'Packages'
+    id = Column(Integer, primary_key=True)
+    tracking_number = Column(String(50), unique=True, nullable=False)
+    dimensions = Column(String(100))
+    weight = Column(DECIMAL(10, 2))
+    status = Column(String(50))
+    eta = Column(Date)
+    last_update = Column(DateTime, server_default=func.now())
+
+# Define the PackageHistory table
+class PackageHistory(Base):
+    __tablename__ = 'PackageHistory'
+    id = Column(Integer, primary_key=True)
+    tracking_number = Column(String(50), ForeignKey('Packages.tracking_number'), index=True)
+    location = Column(String(100))
+    timestamp = Column(DateTime, server_default=func.now())
@@ -0,0 +1,259 @@
+import os
+import sys
+import json
+import hashlib
+import tempfile
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+import fitz  # PyMuPDF
+import camelot
+import logging
+
+# Kept free of model and client setup so extraction can run in worker processes
+
+# Number of pages extracted, embedded and uploaded together
+PAGE_WINDOW = int(os.getenv('PAGE_WINDOW', '8'))
+
+# Tables found on a page, stored by a hash of the page's drawing instructions, so
+# an unchanged page is never handed to camelot again, even in an edited PDF.
+# An empty TABLE_CACHE_DIR turns the cache off.
+TABLE_CACHE_DIR = os.getenv('TABLE_CACHE_DIR', 'table_cache')
+# camelot's lattice mode finds tables by their ruling lines, so a page without a
+# few horizontal and vertical rules cannot hold one
+TABLE_MIN_HORIZONTAL_RULES = 3
+TABLE_MIN_VERTICAL_RULES = 2
+RULE_MIN_LENGTH = 10  # points
+RULE_MAX_WIDTH = 3
+
+
+def attach_shared_memory(name):
+    # Attaching registers the segment with the resource tracker just as creating
+    # it does, so a worker's tracker could unlink it, or warn that it leaked,
+    # while the indexer still uses it. Only the creator tracks it (3.13 adds
+    # track=False for this).
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+class SharedPdf:
+    # A downloaded PDF kept in shared memory rather than a temp file. It pickles
+    # as its name, so each extraction worker maps the same pages instead of
+    # being sent the bytes. The creator unlinks it, workers only close it.
+    def __init__(self, size, name=None, label=None):
+        self.size = size
+        self.label = label
+        if name is None:
+            self.memory = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        else:
+            self.memory = attach_shared_memory(name)
+
+    def __reduce__(self):
+        return SharedPdf, (self.size, self.memory.name, self.label)
+
+    def __str__(self):
+        return self.label or self.memory.name
+
+    @contextmanager
+    def open(self):
+        # PyMuPDF reads the shared pages in place; the view has to be released
+        # before the memory can be closed
+        view = self.memory.buf[:self.size]
+        doc = fitz.open(stream=view, filetype='pdf')
+        try:
+            yield doc
+        finally:
+            doc.close()
+            del doc
+            view.release()
+
+    def close(self):
+        self.memory.close()
+
+    def unlink(self):
+        self.memory.close()
+        self.memory.unlink()
+
+@contextmanager
+def open_pdf(pdf):
+    # pdf is a file path or a SharedPdf
+    if isinstance(pdf, SharedPdf):
+        with pdf.open() as doc:
+            yield doc
+    else:
+        with fitz.open(pdf) as doc:
+            yield doc
+
+def iter_pdf_pages(pdf, start=0, end=None):
+    # Yield (page_number, text) one page at a time, page numbers are 1-based
+    with open_pdf(pdf) as doc:
+        end = doc.page_count if end is None else min(end, doc.page_count)
+        for page_num in range(start, end):
+            yield page_num + 1, doc.load_page(page_num).get_text()
+
+def iter_pdf_paragraphs(pdf, start=0, end=None):
+    for page_number, text in iter_pdf_pages(pdf, start, end):
+        for paragraph in text.split('\n'):
+            if paragraph.strip():
+                yield page_number, paragraph
+
+def iter_document_blocks(doc, start=0, end=None):
+    # Yield (page_number, [(block_text, font_size), ...]) one page at a time. The
+    # font size lets the chunker tell headings from body text.
+    end = doc.page_count if end is None else min(end, doc.page_count)
+    for page_num in range(start, end):
+        blocks = []
+        for block in doc.load_page(page_num).get_text('dict')['blocks']:
+            spans = [span for line in block.get('lines', []) for span in line['spans']]
+            text = ' '.join(' '.join(span['text'] for span in spans).split())
+            if text:
+                blocks.append((text, max(span['size'] for span in spans)))
+        yield page_num + 1, blocks
+
+def iter_pdf_blocks(pdf, start=0, end=None):
+    with open_pdf(pdf) as doc:
+        yield from iter_document_blocks(doc, start, end)
+
+def page_windows(pdf, window=PAGE_WINDOW):
+    with open_pdf(pdf) as doc:
+        page_count = doc.page_count
+    return [(start, min(start + window, page_count)) for start in range(0, page_count, window)]
+
+def extract_text(doc, pdf, start=0, end=None):
+    logging.info("Extracting text from PDF: %s", pdf)
+    try:
+        pages = list(iter_document_blocks(doc, start, end))
+        logging.info("Extracted text from PDF: %s", pdf)
+        return pages
+    except Exception as e:
+        # Raised rather than returned as no pages: the indexer would take the window
+        # for an empty one and drop the chunks it held from the index
+        logging.error(f"Failed to extract text from PDF {pdf}: {e}")
+        raise
+
+def extract_text_from_pdf(pdf, start=0, end=None):
+    with open_pdf(pdf) as doc:
+        return extract_text(doc, pdf, start, end)
+
+def has_table_rules(page):
+    # Counts distinct rule positions among stroked lines and hairline rectangles;
+    # much cheaper than rendering the page the way camelot does
+    horizontal, vertical = set(), set()
+    for drawing in page.get_drawings():
+        for item in drawing['items']:
+            if item[0] == 'l':
+                start, end = item[1], item[2]
+                if abs(start.y - end.y) < 1 and abs(start.x - end.x) >= RULE_MIN_LENGTH:
+                    horizontal.add(round(start.y))
+                elif abs(start.x - end.x) < 1 and abs(start.y - end.y) >= RULE_MIN_LENGTH:
+                    vertical.add(round(start.x))
+            elif item[0] == 're':
+                rect = item[1]
+                if rect.height < RULE_MAX_WIDTH and rect.width >= RULE_MIN_LENGTH:
+                    horizontal.add(round(rect.y0))
+                elif rect.width < RULE_MAX_WIDTH and rect.height >= RULE_MIN_LENGTH:
+                    vertical.add(round(rect.x0))
+    return len(horizontal) >= TABLE_MIN_HORIZONTAL_RULES and len(vertical) >= TABLE_MIN_VERTICAL_RULES
+
+def page_hash(page):
+    # The page's content stream, the forms it draws and its size; text and
+    # rules all live there
+    digest = hashlib.sha256(camelot.__version__.encode('utf-8'))
+    digest.update(page.read_contents())
+    for xref, *_ in page.get_xobjects():
+        digest.update(page.parent.xref_stream(xref) or b'')
+    digest.update(repr(tuple(page.rect)).encode('utf-8'))
+    return digest.hexdigest()
+
+class TableCache:
+    # One JSON file per page hash; worker processes write theirs atomically
+    def __init__(self, directory=TABLE_CACHE_DIR):
+        self.directory = directory
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self, key):
+        if not self.directory:
+            return None
+        try:
+            with open(os.path.join(self.directory, f"{key}.json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, tables):
+        if not self.directory:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(tables, f)
+        os.replace(tmp_path, os.path.join(self.directory, f"{key}.json"))
+
+def read_tables(doc, page_numbers):
+    # camelot only reads files, so the pages it has to parse are copied into a
+    # small PDF of their own; returns {page_number: [rows, ...]}
+    subset = fitz.open()
+    for page_number in page_numbers:
+        subset.insert_pdf(doc, from_page=page_number - 1, to_page=page_number - 1)
+    found = {page_number: [] for page_number in page_numbers}
+    fd, subset_path = tempfile.mkstemp(suffix='.pdf')
+    os.close(fd)
+    try:
+        subset.save(subset_path)
+        subset.close()
+        for table in camelot.read_pdf(subset_path, pages=f"1-{len(page_numbers)}"):
+            found[page_numbers[int(table.page) - 1]].append(table.df.values.tolist())
+    finally:
+        os.remove(subset_path)
+    return found
+
+def extract_tables(doc, pdf, start=0, end=None, cache=None):
+    # Returns [(page_number, rows), ...], rows being lists of cell strings. Only
+    # pages with ruling lines that are not in the cache go to camelot, in one call;
+    # extract_page_window already runs in the indexer's process pool.
+    cache = cache or TableCache()
+    tables = []
+    candidates = 0
+    parse = {}
+    try:
+        end = doc.page_count if end is None else min(end, doc.page_count)
+        for page_num in range(start, end):
+            page = doc.load_page(page_num)
+            if not has_table_rules(page):
+                continue
+            candidates += 1
+            key = page_hash(page)
+            cached = cache.get(key)
+            if cached is None:
+                parse[page_num + 1] = key
+            else:
+                tables.extend((page_num + 1, rows) for rows in cached)
+        if parse:
+            for page_number, page_tables in read_tables(doc, sorted(parse)).items():
+                # Candidate pages without a table are cached too
+                cache.put(parse[page_number], page_tables)
+                tables.extend((page_number, rows) for rows in page_tables)
+        logging.info("Extracted %d tables from PDF: %s, pages %d-%d (%d with rules, %d parsed, %d cached)",
+                     len(tables), pdf, start + 1, end, candidates, len(parse), candidates - len(parse))
+        return sorted(tables, key=lambda table: table[0])
+    except Exception as e:
+        logging.error(f"Failed to extract tables from PDF {pdf}: {e}")
+        raise
+
+def extract_tables_from_pdf(pdf, start=0, end=None, cache=None):
+    with open_pdf(pdf) as doc:
+        return extract_tables(doc, pdf, start, end, cache)
+
+def extract_page_window(source):
+    # Text and tables come from one parsed copy of the document
+    pdf, start, end = source
+    try:
+        with open_pdf(pdf) as doc:
+            return extract_text(doc, pdf, start, end), extract_tables(doc, pdf, start, end)
+    finally:
+        if isinstance(pdf, SharedPdf):
+            pdf.close()
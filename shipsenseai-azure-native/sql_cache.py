@@ -0,0 +1,91 @@
+import os
+import re
+import hashlib
+from sqlalchemy import inspect
+
+# Generated SQL kept per question template, so "where is package 123ABC" and
+# "where is package 456DEF" share one statement and only the first asks the LLM
+SQL_CACHE_SIZE = int(os.getenv('SQL_CACHE_SIZE', '512'))
+# Seconds a cached statement stays valid; 0 disables the cache
+SQL_CACHE_TTL = float(os.getenv('SQL_CACHE_TTL', '86400'))
+
+# Identifiers such as tracking numbers: at least six letters and digits, one of them a digit
+_PARAMETER = re.compile(r"\b(?=[A-Za-z0-9-]*\d)[A-Za-z0-9][A-Za-z0-9-]{5,39}\b")
+_FENCE = re.compile(r"^```(?:sql)?\s*|\s*```$", re.IGNORECASE)
+_READ_ONLY = re.compile(r"^\s*(select|with)\b", re.IGNORECASE)
+_WRITE = re.compile(r"\b(insert|update|delete|drop|alter|create|truncate|grant|revoke|replace|merge|call|exec)\b", re.IGNORECASE)
+_STRING = re.compile(r"'(?:[^']|'')*'")
+# Result rows shown to the LLM when it phrases the answer
+SQL_ANSWER_ROWS = int(os.getenv('SQL_ANSWER_ROWS', '20'))
+
+
+def question_template(question):
+    # Returns the question with its identifiers swapped for numbered slots, and the identifiers
+    params = []
+
+    def slot(match):
+        params.append(match.group(0))
+        return f" param{len(params) - 1} "
+
+    return ' '.join(_PARAMETER.sub(slot, question).split()), params
+
+
+def clean_sql(sql):
+    # LLMs wrap their SQL in code fences, prefixes and trailing semicolons
+    sql = _FENCE.sub('', sql.strip())
+    if sql.lower().startswith('sqlquery:'):
+        sql = sql[len('sqlquery:'):]
+    return sql.strip().rstrip(';').strip()
+
+
+def is_read_only(sql):
+    # A single SELECT; anything else is run as before but never cached
+    without_strings = _STRING.sub("''", sql)
+    return bool(_READ_ONLY.match(sql)) and ';' not in without_strings and not _WRITE.search(without_strings)
+
+
+def parameterize_sql(sql, params):
+    # Swap each identifier the question carried for a bind parameter. Returns None
+    # when the statement cannot be reused safely: not read-only, or an identifier
+    # missing from it or appearing somewhere other than as a plain literal.
+    if not params or not is_read_only(sql):
+        return None
+    for i, value in enumerate(params):
+        literal = re.compile(r"'" + re.escape(value) + r"'" + (r"|\b" + re.escape(value) + r"\b" if value.isdigit() else ''),
+                             re.IGNORECASE)
+        sql, replaced = literal.subn(f":p{i}", sql)
+        if not replaced or value.lower() in sql.lower():
+            return None
+    return sql
+
+
+def bind_params(params):
+    return {f"p{i}": value for i, value in enumerate(params)}
+
+
+def schema_version(engine):
+    # Changes when a table or column is added, dropped or renamed
+    inspector = inspect(engine)
+    schema = [(table, [column['name'] for column in inspector.get_columns(table)]) for table in sorted(inspector.get_table_names())]
+    return hashlib.sha1(repr(schema).encode('utf-8')).hexdigest()
+
+
+def answer_prompt(question, rows):
+    # The last step of SQLDatabaseChain, which the apps now take themselves: the
+    # LLM phrases the rows the SQL returned as an answer to the question
+    shown = rows[:SQL_ANSWER_ROWS]
+    more = f" ({len(rows) - len(shown)} more rows not shown)" if len(rows) > len(shown) else ''
+    return (f"Answer the question using the result of the SQL query that was run for it. If the result is empty, "
+            f"say that nothing matched.\n\nQuestion: {question}\nSQLResult: {shown}{more}\nAnswer:")
+
+
+def rows_answer(rows):
+    # The answer to a question whose statement came from the cache, built from the
+    # rows alone so a hit never waits for the LLM: one "column: value" line per row
+    if not rows:
+        return "Nothing matched."
+    shown = rows[:SQL_ANSWER_ROWS]
+    lines = ['; '.join(f"{column}: {value}" for column, value in row.items()) for row in shown]
+    if len(rows) > len(shown):
+        lines.append(f"({len(rows) - len(shown)} more rows not shown)")
+    return '\n'.join(lines)
@@ -10,6 +10,53 @@ function addMessage(content, sender) {
     message.appendChild(messageContent);
     chatBox.appendChild(message);
     chatBox.scrollTop = chatBox.scrollHeight;  // Auto-scroll to the bottom
+    return messageContent;
+}
+
+// Read the server-sent events of a streamed answer, appending each token as it arrives
+async function renderStream(response, messageContent) {
+    const chatBox = document.getElementById('chat-box');
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) {
+            break;
+        }
+        buffer += decoder.decode(value, { stream: true });
+
+        // Events are separated by a blank line
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const rawEvent = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+
+            let eventType = 'message';
+            let data = '';
+            for (const line of rawEvent.split('\n')) {
+                if (line.startsWith('event:')) {
+                    eventType = line.slice(6).trim();
+                } else if (line.startsWith('data:')) {
+                    data += line.slice(5).trim();
+                }
+            }
+            if (!data) {
+                continue;
+            }
+
+            const payload = JSON.parse(data);
+            if (eventType === 'error') {
+                messageContent.textContent += messageContent.textContent ? '\n\n' + payload.error : payload.error;
+            } else if (eventType === 'done') {
+                messageContent.textContent = payload.answer;
+            } else {
+                messageContent.textContent += payload.token;
+            }
+            chatBox.scrollTop = chatBox.scrollHeight;
+        }
+    }
 }
 
 async function sendMessage() {
@@ -20,17 +67,24 @@ async function sendMessage() {
         addMessage(userMessage, 'user');
         userInput.value = '';
 
-        // Send the message to the backend
+        // Send the message to the backend and ask for the answer as a stream
         const response = await fetch('/search', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
+                'Accept': 'text/event-stream',
             },
-            body: JSON.stringify({ query: userMessage }),
+            body: JSON.stringify({ query: userMessage, stream: true }),
         });
 
-        const data = await response.json();
-        addMessage(data.answer, 'bot');
+        // "No relevant documents" and errors come back as plain JSON
+        const contentType = response.headers.get('Content-Type') || '';
+        if (contentType.includes('text/event-stream')) {
+            await renderStream(response, addMessage('', 'bot'));
+        } else {
+            const data = await response.json();
+            addMessage(data.answer || data.error, 'bot');
+        }
     }
 }
 
@@ -0,0 +1,77 @@
+import re
+from sqlalchemy import bindparam, select
+
+# Deterministic answers for /ask questions that only look up one package, e.g.
+# "where is 123ABC" or "what's the ETA of package 794612345678". Anything else
+# goes to the LLM.
+TRACKING_NUMBER = re.compile(r"\b(?=[A-Za-z0-9]*\d)[A-Za-z0-9]{6,40}\b")
+_WORDS = re.compile(r"[a-z]+")
+
+# Every other word of a lookup question must come from this vocabulary; a word
+# outside it ("heavier", "how many", "compare") makes the question open-ended
+LOOKUP_WORDS = frozenset('''
+    a about all an and any are arrival arrive arriving at be been can check current currently date deliver
+    delivered delivery details dimensions dims do does due estimated eta expected find for from get give has
+    have history i id in info information is it its last latest location look lookup me my number of on order
+    package parcel please right s scan scans see ship shipment shipped show size state status tell the there
+    this time to track tracking up update updated weight what whats when where which will with you
+'''.split())
+
+
+def lookup_tracking_number(question):
+    # Returns the tracking number when the question is a plain lookup, otherwise None
+    numbers = TRACKING_NUMBER.findall(question)
+    if len(numbers) != 1:
+        return None
+    rest = TRACKING_NUMBER.sub(' ', question).lower()
+    if all(word in LOOKUP_WORDS for word in _WORDS.findall(rest)):
+        return numbers[0]
+    return None
+
+
+class PackageLookup:
+    # Both statements are built once against the model tables; SQLAlchemy caches
+    # their compiled form, and each runs on the indexed tracking_number column
+    def __init__(self, engine, package_table, history_table):
+        self.engine = engine
+        self.package_query = select(package_table).where(package_table.c.tracking_number == bindparam('tracking_number'))
+        self.history_query = (
+            select(history_table.c.location, history_table.c.timestamp)
+            .where(history_table.c.tracking_number == bindparam('tracking_number'))
+            .order_by(history_table.c.timestamp.desc())
+        )
+
+    def find(self, tracking_number):
+        # A list of rows like /ask's SQL results, here the package with its scan history
+        params = {'tracking_number': tracking_number}
+        with self.engine.connect() as connection:
+            package = connection.execute(self.package_query, params).first()
+            if package is None:
+                return []
+            history = connection.execute(self.history_query, params).fetchall()
+        result = dict(package._mapping)
+        result['history'] = [dict(row._mapping) for row in history]
+        return [result]
+
+
+def lookup_answer(tracking_number, rows):
+    # The sentence the apps return with the rows of a lookup, so /ask answers in the
+    # same shape whether or not the LLM was asked. It covers everything a lookup
+    # question may ask for: status, ETA, weight, dimensions and the last scan.
+    if not rows:
+        return f"No package with tracking number {tracking_number} was found."
+    package = rows[0]
+    answer = f"Package {tracking_number} is {package['status'] or 'without a status'}"
+    if package.get('eta'):
+        answer += f", expected on {package['eta']}"
+    sizes = []
+    if package.get('weight') is not None:
+        sizes.append(f"weighs {float(package['weight']):g}")
+    if package.get('dimensions'):
+        sizes.append(f"measures {package['dimensions']}")
+    if sizes:
+        answer += f". It {' and '.join(sizes)}"
+    if package['history']:
+        scan = package['history'][0]
+        answer += f". It was last scanned in {scan['location']} at {scan['timestamp']}"
+    return answer + '.'
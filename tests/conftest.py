@@ -0,0 +1,53 @@
+# The three variants share module names (app, cache, vector_store, ...), so a test
+# that imports one variant's app first drops whatever another test imported.
+import importlib
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+VARIANTS = ('shipsense-openai', 'shipsense-llama-on-hf', 'shipsenseai-azure-native')
+# Third-party packages each variant's app imports at module level
+VARIANT_DEPENDENCIES = {
+    'shipsense-openai': ('elasticsearch', 'dotenv'),
+    'shipsense-llama-on-hf': ('elasticsearch', 'dotenv'),
+    'shipsenseai-azure-native': ('openai', 'azure.search.documents', 'dotenv'),
+}
+VARIANT_MODULES = {name[:-3] for variant in VARIANTS for name in os.listdir(os.path.join(ROOT, variant))
+                   if name.endswith('.py')}
+
+
+def forget_variant_modules():
+    for name in VARIANT_MODULES:
+        sys.modules.pop(name, None)
+
+
+@pytest.fixture
+def load_variant(monkeypatch, tmp_path):
+    # Imports a module of one variant against a throwaway SQLite database and an
+    # empty local index, with nothing loaded in the background
+    def load(variant, name='app', **env):
+        for dependency in VARIANT_DEPENDENCIES[variant]:
+            pytest.importorskip(dependency)
+        settings = {
+            'DATABASE_URL': f"sqlite:///{tmp_path / 'shipsense.db'}",
+            'RETRIEVAL_BACKEND': 'local',
+            'LOCAL_INDEX_PATH': str(tmp_path / 'local_index'),
+            'WARM_UP': 'false',
+            'ES_HOST': '127.0.0.1',
+            'ES_PORT': '9200',
+            'SEARCH_SERVICE_ENDPOINT': 'https://search.invalid',
+            'SEARCH_SERVICE_API_KEY': 'test',
+            'SEARCH_INDEX_NAME': 'pdf-index',
+            'OPENAI_API_KEY': 'test',
+        }
+        settings.update(env)
+        for key, value in settings.items():
+            monkeypatch.setenv(key, value)
+        forget_variant_modules()
+        monkeypatch.syspath_prepend(os.path.join(ROOT, variant))
+        return importlib.import_module(name)
+
+    yield load
+    forget_variant_modules()
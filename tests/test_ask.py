@@ -0,0 +1,63 @@
+# /ask on the SQL paths: a question whose statement is cached for its template is
+# answered from the rows, without the LLM.
+import datetime
+
+import pytest
+from sqlalchemy import insert
+
+TRACKING_NUMBERS = ('1Z999AA10123456784', '1Z999AA10123456785')
+# Not a plain lookup ("city", "leave"), so it takes the SQL path
+QUESTION = 'Which city did {} leave from?'
+
+
+def seed(app):
+    Package = app.Package.__table__
+    PackageHistory = app.PackageHistory.__table__
+    Package.metadata.create_all(app.engine)
+    with app.engine.begin() as connection:
+        connection.execute(insert(Package), [{'tracking_number': number, 'status': 'In Transit',
+                                              'eta': datetime.date(2026, 10, 20)} for number in TRACKING_NUMBERS])
+        connection.execute(insert(PackageHistory), [{'tracking_number': number, 'location': location} for number, location
+                                                    in zip(TRACKING_NUMBERS, ('Memphis, TN', 'Newark, NJ'))])
+    return PackageHistory.name
+
+
+class StubLLM:
+    def __init__(self, sql):
+        self.sql = sql
+        self.calls = []
+
+    def run(self, question):
+        self.calls.append(question)
+        return f"```sql\n{self.sql};\n```"
+
+    def submit(self, prompt):
+        self.calls.append(prompt)
+        return ' It left from Memphis.'
+
+
+@pytest.mark.parametrize('variant', ['shipsense-openai', 'shipsenseai-azure-native'])
+def test_cached_template_answers_without_llm(load_variant, monkeypatch, variant):
+    app = load_variant(variant)
+    history_table = seed(app)
+    llm = StubLLM(f"SELECT location FROM {history_table} WHERE tracking_number = '{TRACKING_NUMBERS[0]}'")
+    monkeypatch.setattr(app.db_chain, 'get', lambda: llm)
+    monkeypatch.setattr(app.completion_batcher, 'submit', llm.submit)
+    client = app.app.test_client()
+
+    first = client.post('/ask', json={'query': QUESTION.format(TRACKING_NUMBERS[0])})
+    assert first.get_json() == {'answer': 'It left from Memphis.', 'rows': [{'location': 'Memphis, TN'}]}
+    assert len(llm.calls) == 2  # The SQL, then the answer
+
+    second = client.post('/ask', json={'query': QUESTION.format(TRACKING_NUMBERS[1])})
+    assert second.status_code == 200
+    assert second.get_json() == {'answer': 'location: Newark, NJ', 'rows': [{'location': 'Newark, NJ'}]}
+    assert len(llm.calls) == 2
+
+
+def test_rows_answer(load_variant):
+    sql_cache = load_variant('shipsense-openai', 'sql_cache', SQL_ANSWER_ROWS='2')
+    assert sql_cache.rows_answer([]) == 'Nothing matched.'
+    rows = [{'status': 'Delivered', 'weight': 2.5}, {'status': 'In Transit', 'weight': 1}, {'status': 'Lost', 'weight': 3}]
+    assert sql_cache.rows_answer(rows) == ('status: Delivered; weight: 2.5\nstatus: In Transit; weight: 1\n'
+                                           '(1 more rows not shown)')
@@ -0,0 +1,80 @@
+# Smoke test of the asyncio serving mode (async_app.py) of the Elasticsearch
+# variants: the app boots, its clients reach a stub Elasticsearch built from
+# app.py's es_hosts, and /search answers, then answers again from the cache.
+import asyncio
+
+import pytest
+
+pytest.importorskip('aiohttp')
+from aiohttp import web  # noqa: E402
+from aiohttp.test_utils import TestClient, TestServer  # noqa: E402
+
+CHUNK = 'The Direct Signature option fee is $6.75 per package.'
+ANSWER = 'Direct Signature costs $6.75.'
+ES_HEADERS = {'X-Elastic-Product': 'Elasticsearch'}
+
+
+def stub_upstreams(requests):
+    # Elasticsearch for the index's search and mapping, and a Hugging Face endpoint at /generate
+    routes = web.RouteTableDef()
+
+    @routes.post('/pdf_index/_search')
+    async def search(request):
+        requests.append(('search', await request.json()))
+        hits = [{'_index': 'pdf_index', '_id': 'guide-1', '_score': 1.0, '_source': {'content': CHUNK}}]
+        return web.json_response({'took': 1, 'timed_out': False,
+                                  'hits': {'total': {'value': 1, 'relation': 'eq'}, 'max_score': 1.0, 'hits': hits}},
+                                 headers=ES_HEADERS)
+
+    @routes.get('/pdf_index/_mapping')
+    async def mapping(request):
+        requests.append(('mapping', None))
+        return web.json_response({'pdf_index': {'mappings': {'_meta': {'generation': 1}}}}, headers=ES_HEADERS)
+
+    @routes.post('/generate')
+    async def generate(request):
+        requests.append(('generate', await request.json()))
+        return web.json_response([{'generated_text': ANSWER}])
+
+    app = web.Application()
+    app.add_routes(routes)
+    return app
+
+
+async def stub_completions(app, prompts):
+    return [ANSWER for _ in prompts]
+
+
+@pytest.mark.parametrize('variant', ['shipsense-openai', 'shipsense-llama-on-hf'])
+def test_search_against_stub_elasticsearch(load_variant, monkeypatch, variant):
+    async def run():
+        requests = []
+        upstream = TestServer(stub_upstreams(requests), host='127.0.0.1')
+        await upstream.start_server()
+        try:
+            async_app = load_variant(variant, 'async_app', RETRIEVAL_BACKEND='search', RETRIEVAL_MODE='bm25',
+                                     ES_HOST='127.0.0.1', ES_PORT=str(upstream.port),
+                                     HF_ENDPOINT=str(upstream.make_url('/generate')))
+            if variant == 'shipsense-openai':
+                monkeypatch.setattr(async_app, 'complete_batch', stub_completions)
+            client = TestClient(TestServer(async_app.create_app()))
+            await client.start_server()
+            try:
+                for _ in range(2):
+                    response = await client.post('/search', json={'query': 'signature option fee'})
+                    assert response.status == 200
+                    assert (await response.json())['answer'].strip() == ANSWER
+            finally:
+                await client.close()
+        finally:
+            await upstream.close()
+        return requests
+
+    requests = asyncio.run(run())
+    searches = [body for kind, body in requests if kind == 'search']
+    # The second request was answered from the answer cache
+    assert len(searches) == 1
+    assert searches[0]['query']['multi_match']['query'] == 'signature option fee'
+    assert ('mapping', None) in requests
+    if variant == 'shipsense-llama-on-hf':
+        assert [body['inputs'] for kind, body in requests if kind == 'generate'][0].count(CHUNK) == 1
@@ -0,0 +1,50 @@
+# The azure app's /search context: what build_context keeps, and the sizes it
+# exports at /metrics.
+import sys
+
+import pytest
+
+VARIANT = 'shipsenseai-azure-native'
+QUERY = 'signature options fee'
+DOCUMENTS = [
+    'The Direct Signature option fee is $6.75 per package.',
+    'The Direct Signature option fee is $6.75 per package.',  # A duplicate
+    'Automated Pickup weekly fee applies to on-call pickups.',
+    'word ' * 500,  # Over the budget on its own
+]
+
+
+@pytest.fixture
+def context(load_variant):
+    return load_variant(VARIANT, 'context')
+
+
+def test_build_context_stats(context):
+    text, stats = context.build_context(QUERY, DOCUMENTS, budget=100)
+    assert text.split('\n\n') == [DOCUMENTS[0], DOCUMENTS[2]]
+    assert stats == {
+        'chunks_before': 4,
+        'chunks_after': 2,
+        'tokens_before': sum(context.count_tokens(document) for document in DOCUMENTS),
+        'tokens_after': context.count_tokens(DOCUMENTS[0]) + context.count_tokens(DOCUMENTS[2]),
+    }
+
+
+def test_observe_context_exports_histograms(context):
+    context.observe_context({'chunks_before': 4, 'chunks_after': 2, 'tokens_before': 1200, 'tokens_after': 300})
+    rendered = sys.modules['metrics'].render_metrics()
+    assert '# TYPE search_context_tokens histogram' in rendered
+    assert 'search_context_tokens_bucket{stage="before",le="1500"} 1' in rendered
+    assert 'search_context_tokens_bucket{stage="before",le="1000"} 0' in rendered
+    assert 'search_context_tokens_sum{stage="after"} 300' in rendered
+    assert 'search_context_chunks_count{stage="before"} 1' in rendered
+    assert 'search_context_chunks_bucket{stage="after",le="2"} 1' in rendered
+
+
+def test_search_prompt_metrics_endpoint(load_variant):
+    app = load_variant(VARIANT)
+    app.search_prompt(QUERY, DOCUMENTS, [])
+    rendered = app.app.test_client().get('/metrics').get_data(as_text=True)
+    assert 'search_context_tokens_count{stage="before"} 1' in rendered
+    assert 'search_context_tokens_count{stage="after"} 1' in rendered
+    assert 'search_context_chunks_sum{stage="before"} 4' in rendered
@@ -0,0 +1,50 @@
+# Tracking-number lookups on /ask: which questions take the fast path, and that
+# its answer covers what they ask for.
+import datetime
+import decimal
+
+import pytest
+from sqlalchemy import insert
+
+TRACKING_NUMBER = '1Z999AA10123456784'
+
+
+@pytest.fixture
+def tracking(load_variant):
+    return load_variant('shipsense-openai', 'tracking')
+
+
+def test_lookup_questions(tracking):
+    assert tracking.lookup_tracking_number(f"What's the weight of {TRACKING_NUMBER}?") == TRACKING_NUMBER
+    assert tracking.lookup_tracking_number(f'where is package {TRACKING_NUMBER}') == TRACKING_NUMBER
+    assert tracking.lookup_tracking_number(f'Is {TRACKING_NUMBER} heavier than 1Z999AA10123456785?') is None
+    assert tracking.lookup_tracking_number(f'Which city did {TRACKING_NUMBER} leave from?') is None
+
+
+def test_lookup_answer_covers_the_lookup_vocabulary(tracking):
+    rows = [{'status': 'In Transit', 'eta': datetime.date(2026, 10, 20), 'weight': decimal.Decimal('2.50'),
+             'dimensions': '10x10x10',
+             'history': [{'location': 'Memphis, TN', 'timestamp': datetime.datetime(2026, 10, 17, 8, 30)}]}]
+    assert tracking.lookup_answer(TRACKING_NUMBER, rows) == (
+        f'Package {TRACKING_NUMBER} is In Transit, expected on 2026-10-20. It weighs 2.5 and measures 10x10x10. '
+        'It was last scanned in Memphis, TN at 2026-10-17 08:30:00.')
+    rows = [{'status': None, 'eta': None, 'weight': None, 'dimensions': None, 'history': []}]
+    assert tracking.lookup_answer(TRACKING_NUMBER, rows) == f'Package {TRACKING_NUMBER} is without a status.'
+    assert tracking.lookup_answer(TRACKING_NUMBER, []) == f'No package with tracking number {TRACKING_NUMBER} was found.'
+
+
+@pytest.mark.parametrize('variant', ['shipsense-openai', 'shipsense-llama-on-hf', 'shipsenseai-azure-native'])
+def test_lookup_response_shape(load_variant, variant):
+    app = load_variant(variant)
+    Package = app.Package.__table__
+    Package.metadata.create_all(app.engine)
+    with app.engine.begin() as connection:
+        connection.execute(insert(Package), [{'tracking_number': TRACKING_NUMBER, 'status': 'Delivered',
+                                              'weight': decimal.Decimal('1.25'), 'dimensions': '4x4x4'}])
+
+    response = app.app.test_client().post('/ask', json={'query': f'weight of {TRACKING_NUMBER}'})
+
+    body = response.get_json()
+    assert response.status_code == 200
+    assert body['answer'] == f'Package {TRACKING_NUMBER} is Delivered. It weighs 1.25 and measures 4x4x4.'
+    assert [row['tracking_number'] for row in body['rows']] == [TRACKING_NUMBER]
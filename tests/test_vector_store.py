@@ -0,0 +1,47 @@
+# The apps' view of the local index: a build published while they run is what the
+# next search reads, and before the first build searches find nothing.
+import os
+import sys
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'shipsense-openai'))
+
+from vector_store import LocalIndexReader, LocalIndexWriter  # noqa: E402
+
+DIMENSIONS = 8
+
+
+def vector(i):
+    return np.eye(DIMENSIONS, dtype=np.float32)[i]
+
+
+def test_search_before_first_build_finds_nothing(tmp_path):
+    reader = LocalIndexReader(str(tmp_path / 'local_index'))
+    assert reader.generation() == 0
+    assert reader.search(vector(0)) == []
+    assert len(reader) == 0
+
+
+def test_search_reads_the_newly_published_generation(tmp_path):
+    path = str(tmp_path / 'local_index')
+    writer = LocalIndexWriter(path)
+    writer.add('old', 'Automated Pickup weekly fee', 'guide_2023.pdf', 1, vector(0))
+    first = writer.save(dtype='float32')
+    reader = LocalIndexReader(path)
+    assert [chunk['id'] for chunk, _ in reader.search(vector(0), top_n=1)] == ['old']
+
+    writer = LocalIndexWriter(path)
+    writer.delete(['old'])
+    writer.add('new', 'Signature options fee', 'guide_2024.pdf', 3, vector(0))
+    second = writer.save(dtype='float32')
+    assert second == first + 1
+    # The files the reader mapped for the first build are gone by now
+    assert not any(name.startswith(f'vectors-{first}.') for name in os.listdir(path))
+
+    matches = reader.search(vector(0), top_n=5)
+    assert [chunk['id'] for chunk, _ in matches] == ['new']
+    assert matches[0][0]['content'] == 'Signature options fee'
+    assert matches[0][0]['pdf_filename'] == 'guide_2024.pdf'
+    assert reader.generation() == second